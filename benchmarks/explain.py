@@ -0,0 +1,112 @@
+"""
+EXPLAIN plans and timings for the hot circulation filters, with and
+without the indexes declared in the circulation models' Meta.indexes.
+"""
+import statistics
+import time
+
+from django.db import connection
+from django.utils import timezone
+
+from circulation.models import BookCopy, Loan, Reservation, Fee
+
+# Distinct keys looked up per measurement for the single-row filters
+SAMPLE_SIZE = 50
+
+
+def _sample(queryset, field):
+    return list(queryset.order_by('?').values_list(field, flat=True)[:SAMPLE_SIZE])
+
+
+def hot_queries():
+    """(name, [querysets]) for every filter the indexes target"""
+    today = timezone.now().date()
+    members = _sample(Loan.objects.filter(return_date__isnull=True), 'member_id')
+    books = _sample(BookCopy.objects.all(), 'book_id')
+    reservations = list(
+        Reservation.objects.order_by('?').values_list('member_id', 'book_id')[:SAMPLE_SIZE]
+    )
+    loans = _sample(Fee.objects.all(), 'loan_id')
+
+    return [
+        ('open_overdue_loans', [
+            Loan.objects.filter(return_date__isnull=True, due_date__lt=today).order_by().values_list('pk'),
+        ]),
+        ('member_open_loans', [
+            Loan.objects.filter(member_id=pk, return_date__isnull=True).order_by().values_list('pk')
+            for pk in members
+        ]),
+        ('available_copies', [
+            BookCopy.objects.filter(book_id=pk, status='AV').order_by().values_list('pk')
+            for pk in books
+        ]),
+        ('active_reservation', [
+            Reservation.objects.filter(member_id=member, book_id=book, status='AC').order_by().values_list('pk')
+            for member, book in reservations
+        ]),
+        ('outstanding_fees', [
+            Fee.objects.filter(loan_id=pk, status='OU').order_by().values_list('pk')
+            for pk in loans
+        ]),
+        ('loan_list_first_page', [
+            Loan.objects.order_by('-checkout_date', '-id').values_list('pk')[:21],
+        ]),
+    ]
+
+
+def indexes():
+    """(model, index) for every index declared on the circulation models"""
+    for model in (BookCopy, Loan, Reservation, Fee):
+        for index in model._meta.indexes:
+            yield model, index
+
+
+def drop_indexes():
+    with connection.schema_editor() as editor:
+        for model, index in indexes():
+            editor.remove_index(model, index)
+
+
+def create_indexes():
+    with connection.schema_editor() as editor:
+        for model, index in indexes():
+            editor.add_index(model, index)
+
+
+def analyze():
+    """Refresh planner statistics so both runs see the same data"""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def measure(querysets, repeat=3):
+    """Plan of the first queryset and median ms to run all of them"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for queryset in querysets:
+            list(queryset.all())
+        timings.append(time.perf_counter() - start)
+    plan = querysets[0].explain() if querysets else ''
+    return {'plan': plan, 'ms': round(statistics.median(timings) * 1000, 2)}
+
+
+def run(repeat=3, stdout=None):
+    """Measure every hot query without, then with, the indexes"""
+    queries = hot_queries()
+    results = {name: {} for name, _ in queries}
+
+    for label, prepare in (('before', drop_indexes), ('after', create_indexes)):
+        prepare()
+        analyze()
+        for name, querysets in queries:
+            results[name][label] = measure(querysets, repeat)
+
+    if stdout is not None:
+        for name, result in results.items():
+            before, after = result['before'], result['after']
+            stdout.write(f"{name}: {before['ms']} ms -> {after['ms']} ms")
+            for label, measured in (('before', before), ('after', after)):
+                plan = measured['plan'].replace('\n', '\n' + ' ' * 10)
+                stdout.write(f"  {label + ':':<8}{plan}")
+    return results
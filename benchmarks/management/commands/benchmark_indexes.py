@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from benchmarks import explain, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and show EXPLAIN plans and timings of the "
+        "hot circulation filters before and after the circulation indexes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            type=float,
+            default=0.01,
+            help="Dataset size relative to production (1.0 = 1M loans)",
+        )
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per query")
+        parser.add_argument('--output', help="Also write raw results as JSON to this path")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            counts = seed.seed(scale=options['scale'], stdout=self.stdout)
+            self.stdout.write(f"Seeded {counts['loans']} loans, {counts['copies']} copies, "
+                              f"{counts['members']} members")
+            results = explain.run(repeat=options['repeat'], stdout=self.stdout)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'scale': options['scale'], 'queries': results}, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Measured {len(results)} queries"))
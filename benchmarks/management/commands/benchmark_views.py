@@ -0,0 +1,67 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from benchmarks import runner, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database, time every circulation, inventory and "
+        "admin changelist view, and fail if any exceeds its baseline budget"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            type=float,
+            default=None,
+            help="Dataset size relative to production (1.0 = 1M loans); defaults to the baseline's scale",
+        )
+        parser.add_argument('--repeat', type=int, default=3, help="Requests per view")
+        parser.add_argument('--baseline', default=str(runner.BASELINE_PATH), help="Budget file")
+        parser.add_argument(
+            '--update-baseline',
+            action='store_true',
+            help="Write the measured values to the baseline instead of checking them",
+        )
+        parser.add_argument('--output', help="Also write raw results as JSON to this path")
+
+    def handle(self, *args, **options):
+        try:
+            baseline = runner.load_baseline(options['baseline'])
+        except FileNotFoundError:
+            if not options['update_baseline']:
+                raise CommandError(f"Baseline {options['baseline']} not found; run with --update-baseline")
+            baseline = {'scale': 0.01, 'views': {}}
+        scale = options['scale'] or baseline['scale']
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            counts = seed.seed(scale=scale, stdout=self.stdout)
+            self.stdout.write(f"Seeded {counts['loans']} loans, {counts['books']} books, "
+                              f"{counts['members']} members")
+            results = runner.run(repeat=options['repeat'], stdout=self.stdout)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'scale': scale, 'views': results}, f, indent=2)
+
+        if options['update_baseline']:
+            runner.write_baseline(results, scale, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['baseline']}"))
+            return
+
+        # Wall-time budgets only mean something at the scale they were recorded at
+        failures = runner.check(results, baseline, check_time=scale == baseline['scale'])
+        if failures:
+            for failure in failures:
+                self.stderr.write(failure)
+            raise CommandError(f"{len(failures)} view(s) over budget")
+        self.stdout.write(self.style.SUCCESS(f"All {len(results)} views within budget"))
@@ -0,0 +1,137 @@
+"""
+Measure query count and wall time for every circulation, inventory and
+admin changelist page, and compare them with the checked-in budgets.
+"""
+import json
+import statistics
+import time
+from pathlib import Path
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+
+from circulation import urls as circulation_urls
+from inventory import urls as inventory_urls
+from inventory.models import Shelf
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'baseline.json'
+
+# Values for URL arguments, looked up once the data is seeded
+URL_KWARGS = {
+    'inventory:shelf-detail': lambda: {'pk': Shelf.objects.order_by('pk').values_list('pk', flat=True)[0]},
+}
+
+# Views that only accept POST and so have no page to measure
+SKIPPED = {'inventory:shelf-audit'}
+
+# Extra requests for views whose cost depends on the query string
+EXTRA_QUERIES = {
+    'circulation:loan_list': ['?search=Shadow', '?status=overdue'],
+    'circulation:member_list': ['?search=Maria'],
+    'circulation:reservation_list': ['?status=active'],
+    'inventory:item-list': ['?search=River'],
+    'circulation:loan_export': ['?from_date=2000-01-01&format=jsonl'],
+}
+
+
+# Wall-time budget = measured * TIME_FACTOR + TIME_SLACK_MS; timings on a
+# shared machine vary far more than query counts
+TIME_FACTOR = 3
+TIME_SLACK_MS = 50
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def targets():
+    """(name, url) for every view to measure, in a stable order"""
+    for module in (circulation_urls, inventory_urls):
+        for pattern in module.urlpatterns:
+            if not isinstance(pattern, URLPattern) or not pattern.name:
+                continue
+            name = f'{module.app_name}:{pattern.name}'
+            if name in SKIPPED:
+                continue
+            if pattern.pattern.converters and name not in URL_KWARGS:
+                raise BenchmarkError(f"No URL arguments configured for {name}")
+            kwargs = URL_KWARGS[name]() if name in URL_KWARGS else None
+            url = reverse(name, kwargs=kwargs)
+            yield name, url
+            for query in EXTRA_QUERIES.get(name, ()):
+                yield f'{name}{query}', url + query
+
+    for model in sorted(admin.site._registry, key=lambda m: m._meta.label):
+        opts = model._meta
+        name = f'admin:{opts.app_label}_{opts.model_name}_changelist'
+        yield name, reverse(name)
+
+
+def measure(client, url, repeat=3):
+    """Query count of the last request and median wall time in ms"""
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                # Exports run their queries while the body is consumed
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise BenchmarkError(f"{url} returned {response.status_code}")
+        timings.append(elapsed)
+        queries = len(captured)
+    return {'queries': queries, 'ms': round(statistics.median(timings) * 1000, 1)}
+
+
+def run(repeat=3, stdout=None):
+    """Measure every target as a superuser and return {name: result}"""
+    user, _ = User.objects.get_or_create(
+        username='benchmark-admin', defaults={'is_staff': True, 'is_superuser': True}
+    )
+    client = Client()
+    client.force_login(user)
+
+    results = {}
+    for name, url in targets():
+        results[name] = measure(client, url, repeat)
+        if stdout is not None:
+            stdout.write(f"{name:<60} {results[name]['queries']:>4} queries {results[name]['ms']:>9.1f} ms")
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_baseline(results, scale, path=BASELINE_PATH):
+    """Store the measured query counts as budgets, with headroom on wall time"""
+    budgets = {
+        name: {'queries': result['queries'], 'ms': round(result['ms'] * TIME_FACTOR + TIME_SLACK_MS)}
+        for name, result in sorted(results.items())
+    }
+    with open(path, 'w') as f:
+        json.dump({'scale': scale, 'views': budgets}, f, indent=2)
+        f.write('\n')
+
+
+def check(results, baseline, check_time=True):
+    """Return a message for every view over its budget or missing from the baseline"""
+    failures = []
+    for name, result in results.items():
+        budget = baseline['views'].get(name)
+        if budget is None:
+            failures.append(f"{name}: no budget in baseline")
+            continue
+        if result['queries'] > budget['queries']:
+            failures.append(f"{name}: {result['queries']} queries (budget {budget['queries']})")
+        if check_time and result['ms'] > budget['ms']:
+            failures.append(f"{name}: {result['ms']} ms (budget {budget['ms']} ms)")
+    return failures
@@ -0,0 +1,200 @@
+"""
+Synthetic catalog, membership and circulation data for the view benchmarks.
+
+``scale=1`` produces the production-sized dataset (100k books, 300k copies,
+1M loans, 50k members); smaller scales shrink every table proportionally.
+Rows are written with bulk_create, so the denormalized counters, search
+index and rollups are rebuilt once at the end.
+"""
+import random
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from circulation import stats
+from circulation.models import Member, BookCopy, Loan, Reservation, Fee
+from inventory import stock
+from inventory.models import Shelf, InventoryItem, Acquisition
+from library.models import Author, Book, Category
+from search import index
+
+FULL_SCALE = {
+    'books': 100_000,
+    'copies': 300_000,
+    'loans': 1_000_000,
+    'members': 50_000,
+}
+
+WORDS = (
+    'Shadow', 'River', 'Garden', 'Winter', 'Silent', 'Empire', 'Glass', 'Harbor',
+    'Memory', 'Stone', 'Summer', 'Atlas', 'Night', 'Orchard', 'Ember', 'Tide',
+)
+NAMES = (
+    'Ana', 'Luis', 'Maria', 'Jorge', 'Lucia', 'Pedro', 'Sofia', 'Diego',
+    'Elena', 'Carlos', 'Rosa', 'Pablo', 'Irene', 'Tomas', 'Clara', 'Hugo',
+)
+
+BATCH_SIZE = 5000
+LOAN_CHUNK = 20_000
+
+
+def sizes(scale):
+    """Row counts for every seeded table at a given scale"""
+    counts = {name: max(int(full * scale), 1) for name, full in FULL_SCALE.items()}
+    counts['authors'] = max(counts['books'] // 5, 1)
+    counts['categories'] = 50
+    counts['shelves'] = max(counts['books'] // 200, 1)
+    counts['reservations'] = max(counts['members'] // 2, 1)
+    counts['acquisitions'] = max(counts['books'] // 10, 1)
+    return counts
+
+
+def _log(stdout, message):
+    if stdout is not None:
+        stdout.write(message)
+
+
+def seed(scale=0.01, random_seed=42, stdout=None):
+    """Populate the current database and return the row counts used"""
+    rng = random.Random(random_seed)
+    counts = sizes(scale)
+    today = timezone.now().date()
+    day = timezone.timedelta(days=1)
+
+    with transaction.atomic():
+        _log(stdout, f"Seeding catalog: {counts['books']} books")
+        categories = Category.objects.bulk_create(
+            Category(name=f"{WORDS[i % len(WORDS)]} Studies {i}", slug=f"category-{i}")
+            for i in range(counts['categories'])
+        )
+        author_ids = [a.pk for a in Author.objects.bulk_create(
+            (Author(name=f"{rng.choice(NAMES)} {rng.choice(WORDS)}son {i}")
+             for i in range(counts['authors'])),
+            batch_size=BATCH_SIZE,
+        )]
+        book_ids = [b.pk for b in Book.objects.bulk_create(
+            (Book(
+                title=f"The {rng.choice(WORDS)} of {rng.choice(WORDS)} {i}",
+                slug=f"book-{i}",
+                isbn=f"{9780000000000 + i}",
+                author_id=rng.choice(author_ids),
+                publication_date=today - day * rng.randint(0, 20000),
+            ) for i in range(counts['books'])),
+            batch_size=BATCH_SIZE,
+        )]
+        Book.categories.through.objects.bulk_create(
+            (Book.categories.through(book_id=book_id, category_id=category.pk)
+             for book_id in book_ids
+             for category in rng.sample(categories, rng.randint(1, 2))),
+            batch_size=BATCH_SIZE,
+        )
+
+        _log(stdout, f"Seeding members: {counts['members']}")
+        users = User.objects.bulk_create(
+            (User(username=f"member{i}", password='!', first_name=rng.choice(NAMES),
+                  last_name=f"{rng.choice(WORDS)}ez", email=f"member{i}@example.com")
+             for i in range(counts['members'])),
+            batch_size=BATCH_SIZE,
+        )
+        member_ids = [m.pk for m in Member.objects.bulk_create(
+            (Member(user_id=user.pk, membership_type=rng.choice(('STD', 'PRE', 'STU', 'SEN')),
+                    membership_date=today - day * rng.randint(0, 2000))
+             for user in users),
+            batch_size=BATCH_SIZE,
+        )]
+
+        _log(stdout, f"Seeding shelves: {counts['shelves']}")
+        shelf_ids = [s.pk for s in Shelf.objects.bulk_create(
+            Shelf(name=f"Shelf {i}", location=f"Floor {i % 4}", capacity=500)
+            for i in range(counts['shelves'])
+        )]
+
+        _log(stdout, f"Seeding copies: {counts['copies']}")
+        copy_ids = [c.pk for c in BookCopy.objects.bulk_create(
+            (BookCopy(book_id=rng.choice(book_ids), reference_number=f"C{i:07d}",
+                      shelf_id=shelf_ids[i % len(shelf_ids)])
+             for i in range(counts['copies'])),
+            batch_size=BATCH_SIZE,
+        )]
+
+        _log(stdout, f"Seeding loans: {counts['loans']}")
+        _seed_loans(rng, counts['loans'], member_ids, copy_ids, today)
+
+        _log(stdout, f"Seeding reservations: {counts['reservations']}")
+        Reservation.objects.bulk_create(
+            (Reservation(member_id=rng.choice(member_ids), book_id=rng.choice(book_ids),
+                         reservation_date=today - day * rng.randint(0, 60),
+                         expiry_date=today + day * rng.randint(-30, 14),
+                         status=rng.choice(('AC', 'AC', 'FU', 'CA', 'EX')))
+             for _ in range(counts['reservations'])),
+            batch_size=BATCH_SIZE,
+        )
+
+        _log(stdout, "Seeding inventory")
+        InventoryItem.objects.bulk_create(
+            (InventoryItem(book_id=book_id, shelf_id=rng.choice(shelf_ids),
+                           quantity=rng.randint(0, 5), minimum_quantity=1)
+             for book_id in book_ids),
+            batch_size=BATCH_SIZE,
+        )
+        Shelf.objects.refresh_used_space()
+        stock.open_balances()
+        Acquisition.objects.bulk_create(
+            (Acquisition(book_id=rng.choice(book_ids), quantity=rng.randint(1, 10),
+                         acquisition_type=rng.choice(('PURCHASE', 'DONATION', 'EXCHANGE')))
+             for _ in range(counts['acquisitions'])),
+            batch_size=BATCH_SIZE,
+        )
+
+        _log(stdout, "Rebuilding counters, search index and rollups")
+        # call_command prints to sys.stdout when given None
+        output = stdout if stdout is not None else StringIO()
+        call_command('rebuild_loan_counters', stdout=output)
+        call_command('rebuild_book_counts', stdout=output)
+        if index.is_available():
+            call_command('rebuild_search_index', stdout=output)
+        stats.refresh(full=True, today=today)
+
+    return counts
+
+
+def _seed_loans(rng, total, member_ids, copy_ids, today):
+    """
+    Write loans in chunks. About 5% are still open, each on its own copy;
+    those checked out more than two weeks ago are overdue. The rest are
+    returned, and late returns carry a fee.
+    """
+    day = timezone.timedelta(days=1)
+    open_count = min(max(total // 20, 1), len(copy_ids))
+    open_copies = rng.sample(copy_ids, open_count)
+
+    written = 0
+    while written < total:
+        chunk = min(LOAN_CHUNK, total - written)
+        loans = []
+        for i in range(written, written + chunk):
+            if i < open_count:
+                checkout = today - day * rng.randint(0, 40)
+                loans.append(Loan(member_id=rng.choice(member_ids), book_copy_id=open_copies[i],
+                                  checkout_date=checkout, due_date=checkout + day * 14,
+                                  status='AC'))
+            else:
+                checkout = today - day * rng.randint(41, 730)
+                returned = checkout + day * rng.randint(1, 20)
+                loans.append(Loan(member_id=rng.choice(member_ids), book_copy_id=rng.choice(copy_ids),
+                                  checkout_date=checkout, due_date=checkout + day * 14,
+                                  return_date=returned, status='RE'))
+        Loan.objects.bulk_create(loans, batch_size=BATCH_SIZE)
+        Fee.objects.bulk_create(
+            (Fee(loan_id=loan.pk, amount=(loan.return_date - loan.due_date).days * Loan.LATE_FEE_PER_DAY,
+                 date_assessed=loan.return_date, status=rng.choice(('OU', 'PA', 'PA', 'WA')))
+             for loan in loans if loan.return_date and loan.return_date > loan.due_date),
+            batch_size=BATCH_SIZE,
+        )
+        written += chunk
+
+    for start in range(0, len(open_copies), BATCH_SIZE):
+        BookCopy.objects.filter(pk__in=open_copies[start:start + BATCH_SIZE]).update(status='LO')
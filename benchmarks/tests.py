@@ -0,0 +1,33 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase
+from . import runner, seed
+
+
+class ViewQueryBudgetTest(TestCase):
+    """Test every view stays within its checked-in query budget"""
+
+    def measure(self, scale):
+        """Seed at scale, measure every view, and roll the data back"""
+        with transaction.atomic():
+            seed.seed(scale=scale)
+            results = runner.run(repeat=1)
+            transaction.set_rollback(True)
+        cache.clear()
+        return results
+
+    def test_views_within_query_budget(self):
+        """Test query counts on a small seeded dataset against baseline.json"""
+        results = self.measure(0.001)
+        failures = runner.check(results, runner.load_baseline(), check_time=False)
+        self.assertEqual(failures, [])
+
+    def test_query_counts_do_not_grow_with_data(self):
+        """Test doubling the dataset leaves every view's query count unchanged"""
+        small = self.measure(0.001)
+        large = self.measure(0.002)
+        grown = {
+            name: (small[name]['queries'], result['queries'])
+            for name, result in large.items() if result['queries'] != small[name]['queries']
+        }
+        self.assertEqual(grown, {})
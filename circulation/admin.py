@@ -1,8 +1,23 @@
-from django.contrib import admin
+from decimal import Decimal
+
+from django.contrib import admin, messages
+from django.core.exceptions import ValidationError
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils.html import format_html
+from search.mixins import FullTextSearchMixin
 from django.urls import reverse
 from django.utils import timezone
 from .models import Member, BookCopy, Loan, Reservation, Fee
+from . import services
+
+
+def outstanding_fees_subquery(**lookup):
+    """Correlated SUM of outstanding fee amounts, evaluated only for displayed rows"""
+    fees = Fee.objects.filter(status='OU', **lookup).order_by().values('status').annotate(
+        total=Sum('amount')
+    ).values('total')
+    return Coalesce(Subquery(fees), Value(Decimal('0')), output_field=DecimalField())
 
 
 class FeeInline(admin.TabularInline):
@@ -14,12 +29,14 @@ class FeeInline(admin.TabularInline):
 
 
 @admin.register(Member)
-class MemberAdmin(admin.ModelAdmin):
+class MemberAdmin(FullTextSearchMixin, admin.ModelAdmin):
     """Admin configuration for members"""
     list_display = ('full_name', 'email', 'membership_type', 'membership_date', 
-                    'membership_status', 'active_loans', 'total_fees')
+                    'membership_status', 'open_loans_link', 'total_fees')
     list_filter = ('is_active', 'membership_type', 'membership_date')
     search_fields = ('user__username', 'user__first_name', 'user__last_name', 'user__email')
+    search_member_path = 'pk'
+    list_select_related = ('user',)
     date_hierarchy = 'membership_date'
     
     fieldsets = (
@@ -44,42 +61,42 @@ class MemberAdmin(admin.ModelAdmin):
             return format_html('<span style="color: orange;">Expired</span>')
     membership_status.short_description = "Status"
     
-    def active_loans(self, obj):
+    def get_queryset(self, request):
+        """Annotate outstanding fees so the changelist needs no per-row queries"""
+        return super().get_queryset(request).annotate(
+            outstanding_fees=outstanding_fees_subquery(loan__member=OuterRef('pk'))
+        )
+    
+    def open_loans_link(self, obj):
         """Display active loans with link to filtered loan list"""
-        count = obj.active_loans_count
-        url = reverse('admin:circulation_loan_changelist') + f'?member__id__exact={obj.id}&status__exact=AC'
+        count = obj.active_loans
+        url = reverse('admin:circulation_loan_changelist') + f'?member__id__exact={obj.id}&return_date__isnull=True'
         return format_html('<a href="{}">{}</a>', url, count)
-    active_loans.short_description = "Active Loans"
+    open_loans_link.short_description = "Active Loans"
+    open_loans_link.admin_order_field = 'active_loans'
     
     def total_fees(self, obj):
         """Display total outstanding fees"""
-        total = Fee.objects.filter(
-            loan__member=obj, 
-            status='OU'
-        ).values_list('amount', flat=True)
-        
-        if not total:
-            return "$0.00"
-            
-        total_sum = sum(total)
-        return f"${total_sum:.2f}"
+        return f"${obj.outstanding_fees:.2f}"
     total_fees.short_description = "Outstanding Fees"
+    total_fees.admin_order_field = 'outstanding_fees'
 
 
 @admin.register(BookCopy)
 class BookCopyAdmin(admin.ModelAdmin):
     """Admin configuration for book copies"""
-    list_display = ('reference_number', 'book_title', 'author', 'status', 'shelf_location')
-    list_filter = ('status', 'acquisition_date')
+    list_display = ('reference_number', 'book_title', 'author', 'status', 'shelf')
+    list_filter = ('status', 'acquisition_date', 'shelf')
+    list_select_related = ('book__author', 'shelf')
     search_fields = ('reference_number', 'book__title', 'book__author__name')
-    autocomplete_fields = ['book']
+    autocomplete_fields = ['book', 'shelf']
     
     fieldsets = (
         ('Book Information', {
             'fields': ('book', 'reference_number')
         }),
         ('Status', {
-            'fields': ('status', 'shelf_location')
+            'fields': ('status', 'shelf', 'shelf_location')
         }),
         ('Acquisition Details', {
             'fields': ('acquisition_date', 'price')
@@ -111,13 +128,16 @@ class ReservationInline(admin.TabularInline):
     
 
 @admin.register(Loan)
-class LoanAdmin(admin.ModelAdmin):
+class LoanAdmin(FullTextSearchMixin, admin.ModelAdmin):
     """Admin configuration for loans"""
     list_display = ('id', 'book_title', 'member_name', 'checkout_date', 
                    'due_date', 'status', 'is_overdue_indicator', 'total_fees')
     list_filter = ('status', 'checkout_date', 'due_date')
     search_fields = ('book_copy__book__title', 'member__user__username', 
                    'member__user__first_name', 'member__user__last_name')
+    search_book_path = 'book_copy__book'
+    search_member_path = 'member'
+    list_select_related = ('member__user', 'book_copy__book')
     date_hierarchy = 'checkout_date'
     autocomplete_fields = ['member', 'book_copy']
     inlines = [FeeInline]
@@ -138,16 +158,24 @@ class LoanAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        """Annotate outstanding fees so the changelist needs no per-row queries"""
+        return super().get_queryset(request).annotate(
+            outstanding_fees=outstanding_fees_subquery(loan=OuterRef('pk'))
+        )
+    
     def book_title(self, obj):
         """Display book title"""
         return obj.book_copy.book.title
     book_title.short_description = "Book"
+    book_title.admin_order_field = 'book_copy__book__title'
     
     def member_name(self, obj):
         """Display member name with link"""
-        url = reverse('admin:circulation_member_change', args=[obj.member.id])
+        url = reverse('admin:circulation_member_change', args=[obj.member_id])
         return format_html('<a href="{}">{}</a>', url, obj.member)
     member_name.short_description = "Member"
+    member_name.admin_order_field = 'member__user__last_name'
     
     def is_overdue_indicator(self, obj):
         """Display overdue status with color indicator"""
@@ -163,11 +191,9 @@ class LoanAdmin(admin.ModelAdmin):
     
     def total_fees(self, obj):
         """Display total fees for loan"""
-        total = sum(fee.amount for fee in obj.fees.all() if fee.status == 'OU')
-        if total > 0:
-            return f"${total:.2f}"
-        return "$0.00"
+        return f"${obj.outstanding_fees:.2f}"
     total_fees.short_description = "Fees"
+    total_fees.admin_order_field = 'outstanding_fees'
     
     def save_model(self, request, obj, form, change):
         """Custom save logic for loans"""
@@ -180,13 +206,16 @@ class LoanAdmin(admin.ModelAdmin):
 
 
 @admin.register(Reservation)
-class ReservationAdmin(admin.ModelAdmin):
+class ReservationAdmin(FullTextSearchMixin, admin.ModelAdmin):
     """Admin configuration for reservations"""
     list_display = ('id', 'book_title', 'member_name', 'reservation_date', 
                    'expiry_date', 'status', 'days_left')
     list_filter = ('status', 'reservation_date', 'expiry_date')
     search_fields = ('book__title', 'member__user__username', 'member__user__first_name', 
                      'member__user__last_name')
+    search_book_path = 'book'
+    search_member_path = 'member'
+    list_select_related = ('book', 'member__user')
     date_hierarchy = 'reservation_date'
     autocomplete_fields = ['member', 'book']
     
@@ -217,35 +246,53 @@ class ReservationAdmin(admin.ModelAdmin):
     
     def fulfill_reservations(self, request, queryset):
         """Action to fulfill selected reservations"""
+        active = queryset.filter(status='AC')
+        
+        # Hold available copies for the queue, then lend the held copies
+        services.allocate_pending(book_ids=active.values('book'))
+        
         fulfilled = 0
-        for reservation in queryset.filter(status='AC'):
-            # Find available copy
-            copies = BookCopy.objects.filter(book=reservation.book, status='AV').first()
-            if copies:
-                try:
-                    reservation.fulfill(copies)
-                    fulfilled += 1
-                except Exception:
-                    pass
+        errors = []
+        for reservation in active.filter(allocated_copy__isnull=False).select_related('member', 'allocated_copy'):
+            try:
+                reservation.fulfill()
+                fulfilled += 1
+            except ValidationError as e:
+                errors.append(f"#{reservation.id}: {' '.join(e.messages)}")
         
         self.message_user(request, f"Successfully fulfilled {fulfilled} reservations.")
+        if errors:
+            self.message_user(request, "Could not fulfill " + "; ".join(errors), level=messages.WARNING)
     fulfill_reservations.short_description = "Fulfill selected reservations"
     
     def cancel_reservations(self, request, queryset):
         """Action to cancel selected reservations"""
-        cancelled = queryset.filter(status='AC').update(status='CA')
+        active = queryset.filter(status='AC')
+        held_copies = list(active.filter(allocated_copy__isnull=False).values_list('allocated_copy', flat=True))
+        cancelled = active.update(status='CA', allocated_copy=None)
+        
+        # Pass any held copies on to the next reservations in their queues
+        if held_copies:
+            released = BookCopy.objects.filter(pk__in=held_copies, status='RE')
+            book_ids = list(released.values_list('book', flat=True))
+            released.update(status='AV')
+            services.allocate_pending(book_ids=book_ids)
+        
         self.message_user(request, f"Successfully cancelled {cancelled} reservations.")
     cancel_reservations.short_description = "Cancel selected reservations"
 
 
 @admin.register(Fee)
-class FeeAdmin(admin.ModelAdmin):
+class FeeAdmin(FullTextSearchMixin, admin.ModelAdmin):
     """Admin configuration for fees"""
     list_display = ('id', 'loan_details', 'fee_type', 'amount', 'date_assessed', 
                    'status', 'date_paid')
     list_filter = ('fee_type', 'status', 'date_assessed', 'date_paid')
     search_fields = ('loan__book_copy__book__title', 'loan__member__user__username', 
                    'loan__member__user__first_name', 'loan__member__user__last_name')
+    search_book_path = 'loan__book_copy__book'
+    search_member_path = 'loan__member'
+    list_select_related = ('loan__book_copy__book', 'loan__member__user')
     date_hierarchy = 'date_assessed'
     
     actions = ['mark_as_paid', 'waive_fees']
@@ -0,0 +1,89 @@
+import re
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+
+from circulation.models import BookCopy
+from inventory.models import Shelf
+
+
+def normalize(text):
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+
+class Command(BaseCommand):
+    help = (
+        "Link book copies to inventory shelves by matching BookCopy.shelf_location "
+        "against each shelf's name, or its \"name (location)\" label"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10000,
+            help="Number of copy ids handled per transaction",
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Report what would be linked without writing",
+        )
+
+    def shelf_lookup(self):
+        """
+        Normalized label -> shelf id, leaving out labels shared by several
+        shelves, plus each shelf's own label for BookCopy.shelf_location
+        """
+        labels = defaultdict(set)
+        own_labels = {}
+        for shelf in Shelf.objects.all():
+            labels[normalize(shelf.name)].add(shelf.pk)
+            labels[normalize(str(shelf))].add(shelf.pk)
+            own_labels[shelf.pk] = str(shelf)[:50]
+        ambiguous = sorted(label for label, pks in labels.items() if len(pks) > 1)
+        return {label: pks.pop() for label, pks in labels.items() if len(pks) == 1}, own_labels, ambiguous
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        lookup, own_labels, ambiguous = self.shelf_lookup()
+        pending = BookCopy.objects.filter(shelf__isnull=True).exclude(shelf_location='')
+        bounds = pending.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            self.stdout.write("No copies left to link")
+            return
+
+        linked = 0
+        unmatched = Counter()
+        for start in range(bounds['low'], bounds['high'] + 1, chunk_size):
+            window = pending.filter(pk__gte=start, pk__lt=start + chunk_size)
+            by_shelf = defaultdict(list)
+            for pk, location in window.values_list('pk', 'shelf_location'):
+                shelf_id = lookup.get(normalize(location))
+                if shelf_id is None:
+                    unmatched[location] += 1
+                else:
+                    by_shelf[shelf_id].append(pk)
+            if options['dry_run']:
+                linked += sum(len(pks) for pks in by_shelf.values())
+                continue
+            with transaction.atomic():
+                # One UPDATE per shelf present in the chunk; the text becomes the shelf's label
+                for shelf_id, pks in by_shelf.items():
+                    linked += BookCopy.objects.filter(pk__in=pks, shelf__isnull=True).update(
+                        shelf_id=shelf_id, shelf_location=own_labels[shelf_id],
+                    )
+
+        for label in ambiguous:
+            self.stderr.write(f"Ambiguous shelf label {label!r}: several shelves share it")
+        for location, count in unmatched.most_common():
+            self.stderr.write(f"No shelf matches {location!r} ({count} copies)")
+        verb = "Would link" if options['dry_run'] else "Linked"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {linked} copies to shelves; {sum(unmatched.values())} left unmatched"
+        ))
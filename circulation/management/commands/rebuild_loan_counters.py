@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from circulation.models import Member, Loan
+
+
+class Command(BaseCommand):
+    help = "Rebuild or verify Member.active_loans against the open Loan rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Only report members whose counter is out of step; exit non-zero if any",
+        )
+
+    def handle(self, *args, **options):
+        open_loans = Loan.objects.filter(
+            member=OuterRef('pk'), return_date__isnull=True
+        ).order_by().values('member').annotate(n=Count('pk')).values('n')
+        actual = Coalesce(Subquery(open_loans, output_field=IntegerField()), 0)
+
+        drifted = Member.objects.annotate(actual_loans=actual).exclude(
+            active_loans=F('actual_loans')
+        )
+
+        if options['check']:
+            rows = list(drifted.values_list('pk', 'active_loans', 'actual_loans'))
+            for pk, stored, real in rows:
+                self.stdout.write(f"Member {pk}: stored {stored}, actual {real}")
+            if rows:
+                raise CommandError(f"{len(rows)} member counter(s) out of step")
+            self.stdout.write(self.style.SUCCESS("All member loan counters are consistent"))
+            return
+
+        with transaction.atomic():
+            updated = drifted.count()
+            Member.objects.update(active_loans=actual)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt loan counters ({updated} corrected)"))
@@ -0,0 +1,31 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from circulation import stats
+
+
+class Command(BaseCommand):
+    help = "Refresh the daily circulation rollups used by the report views"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help="Rebuild every rollup from scratch instead of only the days that may have changed",
+        )
+        parser.add_argument(
+            '--date',
+            help="Compute overdue counts as of this date (YYYY-MM-DD); defaults to today",
+        )
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError("--date must be in YYYY-MM-DD format")
+
+        days = stats.refresh(full=options['full'], today=today)
+        self.stdout.write(self.style.SUCCESS(f"Refreshed circulation rollups for {days} days"))
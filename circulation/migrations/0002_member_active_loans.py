@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-16 23:04
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_active_loans(apps, schema_editor):
+    Member = apps.get_model('circulation', 'Member')
+    Loan = apps.get_model('circulation', 'Loan')
+    open_loans = Loan.objects.filter(
+        member=OuterRef('pk'), return_date__isnull=True
+    ).order_by().values('member').annotate(n=Count('pk')).values('n')
+    Member.objects.update(
+        active_loans=Coalesce(Subquery(open_loans, output_field=IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circulation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='active_loans',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_active_loans, migrations.RunPython.noop),
+    ]
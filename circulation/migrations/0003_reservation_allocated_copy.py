@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-16 23:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circulation', '0002_member_active_loans'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='reservation',
+            options={'ordering': ['reservation_date', 'id']},
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='allocated_copy',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='held_reservations', to='circulation.bookcopy'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2 on 2026-10-16 23:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circulation', '0003_reservation_allocated_copy'),
+        ('library', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyLoanStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('returned', models.PositiveIntegerField(default=0)),
+                ('open_loans', models.PositiveIntegerField(default=0)),
+                ('overdue', models.PositiveIntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily loan stats',
+                'ordering': ['day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MemberLoanStats',
+            fields=[
+                ('member', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='loan_stats', serialize=False, to='circulation.member')),
+                ('loans', models.PositiveIntegerField(db_index=True, default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Member loan stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyFeeStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('OU', 'Outstanding'), ('PA', 'Paid'), ('WA', 'Waived')], max_length=2)),
+                ('fees', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily fee stats',
+                'ordering': ['day'],
+                'unique_together': {('day', 'status')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyCategoryLoans',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_loans', to='library.category')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily category loans',
+                'ordering': ['day'],
+                'unique_together': {('day', 'category')},
+            },
+        ),
+    ]
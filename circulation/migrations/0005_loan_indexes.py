@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-16 23:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circulation', '0004_circulation_rollups'),
+        ('library', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookcopy',
+            index=models.Index(condition=models.Q(('status', 'AV')), fields=['book'], name='bookcopy_available_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fee',
+            index=models.Index(condition=models.Q(('status', 'OU')), fields=['loan'], name='fee_outstanding_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('return_date__isnull', True)), fields=['due_date'], name='loan_open_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('return_date__isnull', True)), fields=['member'], name='loan_member_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['-checkout_date', '-id'], name='loan_checkout_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('status', 'AC')), fields=['member', 'book'], name='reservation_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('status', 'AC')), fields=['book', 'reservation_date', 'id'], name='reservation_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-16 23:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circulation', '0005_loan_indexes'),
+        ('inventory', '0004_inventoryaudit'),
+        ('library', '0002_book_count_columns'),
+    ]
+
+    # Existing copies are linked in chunks by `manage.py backfill_copy_shelves`
+    # rather than here, so the migration stays short on large tables
+    operations = [
+        migrations.AddField(
+            model_name='bookcopy',
+            name='shelf',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='copies', to='inventory.shelf'),
+        ),
+        migrations.AddIndex(
+            model_name='bookcopy',
+            index=models.Index(condition=models.Q(('status', 'AV')), fields=['shelf'], name='bookcopy_shelf_available_idx'),
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, Value, When
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.exceptions import ValidationError
@@ -25,8 +28,20 @@ class Member(models.Model):
         default='STD'
     )
     
+    # Maximum simultaneous loans per membership type
+    BORROWING_LIMITS = {
+        'STD': 3,
+        'PRE': 5,
+        'STU': 2,
+        'SEN': 4,
+    }
+    DEFAULT_BORROWING_LIMIT = 3
+    
     is_active = models.BooleanField(default=True)
     
+    # Denormalized count of open loans, kept current by Loan.save()/delete()
+    active_loans = models.PositiveIntegerField(default=0, editable=False)
+    
     def __str__(self):
         return f"{self.user.get_full_name() or self.user.username}"
     
@@ -46,7 +61,11 @@ class Member(models.Model):
     
     @property
     def active_loans_count(self):
-        return self.loans.filter(return_date__isnull=True).count()
+        return self.active_loans
+    
+    @property
+    def borrowing_limit(self):
+        return self.BORROWING_LIMITS.get(self.membership_type, self.DEFAULT_BORROWING_LIMIT)
     
     def can_borrow(self):
         """Check if member can borrow more books"""
@@ -57,14 +76,15 @@ class Member(models.Model):
             return False
         
         # Check borrowing limits based on membership type
-        limit = {
-            'STD': 3,
-            'PRE': 5,
-            'STU': 2,
-            'SEN': 4,
-        }.get(self.membership_type, 3)
-        
-        return self.active_loans_count < limit
+        return self.active_loans < self.borrowing_limit
+
+
+class BookCopyQuerySet(models.QuerySet):
+    def delete(self):
+        """Delete the copies, releasing the borrowing slots of their open loans first"""
+        with transaction.atomic():
+            Loan.objects.filter(book_copy__in=self).release_members()
+            return super().delete()
 
 
 class BookCopy(models.Model):
@@ -84,32 +104,101 @@ class BookCopy(models.Model):
         ('WD', 'Withdrawn'),
     )
     status = models.CharField(max_length=2, choices=STATUS_CHOICES, default='AV')
+    shelf = models.ForeignKey(
+        'inventory.Shelf', on_delete=models.SET_NULL, null=True, blank=True, related_name='copies'
+    )
+    # Label of shelf, kept in step by save(). Copies without a shelf keep the
+    # free text from before shelves were linked; backfill_copy_shelves
+    # resolves it into shelf
     shelf_location = models.CharField(max_length=50, blank=True)
     notes = models.TextField(blank=True)
     
+    objects = BookCopyQuerySet.as_manager()
+    
     class Meta:
         verbose_name_plural = "Book copies"
+        indexes = [
+            # Available copies of a book (checkout, allocation)
+            models.Index(fields=['book'], condition=Q(status='AV'), name='bookcopy_available_idx'),
+            # Available copies on a shelf
+            models.Index(fields=['shelf'], condition=Q(status='AV'), name='bookcopy_shelf_available_idx'),
+        ]
     
     def __str__(self):
         return f"{self.book.title} ({self.reference_number})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored shelf so shelf_location is only rederived on a move
+        instance._loaded_shelf_id = instance.__dict__.get('shelf_id')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        # The shelf is the source of truth; shelf_location mirrors its label
+        if self.shelf_id is not None and self.shelf_id != getattr(self, '_loaded_shelf_id', None):
+            self.shelf_location = str(self.shelf)[:50]
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'shelf' in update_fields:
+                kwargs['update_fields'] = {*update_fields, 'shelf_location'}
+        super().save(*args, **kwargs)
+        self._loaded_shelf_id = self.shelf_id
+    
     @property
     def is_available(self):
         return self.status == 'AV'
     
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            Loan.objects.filter(book_copy=self).release_members()
+            return super().delete(*args, **kwargs)
+    
     def mark_as_loaned(self):
         self.status = 'LO'
         self.save()
     
     def mark_as_available(self):
-        self.status = 'AV'
-        self.save()
+        from .services import allocate_copy
+        
+        with transaction.atomic():
+            self.status = 'AV'
+            self.save()
+            
+            # Hand the copy to the oldest waiting reservation, if any
+            allocate_copy(self)
     
     def mark_as_reserved(self):
         self.status = 'RE'
         self.save()
 
 
+class LoanQuerySet(models.QuerySet):
+    def release_members(self):
+        """
+        Lower Member.active_loans for the open loans in this queryset.
+
+        One UPDATE covers every member, however many loans there are. Run
+        it before the loans are deleted: deletes through the ORM go through
+        LoanQuerySet.delete(), Loan.delete() and BookCopy's equivalents,
+        and cascades from Book through circulation.signals.
+        """
+        released = dict(
+            self.filter(return_date__isnull=True).order_by().values('member').annotate(
+                open_loans=Count('pk')
+            ).values_list('member', 'open_loans')
+        )
+        if released:
+            Member.objects.filter(pk__in=list(released)).update(active_loans=F('active_loans') - Case(
+                *[When(pk=pk, then=Value(count)) for pk, count in released.items()],
+                default=Value(0), output_field=IntegerField(),
+            ))
+    
+    def delete(self):
+        with transaction.atomic():
+            self.release_members()
+            return super().delete()
+
+
 class Loan(models.Model):
     """Record of a book being borrowed"""
     member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='loans')
@@ -127,15 +216,35 @@ class Loan(models.Model):
     )
     status = models.CharField(max_length=2, choices=LOAN_STATUS_CHOICES, default='AC')
     
+    # Late fee charged per day past the due date
+    LATE_FEE_PER_DAY = Decimal('0.50')
+    
     renewed_count = models.PositiveSmallIntegerField(default=0)
     notes = models.TextField(blank=True)
     
+    objects = LoanQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-checkout_date']
+        indexes = [
+            # Open loans past their due date (overdue list, sweep_overdue)
+            models.Index(fields=['due_date'], condition=Q(return_date__isnull=True), name='loan_open_due_idx'),
+            # A member's open loans
+            models.Index(fields=['member'], condition=Q(return_date__isnull=True), name='loan_member_open_idx'),
+            # Keyset pagination of loan_list
+            models.Index(fields=['-checkout_date', '-id'], name='loan_checkout_idx'),
+        ]
     
     def __str__(self):
         return f"{self.book_copy.book.title} - {self.member}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember whether the stored row was open to detect returns on save
+        instance._was_open = instance.__dict__.get('return_date') is None
+        return instance
+    
     def clean(self):
         """Validate loan data"""
         # Cannot borrow if member can't borrow more books
@@ -151,16 +260,42 @@ class Loan(models.Model):
             raise ValidationError("Due date must be in the future")
     
     def save(self, *args, **kwargs):
-        # For new loans, mark the book copy as loaned
-        if not self.pk:
-            self.book_copy.mark_as_loaned()
-            
-        # If return date was set, mark the book as available
-        if self.return_date and self.status != 'RE':
-            self.status = 'RE'
-            self.book_copy.mark_as_available()
+        creating = not self.pk
+        was_open = getattr(self, '_was_open', False)
+        
+        with transaction.atomic():
+            # For new loans, mark the book copy as loaned
+            if creating:
+                self.book_copy.mark_as_loaned()
+                
+            # If return date was set on an open loan, mark the book as available;
+            # damaged and lost returns keep their copy out of circulation
+            if self.return_date and self.status in ('AC', 'OV'):
+                self.status = 'RE'
+                self.book_copy.mark_as_available()
+                
+            super().save(*args, **kwargs)
             
-        super().save(*args, **kwargs)
+            # Keep the member's open loan counter in step with this row
+            if creating and not self.return_date:
+                self._adjust_member_loans(1)
+            elif was_open and self.return_date:
+                self._adjust_member_loans(-1)
+        
+        self._was_open = self.return_date is None
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            Loan.objects.filter(pk=self.pk).release_members()
+            return super().delete(*args, **kwargs)
+    
+    def _adjust_member_loans(self, delta):
+        """Atomically shift the member's active_loans counter by delta"""
+        Member.objects.filter(pk=self.member_id).update(
+            active_loans=F('active_loans') + delta
+        )
+        if Loan.member.is_cached(self):
+            self.member.active_loans = max(self.member.active_loans + delta, 0)
     
     @property
     def is_overdue(self):
@@ -168,6 +303,17 @@ class Loan(models.Model):
             return False
         return timezone.now().date() > self.due_date
     
+    def late_fee_owed(self, as_of, already_charged=None):
+        """
+        Late fee still to be charged as of a date, net of fees already assessed.
+
+        already_charged must only cover late fees assessed after the current
+        due_date, so a renewed loan that goes
+        overdue again is charged for its new lateness in full.
+        """
+        days_late = max((as_of - self.due_date).days, 0)
+        return max(days_late * self.LATE_FEE_PER_DAY - (already_charged or 0), 0)
+    
     def renew(self, weeks=2):
         """Renew a loan for a number of weeks"""
         if self.renewed_count >= 3:
@@ -178,6 +324,8 @@ class Loan(models.Model):
             
         self.due_date = timezone.now().date() + timezone.timedelta(weeks=weeks)
         self.renewed_count += 1
+        if self.status == 'OV':
+            self.status = 'AC'
         self.save()
     
     def return_book(self, damaged=False, lost=False):
@@ -201,15 +349,19 @@ class Loan(models.Model):
         # Calculate late fee if applicable
         if today > self.due_date:
             days_late = (today - self.due_date).days
-            fee_amount = days_late * 0.50  # $0.50 per day
+            
+            # Part of the fee may already have been accrued by sweep_overdue
+            accrued = self.fees.filter(fee_type='LA', date_assessed__gt=self.due_date).aggregate(total=Sum('amount'))['total']
+            fee_amount = self.late_fee_owed(today, accrued)
             
             # Create late fee record
-            Fee.objects.create(
-                loan=self,
-                fee_type='LA',
-                amount=fee_amount,
-                description=f"Late fee for {days_late} days"
-            )
+            if fee_amount > 0:
+                Fee.objects.create(
+                    loan=self,
+                    fee_type='LA',
+                    amount=fee_amount,
+                    description=f"Late fee for {days_late} days"
+                )
             
         return True
 
@@ -229,8 +381,24 @@ class Reservation(models.Model):
     )
     status = models.CharField(max_length=2, choices=STATUS_CHOICES, default='AC')
     
+    # Copy set aside for this reservation by the queue, held with status 'RE'
+    allocated_copy = models.ForeignKey(
+        BookCopy,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='held_reservations'
+    )
+    
     class Meta:
-        ordering = ['reservation_date']
+        ordering = ['reservation_date', 'id']
+        indexes = [
+            # A member's active reservation for a book
+            models.Index(fields=['member', 'book'], condition=Q(status='AC'), name='reservation_active_idx'),
+            # Waiting queue of a book, oldest first
+            models.Index(fields=['book', 'reservation_date', 'id'], condition=Q(status='AC'),
+                         name='reservation_queue_idx'),
+        ]
     
     def __str__(self):
         return f"{self.book.title} reserved by {self.member}"
@@ -258,28 +426,40 @@ class Reservation(models.Model):
             
         super().save(*args, **kwargs)
     
-    def fulfill(self, book_copy, checkout_date=None, due_date=None):
-        """Create a loan when reservation is fulfilled"""
+    def fulfill(self, book_copy=None, checkout_date=None, due_date=None):
+        """Create a loan when reservation is fulfilled, defaulting to the held copy"""
         if self.status != 'AC':
             raise ValidationError("Cannot fulfill a non-active reservation")
-            
-        if not book_copy.is_available:
+        
+        held_copy = self.allocated_copy
+        book_copy = book_copy or held_copy
+        if book_copy is None:
+            raise ValidationError("No book copy has been allocated to this reservation")
+        
+        is_held = held_copy is not None and book_copy.pk == held_copy.pk and book_copy.status == 'RE'
+        if not book_copy.is_available and not is_held:
             raise ValidationError("Selected book copy is not available")
         
         # Create loan
         checkout = checkout_date or timezone.now().date()
         due = due_date or (checkout + timezone.timedelta(weeks=2))
         
-        loan = Loan.objects.create(
-            member=self.member,
-            book_copy=book_copy,
-            checkout_date=checkout,
-            due_date=due
-        )
-        
-        # Update reservation status
-        self.status = 'FU'
-        self.save()
+        with transaction.atomic():
+            loan = Loan.objects.create(
+                member=self.member,
+                book_copy=book_copy,
+                checkout_date=checkout,
+                due_date=due
+            )
+            
+            # Update reservation status
+            self.status = 'FU'
+            self.allocated_copy = book_copy
+            self.save()
+            
+            # A different copy was lent, so pass the held one down the queue
+            if held_copy is not None and not is_held:
+                held_copy.mark_as_available()
         
         return loan
     
@@ -287,9 +467,16 @@ class Reservation(models.Model):
         """Cancel reservation"""
         if self.status != 'AC':
             raise ValidationError("Cannot cancel a non-active reservation")
+        
+        with transaction.atomic():
+            held_copy = self.allocated_copy
+            self.status = 'CA'
+            self.allocated_copy = None
+            self.save()
             
-        self.status = 'CA'
-        self.save()
+            # Release the held copy to the next reservation in the queue
+            if held_copy is not None and held_copy.status == 'RE':
+                held_copy.mark_as_available()
         return True
 
 
@@ -318,6 +505,12 @@ class Fee(models.Model):
     )
     status = models.CharField(max_length=2, choices=PAYMENT_STATUS_CHOICES, default='OU')
     
+    class Meta:
+        indexes = [
+            # Outstanding fees of a loan (admin fee totals)
+            models.Index(fields=['loan'], condition=Q(status='OU'), name='fee_outstanding_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.get_fee_type_display()} fee of ${self.amount:.2f} for {self.loan}"
     
@@ -332,4 +525,68 @@ class Fee(models.Model):
         """Waive fee"""
         self.status = 'WA'
         self.save()
-        return True
\ No newline at end of file
+        return True
+
+class DailyLoanStats(models.Model):
+    """Loans checked out on a day and how many are returned, open or overdue"""
+    day = models.DateField(unique=True)
+    loans = models.PositiveIntegerField(default=0)
+    returned = models.PositiveIntegerField(default=0)
+    open_loans = models.PositiveIntegerField(default=0)
+    overdue = models.PositiveIntegerField(default=0)
+    refreshed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['day']
+        verbose_name_plural = "Daily loan stats"
+    
+    def __str__(self):
+        return f"{self.day}: {self.loans} loans"
+
+
+class DailyCategoryLoans(models.Model):
+    """Loans checked out on a day for books in a category"""
+    day = models.DateField()
+    category = models.ForeignKey('library.Category', on_delete=models.CASCADE, related_name='daily_loans')
+    loans = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['day']
+        unique_together = ('day', 'category')
+        verbose_name_plural = "Daily category loans"
+    
+    def __str__(self):
+        return f"{self.day}: {self.loans} loans in category {self.category_id}"
+
+
+class DailyFeeStats(models.Model):
+    """Fees on loans checked out on a day, per payment status"""
+    day = models.DateField()
+    status = models.CharField(max_length=2, choices=Fee.PAYMENT_STATUS_CHOICES)
+    fees = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    class Meta:
+        ordering = ['day']
+        unique_together = ('day', 'status')
+        verbose_name_plural = "Daily fee stats"
+    
+    def __str__(self):
+        return f"{self.day}: {self.get_status_display()} ${self.amount:.2f}"
+
+
+class MemberLoanStats(models.Model):
+    """Total number of loans a member has ever had"""
+    member = models.OneToOneField(
+        Member,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='loan_stats'
+    )
+    loans = models.PositiveIntegerField(default=0, db_index=True)
+    
+    class Meta:
+        verbose_name_plural = "Member loan stats"
+    
+    def __str__(self):
+        return f"{self.member_id}: {self.loans} loans"
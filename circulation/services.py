@@ -0,0 +1,331 @@
+"""
+Transactional circulation operations.
+
+These functions replace read-then-write flows on the models with guarded
+UPDATE statements so that concurrent desk traffic cannot lend the same copy
+twice or push a member past their borrowing limit.
+"""
+from collections import Counter
+from dataclasses import dataclass
+from itertools import groupby
+from operator import attrgetter
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.utils import timezone
+
+from .models import Member, BookCopy, Loan, Reservation, Fee
+
+
+@dataclass
+class CheckoutResult:
+    """Outcome of a checkout attempt"""
+    OK = 'ok'
+    COPY_NOT_FOUND = 'copy_not_found'
+    COPY_UNAVAILABLE = 'copy_unavailable'
+    MEMBER_NOT_FOUND = 'member_not_found'
+    MEMBER_INELIGIBLE = 'member_ineligible'
+    LIMIT_REACHED = 'limit_reached'
+    INVALID_DUE_DATE = 'invalid_due_date'
+
+    status: str
+    loan: Optional[Loan] = None
+    message: str = ''
+
+    @property
+    def ok(self):
+        return self.status == self.OK
+
+    @property
+    def is_conflict(self):
+        """True when the request lost a race or hit a limit rather than being malformed"""
+        return self.status in (self.COPY_UNAVAILABLE, self.LIMIT_REACHED)
+
+
+def _borrowing_limit_expression():
+    """SQL CASE mirroring Member.BORROWING_LIMITS"""
+    return Case(
+        *[When(membership_type=code, then=Value(limit))
+          for code, limit in Member.BORROWING_LIMITS.items()],
+        default=Value(Member.DEFAULT_BORROWING_LIMIT),
+        output_field=IntegerField(),
+    )
+
+
+def _member_failure(member_id, today):
+    """Explain why the guarded member UPDATE matched no row"""
+    member = Member.objects.filter(pk=member_id).only(
+        'is_active', 'membership_expiry', 'membership_type', 'active_loans'
+    ).first()
+    if member is None:
+        return CheckoutResult(CheckoutResult.MEMBER_NOT_FOUND, message="Member does not exist")
+    if not member.is_active or not member.is_membership_valid:
+        return CheckoutResult(CheckoutResult.MEMBER_INELIGIBLE,
+                              message="Membership is inactive or has expired")
+    return CheckoutResult(CheckoutResult.LIMIT_REACHED,
+                          message="Member has reached the borrowing limit")
+
+
+def checkout(member_id, book_copy_id, due_date, checkout_date=None):
+    """
+    Lend a copy to a member in a single transaction.
+
+    The copy is claimed with ``UPDATE ... WHERE status='AV'`` and the member's
+    active_loans counter is bumped with an UPDATE guarded by the membership
+    rules, so the loser of a race gets a conflict result instead of a second
+    loan. On success this costs two UPDATEs and one INSERT.
+    """
+    today = timezone.now().date()
+    checkout_date = checkout_date or today
+
+    if due_date < today:
+        return CheckoutResult(CheckoutResult.INVALID_DUE_DATE,
+                              message="Due date must be in the future")
+
+    with transaction.atomic():
+        claimed = BookCopy.objects.filter(pk=book_copy_id, status='AV').update(status='LO')
+        if not claimed:
+            if BookCopy.objects.filter(pk=book_copy_id).exists():
+                return CheckoutResult(CheckoutResult.COPY_UNAVAILABLE,
+                                      message="This book copy is not available for loan")
+            return CheckoutResult(CheckoutResult.COPY_NOT_FOUND,
+                                  message="Book copy does not exist")
+
+        reserved_slot = Member.objects.filter(
+            Q(membership_expiry__isnull=True) | Q(membership_expiry__gte=today),
+            pk=member_id,
+            is_active=True,
+            active_loans__lt=_borrowing_limit_expression(),
+        ).update(active_loans=F('active_loans') + 1)
+        if not reserved_slot:
+            result = _member_failure(member_id, today)
+            # Undo the copy claim along with everything else in this block
+            transaction.set_rollback(True)
+            return result
+
+        loan = Loan(
+            member_id=member_id,
+            book_copy_id=book_copy_id,
+            checkout_date=checkout_date,
+            due_date=due_date,
+        )
+        # bulk_create skips Loan.save(); the copy and counter are already updated
+        Loan.objects.bulk_create([loan])
+        loan._was_open = True
+
+    return CheckoutResult(CheckoutResult.OK, loan=loan)
+
+
+@dataclass
+class ReturnResult:
+    """Outcome of returning one copy in a batch"""
+    RETURNED = 'returned'
+    NOT_FOUND = 'not_found'
+    NOT_ON_LOAN = 'not_on_loan'
+    DUPLICATE = 'duplicate'
+
+    reference_number: str
+    status: str
+    loan: Optional[Loan] = None
+    fee: Optional[Fee] = None
+
+    @property
+    def ok(self):
+        return self.status == self.RETURNED
+
+
+def return_batch(reference_numbers, return_date=None, batch_size=500):
+    """
+    Check in many copies at once, e.g. when emptying the book drop.
+
+    Loans, copies and late fees are written with bulk_update/bulk_create and
+    the affected members' counters with a single UPDATE, all in one
+    transaction. Returns one ReturnResult per input reference number, in order.
+    """
+    return_date = return_date or timezone.now().date()
+    wanted = [ref.strip() for ref in reference_numbers if ref and ref.strip()]
+
+    with transaction.atomic():
+        copies = {
+            copy.reference_number: copy
+            for copy in BookCopy.objects.filter(reference_number__in=set(wanted))
+                                        .only('id', 'book', 'reference_number', 'status')
+        }
+        open_loans = {
+            loan.book_copy_id: loan
+            for loan in Loan.objects.select_for_update()
+                                    .filter(book_copy__in=copies.values(), return_date__isnull=True)
+                                    .only('id', 'member', 'book_copy', 'due_date', 'status')
+        }
+
+        results = []
+        seen = set()
+        loans, returned_copies = [], []
+        for ref in wanted:
+            if ref in seen:
+                results.append(ReturnResult(ref, ReturnResult.DUPLICATE))
+                continue
+            seen.add(ref)
+
+            copy = copies.get(ref)
+            if copy is None:
+                results.append(ReturnResult(ref, ReturnResult.NOT_FOUND))
+                continue
+            loan = open_loans.get(copy.pk)
+            if loan is None:
+                results.append(ReturnResult(ref, ReturnResult.NOT_ON_LOAN))
+                continue
+
+            loan.return_date = return_date
+            loan.status = 'RE'
+            loan.book_copy = copy
+            loan._was_open = False
+            copy.status = 'AV'
+            loans.append(loan)
+            returned_copies.append(copy)
+            results.append(ReturnResult(ref, ReturnResult.RETURNED, loan=loan))
+
+        # Late fees net of anything sweep_overdue already accrued
+        late = {loan.pk: loan for loan in loans if return_date > loan.due_date}
+        accrued = dict(
+            Fee.objects.filter(loan__in=late, fee_type='LA', date_assessed__gt=F('loan__due_date'))
+                       .values('loan').order_by().annotate(total=Sum('amount'))
+                       .values_list('loan', 'total')
+        ) if late else {}
+        fees = []
+        for result in results:
+            loan = result.loan
+            if loan is None or loan.pk not in late:
+                continue
+            amount = loan.late_fee_owed(return_date, accrued.get(loan.pk))
+            if amount > 0:
+                days_late = (return_date - loan.due_date).days
+                result.fee = Fee(
+                    loan=loan,
+                    fee_type='LA',
+                    amount=amount,
+                    date_assessed=return_date,
+                    description=f"Late fee for {days_late} days",
+                )
+                fees.append(result.fee)
+
+        if loans:
+            Loan.objects.bulk_update(loans, ['return_date', 'status'], batch_size=batch_size)
+            BookCopy.objects.bulk_update(returned_copies, ['status'], batch_size=batch_size)
+            Fee.objects.bulk_create(fees, batch_size=batch_size)
+
+            returned_per_member = Counter(loan.member_id for loan in loans)
+            Member.objects.filter(pk__in=returned_per_member).update(
+                active_loans=F('active_loans') - Case(
+                    *[When(pk=member_id, then=Value(count))
+                      for member_id, count in returned_per_member.items()],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            )
+
+            # Returned copies go to waiting reservations first
+            held = allocate_pending(book_ids={copy.book_id for copy in returned_copies})
+            held_copy_ids = {reservation.allocated_copy_id for reservation in held}
+            for copy in returned_copies:
+                if copy.pk in held_copy_ids:
+                    copy.status = 'RE'
+
+    return results
+
+
+def _waiting_reservations():
+    """Active, unexpired reservations without a held copy, oldest first"""
+    return Reservation.objects.filter(status='AC', allocated_copy__isnull=True,
+                                      expiry_date__gte=timezone.now().date())
+
+
+def expire_reservations(book_ids=None):
+    """
+    Expire active reservations past their expiry_date.
+
+    Copies they were holding go back to 'AV'. Returns the ids of the books
+    whose copies were released, so they can be offered to the rest of the queue.
+    """
+    stale = Reservation.objects.filter(status='AC', expiry_date__lt=timezone.now().date())
+    if book_ids is not None:
+        stale = stale.filter(book__in=book_ids)
+
+    with transaction.atomic():
+        held_copies = list(stale.filter(allocated_copy__isnull=False).values_list('allocated_copy', flat=True))
+        stale.update(status='EX', allocated_copy=None)
+        if not held_copies:
+            return set()
+        released = BookCopy.objects.filter(pk__in=held_copies, status='RE')
+        released_books = set(released.values_list('book', flat=True))
+        released.update(status='AV')
+    return released_books
+
+
+def allocate_copy(book_copy):
+    """
+    Hold a newly available copy for the oldest waiting reservation of its book.
+
+    The copy is claimed with ``UPDATE ... WHERE status='AV'`` so a concurrent
+    checkout or allocation cannot take it twice. Returns the reservation that
+    received the copy, or None if nobody is waiting.
+    """
+    with transaction.atomic():
+        # Copies released here stay 'AV' until the next allocate_pending()
+        expire_reservations(book_ids=[book_copy.book_id])
+        reservation = _waiting_reservations().select_for_update().filter(
+            book_id=book_copy.book_id
+        ).order_by('reservation_date', 'id').first()
+        if reservation is None:
+            return None
+
+        if not BookCopy.objects.filter(pk=book_copy.pk, status='AV').update(status='RE'):
+            return None
+
+        reservation.allocated_copy = book_copy
+        reservation.save(update_fields=['allocated_copy'])
+        book_copy.status = 'RE'
+
+    return reservation
+
+
+def allocate_pending(book_ids=None, batch_size=500):
+    """
+    Match available copies to waiting reservations, first come first served.
+
+    Waiting reservations and available copies are each read once, ordered by
+    book, and paired per book in a single pass; the results are written with
+    one bulk_update per table. Expired reservations are closed first and the
+    copies they held join the pool. Returns the reservations that received a copy.
+    """
+    with transaction.atomic():
+        released_books = expire_reservations(book_ids)
+        waiting = _waiting_reservations()
+        if book_ids is not None:
+            waiting = waiting.filter(Q(book__in=book_ids) | Q(book__in=released_books))
+
+        queue = waiting.select_for_update().order_by('book', 'reservation_date', 'id').only('id', 'book')
+        copies = BookCopy.objects.select_for_update().filter(
+            status='AV', book__in=waiting.values('book')
+        ).order_by('book', 'id').only('id', 'book', 'status')
+        copies_by_book = {
+            book_id: list(group)
+            for book_id, group in groupby(copies, key=attrgetter('book_id'))
+        }
+
+        allocated = []
+        for book_id, reservations in groupby(queue, key=attrgetter('book_id')):
+            for reservation, copy in zip(reservations, copies_by_book.get(book_id, ())):
+                reservation.allocated_copy = copy
+                copy.status = 'RE'
+                allocated.append(reservation)
+
+        if allocated:
+            Reservation.objects.bulk_update(allocated, ['allocated_copy'], batch_size=batch_size)
+            BookCopy.objects.bulk_update(
+                [reservation.allocated_copy for reservation in allocated], ['status'],
+                batch_size=batch_size,
+            )
+
+    return allocated
@@ -0,0 +1,12 @@
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from library.models import Book
+from .models import Loan
+
+
+@receiver(pre_delete, sender=Book)
+def release_book_loans(sender, instance, **kwargs):
+    # The cascade deletes the book's copies and loans without calling their
+    # delete() methods, so release the borrowers' slots beforehand
+    Loan.objects.filter(book_copy__book=instance).release_members()
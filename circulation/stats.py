@@ -0,0 +1,146 @@
+"""
+Daily circulation rollups behind circulation_report and member_report.
+
+Loans are grouped by checkout day. A day's rollup can only change while
+some of its loans are still open or some of its fees are still
+outstanding. Each refresh therefore recomputes:
+
+* every day from the newest rolled-up day onwards,
+* every day whose rollup still shows open loans or outstanding fees,
+* every day that currently has an open loan.
+
+Days that are fully settled are left alone. Use ``full=True`` after bulk
+edits that bypass this rule, such as deleting old loans.
+"""
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from .models import (
+    Loan, Fee, DailyLoanStats, DailyCategoryLoans, DailyFeeStats, MemberLoanStats,
+)
+
+# Days recomputed per statement, keeping IN (...) lists bounded
+DAY_CHUNK = 500
+
+
+def _chunks(items, size):
+    items = sorted(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _dirty_days(since):
+    days = set(
+        Loan.objects.filter(checkout_date__gte=since)
+        .order_by().values_list('checkout_date', flat=True).distinct()
+    )
+    days.update(DailyLoanStats.objects.filter(open_loans__gt=0).values_list('day', flat=True))
+    days.update(
+        DailyFeeStats.objects.filter(status='OU', fees__gt=0)
+        .order_by().values_list('day', flat=True).distinct()
+    )
+    days.update(
+        Loan.objects.filter(return_date__isnull=True)
+        .order_by().values_list('checkout_date', flat=True).distinct()
+    )
+    return days
+
+
+def _refresh_loan_days(days, today):
+    DailyLoanStats.objects.filter(day__in=days).delete()
+    rows = Loan.objects.filter(checkout_date__in=days).order_by().values('checkout_date').annotate(
+        loans=Count('pk'),
+        returned=Count('pk', filter=Q(return_date__isnull=False)),
+        open_loans=Count('pk', filter=Q(return_date__isnull=True)),
+        overdue=Count('pk', filter=Q(return_date__isnull=True, due_date__lt=today)),
+    )
+    DailyLoanStats.objects.bulk_create(
+        DailyLoanStats(day=row.pop('checkout_date'), **row) for row in rows
+    )
+
+
+def _refresh_fee_days(days):
+    DailyFeeStats.objects.filter(day__in=days).delete()
+    rows = Fee.objects.filter(loan__checkout_date__in=days).order_by().values(
+        'loan__checkout_date', 'status'
+    ).annotate(fees=Count('pk'), amount=Sum('amount'))
+    DailyFeeStats.objects.bulk_create(
+        DailyFeeStats(day=row['loan__checkout_date'], status=row['status'],
+                      fees=row['fees'], amount=row['amount'])
+        for row in rows
+    )
+
+
+def _refresh_category_days(loans):
+    rows = loans.filter(book_copy__book__categories__isnull=False).order_by().values(
+        'checkout_date', 'book_copy__book__categories'
+    ).annotate(loans=Count('pk'))
+    DailyCategoryLoans.objects.bulk_create(
+        DailyCategoryLoans(day=row['checkout_date'],
+                           category_id=row['book_copy__book__categories'],
+                           loans=row['loans'])
+        for row in rows
+    )
+
+
+def _refresh_members(loans):
+    members = loans.order_by().values('member').distinct()
+    MemberLoanStats.objects.filter(member__in=members).delete()
+    rows = Loan.objects.filter(member__in=members).order_by().values('member').annotate(loans=Count('pk'))
+    MemberLoanStats.objects.bulk_create(
+        MemberLoanStats(member_id=row['member'], loans=row['loans']) for row in rows
+    )
+
+
+def refresh(full=False, today=None):
+    """
+    Bring the rollup tables up to date and return the number of days recomputed.
+
+    Category and member rollups only change when loans are added, so they
+    are recomputed from the newest rolled-up day onwards. Loan and fee
+    rollups also cover every day that may still change.
+    """
+    today = today or timezone.now().date()
+
+    with transaction.atomic():
+        since = None if full else DailyLoanStats.objects.aggregate(last=Max('day'))['last']
+
+        if since is None:
+            DailyLoanStats.objects.all().delete()
+            DailyFeeStats.objects.all().delete()
+            DailyCategoryLoans.objects.all().delete()
+            MemberLoanStats.objects.all().delete()
+            days = set(Loan.objects.order_by().values_list('checkout_date', flat=True).distinct())
+            new_loans = Loan.objects.all()
+        else:
+            days = _dirty_days(since)
+            new_loans = Loan.objects.filter(checkout_date__gte=since)
+            DailyCategoryLoans.objects.filter(day__gte=since).delete()
+
+        for chunk in _chunks(days, DAY_CHUNK):
+            _refresh_loan_days(chunk, today)
+            _refresh_fee_days(chunk)
+        _refresh_category_days(new_loans)
+        _refresh_members(new_loans)
+
+    return len(days)
+
+
+def loan_totals(from_date, to_date):
+    """Total, returned and overdue loans checked out in the date range"""
+    totals = DailyLoanStats.objects.filter(day__range=(from_date, to_date)).aggregate(
+        total=Sum('loans'), returned=Sum('returned'), overdue=Sum('overdue'),
+        refreshed_at=Max('refreshed_at'),
+    )
+    for key in ('total', 'returned', 'overdue'):
+        totals[key] = totals[key] or 0
+    return totals
+
+
+def fee_totals(from_date, to_date):
+    """Assessed and collected fees on loans checked out in the date range"""
+    totals = DailyFeeStats.objects.filter(day__range=(from_date, to_date)).aggregate(
+        total=Sum('amount'), collected=Sum('amount', filter=Q(status='PA')),
+    )
+    return totals['total'] or 0, totals['collected'] or 0
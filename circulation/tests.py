@@ -1,3 +1,741 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth.models import User
+from django.db.models import Sum
+from django.utils import timezone
+from inventory.models import Shelf
+from library.models import Author, Book, Category
+from .models import Member, BookCopy, Loan, Reservation, Fee, DailyCategoryLoans, MemberLoanStats
+from . import services, stats
+from search import index
+from config.pagination import CursorPaginator, _encode
+from config.profiling import QueryRecorder
+
+
+class MemberLoanCounterTest(TestCase):
+    """Test cases for the denormalized Member.active_loans counter"""
+
+    def setUp(self):
+        """Create a member and two available copies"""
+        user = User.objects.create_user(username='reader', password='readerpassword')
+        self.member = Member.objects.create(user=user)
+        author = Author.objects.create(name="Ursula K. Le Guin")
+        book = Book.objects.create(title="The Dispossessed", author=author, isbn="9780060512750")
+        self.copy1 = BookCopy.objects.create(book=book, reference_number="DIS-001")
+        self.copy2 = BookCopy.objects.create(book=book, reference_number="DIS-002")
+        self.due_date = timezone.now().date() + timezone.timedelta(weeks=2)
+
+    def test_counter_follows_checkout_and_return(self):
+        """Test the counter rises on checkout and falls on return"""
+        loan = Loan.objects.create(member=self.member, book_copy=self.copy1, due_date=self.due_date)
+        Loan.objects.create(member=self.member, book_copy=self.copy2, due_date=self.due_date)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.active_loans, 2)
+
+        Loan.objects.get(pk=loan.pk).return_book()
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.active_loans, 1)
+
+    def test_can_borrow_uses_counter(self):
+        """Test can_borrow answers without counting loan rows"""
+        Member.objects.filter(pk=self.member.pk).update(active_loans=3)
+        self.member.refresh_from_db()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.member.can_borrow())
+
+    def test_rebuild_command_repairs_drift(self):
+        """Test rebuild_loan_counters detects and fixes a wrong counter"""
+        Loan.objects.create(member=self.member, book_copy=self.copy1, due_date=self.due_date)
+        Member.objects.filter(pk=self.member.pk).update(active_loans=5)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_loan_counters', check=True, stdout=StringIO())
+
+        call_command('rebuild_loan_counters', stdout=StringIO())
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.active_loans, 1)
+        call_command('rebuild_loan_counters', check=True, stdout=StringIO())
+
+    def test_counter_follows_queryset_and_cascade_deletes(self):
+        """Test deleting open loans in bulk, through their copy or their book frees the slots"""
+        book = self.copy1.book
+        copies = [BookCopy.objects.create(book=book, reference_number=f"DIS-1{i:02d}") for i in range(4)]
+        Loan.objects.create(member=self.member, book_copy=self.copy1, due_date=self.due_date)
+        Loan.objects.create(member=self.member, book_copy=self.copy2, due_date=self.due_date)
+
+        Loan.objects.filter(book_copy=self.copy1).delete()
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.active_loans, 1)
+
+        self.copy2.delete()
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.active_loans, 0)
+
+        for copy in copies:
+            Loan.objects.create(member=self.member, book_copy=copy, due_date=self.due_date)
+        BookCopy.objects.filter(pk=copies[0].pk).delete()
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.active_loans, 3)
+
+        Book.objects.get(pk=book.pk).delete()
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.active_loans, 0)
+
+    def test_bulk_delete_queries_do_not_grow_with_loans(self):
+        """Test one UPDATE releases the slots of every deleted loan"""
+        def delete_queries(count):
+            copies = [BookCopy.objects.create(book=self.copy1.book, reference_number=f"BULK-{count}-{i}")
+                      for i in range(count)]
+            for copy in copies:
+                Loan.objects.create(member=self.member, book_copy=copy, due_date=self.due_date)
+            with CaptureQueriesContext(connection) as captured:
+                BookCopy.objects.filter(pk__in=[copy.pk for copy in copies]).delete()
+            return len(captured)
+
+        Member.objects.filter(pk=self.member.pk).update(membership_type='PRE')
+        self.assertEqual(delete_queries(2), delete_queries(5))
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.active_loans, 0)
+
+    def test_admin_links_open_loans(self):
+        """Test the member changelist links the counter to the open loans"""
+        Loan.objects.create(member=self.member, book_copy=self.copy1, due_date=self.due_date)
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com',
+                                                   password='adminpassword')
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:circulation_member_changelist'))
+        self.assertContains(response, f'?member__id__exact={self.member.pk}&amp;return_date__isnull=True">1</a>')
+
+
+class CheckoutServiceTest(TestCase):
+    """Test cases for circulation.services.checkout"""
+
+    def setUp(self):
+        """Create a student member (limit 2) and three available copies"""
+        user = User.objects.create_user(username='student', password='studentpassword')
+        self.member = Member.objects.create(user=user, membership_type='STU')
+        author = Author.objects.create(name="Octavia E. Butler")
+        book = Book.objects.create(title="Kindred", author=author, isbn="9780807083697")
+        self.copies = [
+            BookCopy.objects.create(book=book, reference_number=f"KIN-00{i}")
+            for i in range(3)
+        ]
+        self.due_date = timezone.now().date() + timezone.timedelta(weeks=2)
+
+    def test_checkout_claims_copy_and_slot(self):
+        """Test a successful checkout in two updates and one insert"""
+        with self.assertNumQueries(5):  # savepoint + 2 UPDATEs + INSERT + release
+            result = services.checkout(self.member.pk, self.copies[0].pk, self.due_date)
+        self.assertTrue(result.ok)
+        self.copies[0].refresh_from_db()
+        self.member.refresh_from_db()
+        self.assertEqual(self.copies[0].status, 'LO')
+        self.assertEqual(self.member.active_loans, 1)
+        self.assertEqual(result.loan.member_id, self.member.pk)
+
+    def test_checkout_of_loaned_copy_conflicts(self):
+        """Test a second checkout of the same copy reports a conflict"""
+        services.checkout(self.member.pk, self.copies[0].pk, self.due_date)
+        result = services.checkout(self.member.pk, self.copies[0].pk, self.due_date)
+        self.assertEqual(result.status, services.CheckoutResult.COPY_UNAVAILABLE)
+        self.assertTrue(result.is_conflict)
+        self.assertEqual(Loan.objects.count(), 1)
+
+    def test_limit_reached_rolls_back_copy_claim(self):
+        """Test hitting the borrowing limit leaves the copy available"""
+        services.checkout(self.member.pk, self.copies[0].pk, self.due_date)
+        services.checkout(self.member.pk, self.copies[1].pk, self.due_date)
+        result = services.checkout(self.member.pk, self.copies[2].pk, self.due_date)
+        self.assertEqual(result.status, services.CheckoutResult.LIMIT_REACHED)
+        self.copies[2].refresh_from_db()
+        self.assertEqual(self.copies[2].status, 'AV')
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.active_loans, 2)
+
+
+class BatchReturnTest(TestCase):
+    """Test cases for circulation.services.return_batch"""
+
+    def setUp(self):
+        """Create a member with one overdue and one current loan"""
+        user = User.objects.create_user(username='dropbox', password='dropboxpassword')
+        self.member = Member.objects.create(user=user, membership_type='PRE')
+        author = Author.objects.create(name="Italo Calvino")
+        book = Book.objects.create(title="Invisible Cities", author=author, isbn="9780156453806")
+        self.copies = [
+            BookCopy.objects.create(book=book, reference_number=f"INV-00{i}")
+            for i in range(3)
+        ]
+        today = timezone.now().date()
+        self.overdue = Loan.objects.create(member=self.member, book_copy=self.copies[0],
+                                           due_date=today + timezone.timedelta(weeks=1))
+        Loan.objects.filter(pk=self.overdue.pk).update(due_date=today - timezone.timedelta(days=4))
+        self.current = Loan.objects.create(member=self.member, book_copy=self.copies[1],
+                                           due_date=today + timezone.timedelta(weeks=1))
+
+    def test_batch_return_reports_each_item(self):
+        """Test returns, late fees and per-item statuses from one batch"""
+        results = services.return_batch(['INV-000', 'INV-001', 'INV-002', 'NOPE', 'INV-000'])
+        self.assertEqual([r.status for r in results], [
+            services.ReturnResult.RETURNED,
+            services.ReturnResult.RETURNED,
+            services.ReturnResult.NOT_ON_LOAN,
+            services.ReturnResult.NOT_FOUND,
+            services.ReturnResult.DUPLICATE,
+        ])
+        self.assertEqual(results[0].fee.amount, Decimal('2.00'))
+        self.assertIsNone(results[1].fee)
+
+        self.assertFalse(Loan.objects.filter(return_date__isnull=True).exists())
+        self.assertEqual(BookCopy.objects.filter(status='AV').count(), 3)
+        self.assertEqual(Fee.objects.get().loan_id, self.overdue.pk)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.active_loans, 0)
+
+
+class SweepOverdueTest(TestCase):
+    """Test cases for the sweep_overdue management command"""
+
+    def setUp(self):
+        """Create one loan three days overdue and one still current"""
+        user = User.objects.create_user(username='late', password='latepassword')
+        member = Member.objects.create(user=user)
+        author = Author.objects.create(name="Jorge Luis Borges")
+        book = Book.objects.create(title="Ficciones", author=author, isbn="9780802130303")
+        self.today = timezone.now().date()
+        copies = [BookCopy.objects.create(book=book, reference_number=f"FIC-00{i}") for i in range(2)]
+        self.late = Loan.objects.create(member=member, book_copy=copies[0],
+                                        due_date=self.today + timezone.timedelta(days=1))
+        Loan.objects.filter(pk=self.late.pk).update(due_date=self.today - timezone.timedelta(days=3))
+        self.current = Loan.objects.create(member=member, book_copy=copies[1],
+                                           due_date=self.today + timezone.timedelta(days=1))
+
+    def test_sweep_flags_and_is_idempotent(self):
+        """Test the sweep marks overdue loans and charges once per day"""
+        call_command('sweep_overdue', chunk_size=1, stdout=StringIO())
+        call_command('sweep_overdue', chunk_size=1, stdout=StringIO())
+
+        self.assertEqual(Loan.objects.get(pk=self.late.pk).status, 'OV')
+        self.assertEqual(Loan.objects.get(pk=self.current.pk).status, 'AC')
+        self.assertEqual(Fee.objects.get().amount, Decimal('1.50'))
+
+        tomorrow = (self.today + timezone.timedelta(days=1)).isoformat()
+        call_command('sweep_overdue', date=tomorrow, stdout=StringIO())
+        self.assertEqual(Fee.objects.aggregate(total=Sum('amount'))['total'], Decimal('2.00'))
+
+    def test_return_charges_only_unaccrued_fee(self):
+        """Test a return after the sweep does not double-charge"""
+        call_command('sweep_overdue', stdout=StringIO())
+        Loan.objects.get(pk=self.late.pk).return_book()
+        self.assertEqual(Fee.objects.count(), 1)
+        self.assertEqual(Loan.objects.get(pk=self.late.pk).status, 'RE')
+
+    def test_renewed_loan_overdue_again_is_charged_in_full(self):
+        """Test fees from before a renewal do not offset the next overdue period"""
+        call_command('sweep_overdue', stdout=StringIO())
+        Loan.objects.get(pk=self.late.pk).renew(weeks=1)
+        self.assertEqual(Loan.objects.get(pk=self.late.pk).status, 'AC')
+
+        # Two days past the new due date
+        later = (self.today + timezone.timedelta(weeks=1, days=2)).isoformat()
+        call_command('sweep_overdue', date=later, stdout=StringIO())
+        fees = list(Fee.objects.filter(loan=self.late).order_by('date_assessed').values_list('amount', flat=True))
+        self.assertEqual(fees, [Decimal('1.50'), Decimal('1.00')])
+
+
+class ReservationQueueTest(TestCase):
+    """Test cases for FIFO allocation of returned copies to reservations"""
+
+    def setUp(self):
+        """Create a loaned copy and two members queued for its book"""
+        author = Author.objects.create(name="Stanisław Lem")
+        self.book = Book.objects.create(title="Solaris", author=author, isbn="9780156027601")
+        self.copy = BookCopy.objects.create(book=self.book, reference_number="SOL-001")
+        borrower, first, second = [
+            Member.objects.create(user=User.objects.create_user(username=name, password=f"{name}password"))
+            for name in ('borrower', 'first', 'second')
+        ]
+        self.loan = Loan.objects.create(member=borrower, book_copy=self.copy,
+                                        due_date=timezone.now().date() + timezone.timedelta(weeks=2))
+        today = timezone.now().date()
+        self.first = Reservation.objects.create(member=first, book=self.book,
+                                                reservation_date=today - timezone.timedelta(days=2))
+        self.second = Reservation.objects.create(member=second, book=self.book,
+                                                 reservation_date=today - timezone.timedelta(days=1))
+
+    def test_return_holds_copy_for_oldest_reservation(self):
+        """Test returning a copy allocates it to the first in the queue"""
+        Loan.objects.get(pk=self.loan.pk).return_book()
+        self.copy.refresh_from_db()
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.copy.status, 'RE')
+        self.assertEqual(self.first.allocated_copy, self.copy)
+        self.assertIsNone(self.second.allocated_copy)
+
+        loan = self.first.fulfill()
+        self.assertEqual(loan.book_copy, self.copy)
+        self.assertEqual(Reservation.objects.get(pk=self.first.pk).status, 'FU')
+
+    def test_cancel_passes_copy_down_the_queue(self):
+        """Test cancelling a held reservation reallocates its copy"""
+        services.return_batch(['SOL-001'])
+        Reservation.objects.get(pk=self.first.pk).cancel()
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.allocated_copy, self.copy)
+
+    def test_allocate_pending_matches_in_order(self):
+        """Test batch allocation gives each available copy to the next reservation"""
+        BookCopy.objects.create(book=self.book, reference_number="SOL-002")
+        extra = BookCopy.objects.create(book=self.book, reference_number="SOL-003")
+        allocated = services.allocate_pending()
+        self.assertEqual([r.pk for r in allocated], [self.first.pk, self.second.pk])
+        extra.refresh_from_db()
+        self.assertEqual(extra.status, 'RE')
+        self.assertEqual(BookCopy.objects.filter(status='RE').count(), 2)
+
+    def test_expired_reservations_are_skipped_and_release_copies(self):
+        """Test the queue expires stale reservations and frees the copies they held"""
+        yesterday = timezone.now().date() - timezone.timedelta(days=1)
+        Reservation.objects.filter(pk=self.first.pk).update(expiry_date=yesterday)
+        Loan.objects.get(pk=self.loan.pk).return_book()
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.status, self.first.allocated_copy), ('EX', None))
+        self.assertEqual(self.second.allocated_copy, self.copy)
+
+        Reservation.objects.filter(pk=self.second.pk).update(expiry_date=yesterday)
+        self.assertEqual(services.allocate_pending(book_ids=[self.book.pk]), [])
+        self.second.refresh_from_db()
+        self.copy.refresh_from_db()
+        self.assertEqual((self.second.status, self.second.allocated_copy), ('EX', None))
+        self.assertEqual(self.copy.status, 'AV')
+
+    def test_damaged_return_is_not_allocated(self):
+        """Test a copy returned damaged stays out of circulation and the queue"""
+        Loan.objects.get(pk=self.loan.pk).return_book(damaged=True)
+        self.copy.refresh_from_db()
+        self.first.refresh_from_db()
+        self.assertEqual(self.copy.status, 'DA')
+        self.assertEqual(Loan.objects.get(pk=self.loan.pk).status, 'DA')
+        self.assertIsNone(self.first.allocated_copy)
+
+
+class CirculationStatsTest(TestCase):
+    """Test cases for the daily circulation rollups"""
+
+    def setUp(self):
+        """Create loans on two days, one of them overdue"""
+        self.user = User.objects.create_superuser(username='admin', email='admin@example.com',
+                                                  password='adminpassword')
+        self.member = Member.objects.create(user=self.user, membership_type='PRE')
+        author = Author.objects.create(name="Haruki Murakami")
+        category = Category.objects.create(name="Magical Realism")
+        book = Book.objects.create(title="Kafka on the Shore", author=author, isbn="9781400079278")
+        book.categories.add(category)
+        self.today = timezone.now().date()
+        self.loans = []
+        for i, days_ago in enumerate((10, 10, 3)):
+            copy = BookCopy.objects.create(book=book, reference_number=f"KAF-00{i}")
+            loan = Loan.objects.create(member=self.member, book_copy=copy,
+                                       due_date=self.today + timezone.timedelta(days=1))
+            Loan.objects.filter(pk=loan.pk).update(
+                checkout_date=self.today - timezone.timedelta(days=days_ago),
+                due_date=self.today - timezone.timedelta(days=days_ago - 7),
+            )
+            self.loans.append(loan)
+
+    def test_refresh_matches_loan_rows(self):
+        """Test rollup totals match a live count"""
+        stats.refresh()
+        start = self.today - timezone.timedelta(days=30)
+        totals = stats.loan_totals(start, self.today)
+        self.assertEqual((totals['total'], totals['returned'], totals['overdue']), (3, 0, 2))
+        self.assertEqual(DailyCategoryLoans.objects.aggregate(total=Sum('loans'))['total'], 3)
+        self.assertEqual(MemberLoanStats.objects.get(member=self.member).loans, 3)
+
+    def test_incremental_refresh_picks_up_old_returns(self):
+        """Test returning an old loan updates its day on the next refresh"""
+        stats.refresh()
+        Loan.objects.get(pk=self.loans[0].pk).return_book()
+        stats.refresh()
+        totals = stats.loan_totals(self.today - timezone.timedelta(days=30), self.today)
+        self.assertEqual((totals['returned'], totals['overdue']), (1, 1))
+        self.assertEqual(stats.fee_totals(self.today - timezone.timedelta(days=30), self.today)[0],
+                         Decimal('1.50'))
+
+    def test_reports_read_rollups(self):
+        """Test report views render from the rollups alone"""
+        stats.refresh()
+        self.client.login(username='admin', password='adminpassword')
+        response = self.client.get(reverse('circulation:circulation_report'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_loans'], 3)
+        self.assertEqual(response.context['most_borrowed_categories'][0].loan_count, 3)
+
+        response = self.client.get(reverse('circulation:member_report'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['top_borrowers'][0].loan_count, 3)
+
+
+class AdminChangelistQueryTest(TestCase):
+    """Test cases for per-row query counts in the circulation admin"""
+
+    def setUp(self):
+        """Create an admin user and a book to lend"""
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpassword')
+        self.client.login(username='admin', password='adminpassword')
+        author = Author.objects.create(name="Italo Svevo")
+        self.book = Book.objects.create(title="Zeno's Conscience", author=author, isbn="9780375727764")
+        self.due_date = timezone.now().date() + timezone.timedelta(weeks=2)
+
+    def add_members_with_fees(self, start, count):
+        for i in range(start, start + count):
+            member = Member.objects.create(user=User.objects.create_user(username=f"reader{i}"))
+            copy = BookCopy.objects.create(book=self.book, reference_number=f"ZEN-{i:03d}")
+            loan = Loan.objects.create(member=member, book_copy=copy, due_date=self.due_date)
+            Fee.objects.create(loan=loan, amount=Decimal('1.25'))
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        """Test member and loan changelists use a fixed number of queries"""
+        self.add_members_with_fees(0, 2)
+        baseline = [self.changelist_queries(reverse(f'admin:circulation_{model}_changelist'))
+                    for model in ('member', 'loan')]
+        self.add_members_with_fees(2, 8)
+        grown = [self.changelist_queries(reverse(f'admin:circulation_{model}_changelist'))
+                 for model in ('member', 'loan')]
+        self.assertEqual(baseline, grown)
+
+    def test_fee_column_sorts_on_annotation(self):
+        """Test the outstanding fee column is sortable"""
+        self.add_members_with_fees(0, 2)
+        response = self.client.get(reverse('admin:circulation_member_changelist') + '?o=7')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "$1.25")
+
+
+class CursorPaginationTest(TestCase):
+    """Test cases for keyset pagination of the loan list"""
+
+    def setUp(self):
+        """Create 25 loans, several sharing a checkout date"""
+        self.user = User.objects.create_superuser(username='admin', email='admin@example.com',
+                                                  password='adminpassword')
+        self.member = Member.objects.create(user=self.user, membership_type='PRE')
+        author = Author.objects.create(name="Ursula K. Le Guin")
+        book = Book.objects.create(title="The Dispossessed", author=author, isbn="9780061054884")
+        today = timezone.now().date()
+        for i in range(25):
+            copy = BookCopy.objects.create(book=book, reference_number=f"DIS-{i:03d}")
+            loan = Loan.objects.create(member=self.member, book_copy=copy,
+                                       due_date=today + timezone.timedelta(days=14))
+            Loan.objects.filter(pk=loan.pk).update(checkout_date=today - timezone.timedelta(days=i // 4))
+        self.expected = list(Loan.objects.order_by('-checkout_date', '-id').values_list('pk', flat=True))
+
+    def test_pages_walk_forward_and_back(self):
+        """Following cursors visits every loan once, in order, and back again"""
+        paginator = CursorPaginator(Loan.objects.all(), ('-checkout_date', '-id'), per_page=10)
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        third = paginator.get_page(second.next_cursor)
+
+        seen = [loan.pk for page in (first, second, third) for loan in page]
+        self.assertEqual(seen, self.expected)
+        self.assertFalse(first.has_previous())
+        self.assertFalse(third.has_next())
+
+        back = paginator.get_page(third.previous_cursor)
+        self.assertEqual([loan.pk for loan in back], [loan.pk for loan in second])
+        self.assertTrue(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_invalid_cursor_returns_first_page(self):
+        """A tampered cursor falls back to the first page"""
+        paginator = CursorPaginator(Loan.objects.all(), ('-checkout_date', '-id'), per_page=10)
+        page = paginator.get_page('not-a-cursor')
+        self.assertEqual([loan.pk for loan in page], self.expected[:10])
+
+    def test_counts_are_optional_and_capped(self):
+        """No count by default, exact on request, capped when estimating"""
+        queryset = Loan.objects.all()
+        self.assertIsNone(CursorPaginator(queryset, ('-id',)).count)
+        self.assertEqual(CursorPaginator(queryset, ('-id',), count='exact').count, 25)
+        with mock.patch('config.pagination.COUNT_CAP', 10):
+            estimated = CursorPaginator(queryset, ('-id',), count='estimate')
+            self.assertEqual(estimated.count, 11)
+            self.assertFalse(estimated.count_is_exact)
+
+    def test_loan_list_follows_next_cursor(self):
+        """The view links to the next page and serves it without OFFSET"""
+        self.client.login(username='admin', password='adminpassword')
+        response = self.client.get(reverse('circulation:loan_list'))
+        next_cursor = response.context['page_obj'].next_cursor
+        self.assertContains(response, f'cursor={next_cursor}')
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('circulation:loan_list'), {'cursor': next_cursor})
+        self.assertEqual([loan.pk for loan in response.context['page_obj']], self.expected[20:])
+        self.assertFalse(any('OFFSET' in query['sql'] for query in captured))
+
+    def test_malformed_cursor_values_return_first_page(self):
+        """A well-formed cursor holding values of the wrong type falls back to the first page"""
+        self.client.login(username='admin', password='adminpassword')
+        response = self.client.get(reverse('circulation:loan_list'), {'cursor': _encode('n', ['notadate', 1])})
+        self.assertEqual([loan.pk for loan in response.context['page_obj']], self.expected[:20])
+        response = self.client.get(reverse('circulation:member_list'), {'cursor': _encode('p', [{'a': 1}])})
+        self.assertEqual(response.status_code, 200)
+
+    def test_search_pages_follow_rank(self):
+        """Paging through a search keeps the relevance order across pages"""
+        author = Author.objects.get()
+        books = [Book.objects.create(title=f"The Dispossessed {i}", author=author, isbn=f"978000000000{i}")
+                 for i in range(2)]
+        for i, book in enumerate(books):
+            copy = BookCopy.objects.create(book=book, reference_number=f"RANK-{i}")
+            Loan.objects.create(member=self.member, book_copy=copy,
+                                due_date=timezone.now().date() + timezone.timedelta(days=14))
+        ranked = [books[1].pk, books[0].pk]
+
+        with mock.patch.object(index, '_match', return_value=ranked):
+            loans = index.search_filter(Loan.objects.all(), "dispossessed", fallback=None,
+                                        books='book_copy__book')
+        paginator = CursorPaginator(loans, index.rank_ordering(loans, ('-checkout_date', '-id')), per_page=1)
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        third = paginator.get_page(second.next_cursor)
+        self.assertEqual([page.object_list[0].book_copy.book_id for page in (first, second)], ranked)
+        self.assertEqual(third.object_list[0].pk, self.expected[0])
+
+
+class CirculationIndexTest(TestCase):
+    """Test cases for the partial indexes behind the hot circulation filters"""
+
+    def plan(self, queryset):
+        return queryset.order_by().values_list('pk').explain()
+
+    def test_hot_filters_use_partial_indexes(self):
+        """The planner picks the conditional index for each filter"""
+        if connection.vendor != 'sqlite':
+            self.skipTest("Plan text is backend specific")
+        today = timezone.now().date()
+        self.assertIn('loan_open_due_idx', self.plan(
+            Loan.objects.filter(return_date__isnull=True, due_date__lt=today)))
+        self.assertIn('bookcopy_available_idx', self.plan(
+            BookCopy.objects.filter(book_id=1, status='AV')))
+        self.assertIn('bookcopy_shelf_available_idx', self.plan(
+            BookCopy.objects.filter(shelf_id=1, status='AV')))
+        self.assertIn('fee_outstanding_idx', self.plan(
+            Fee.objects.filter(loan_id=1, status='OU')))
+
+
+class CopyShelfBackfillTest(TestCase):
+    """Test cases for linking copies to shelves from their shelf_location text"""
+
+    def setUp(self):
+        """Create two shelves and copies with matching, unknown and blank locations"""
+        author = Author.objects.create(name="Test Author")
+        self.book = Book.objects.create(title="Test Book", author=author, isbn="1234567890123")
+        self.fiction = Shelf.objects.create(name="A1", location="Planta 1", capacity=100)
+        self.history = Shelf.objects.create(name="B2", location="Planta 2", capacity=100)
+        locations = ['A1', ' a1 ', 'B2 (Planta 2)', 'Z9', '']
+        for i, location in enumerate(locations):
+            BookCopy.objects.create(book=self.book, reference_number=f"REF{i}", shelf_location=location)
+
+    def backfill(self, **options):
+        out, err = StringIO(), StringIO()
+        call_command('backfill_copy_shelves', stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def shelves(self):
+        return dict(BookCopy.objects.values_list('reference_number', 'shelf__name'))
+
+    def test_links_by_name_and_label(self):
+        """Names match case and space insensitively, and the "name (location)" label matches too"""
+        out, err = self.backfill(chunk_size=2)
+        self.assertEqual(self.shelves(), {'REF0': 'A1', 'REF1': 'A1', 'REF2': 'B2', 'REF3': None, 'REF4': None})
+        self.assertIn("Linked 3 copies", out)
+        self.assertIn("'Z9' (1 copies)", err)
+
+    def test_dry_run_and_rerun(self):
+        """A dry run writes nothing, and copies already linked are left alone"""
+        out, _ = self.backfill(dry_run=True)
+        self.assertIn("Would link 3 copies", out)
+        self.assertFalse(BookCopy.objects.filter(shelf__isnull=False).exists())
+
+        self.backfill()
+        BookCopy.objects.filter(reference_number='REF0').update(shelf=self.history)
+        out, _ = self.backfill()
+        self.assertIn("Linked 0 copies", out)
+        self.assertEqual(self.shelves()['REF0'], 'B2')
+
+    def test_ambiguous_names_are_skipped(self):
+        """A name shared by two shelves links nothing"""
+        Shelf.objects.create(name="A1", location="Planta 3", capacity=100)
+        _, err = self.backfill()
+        self.assertIn("Ambiguous shelf label 'a1'", err)
+        self.assertIsNone(self.shelves()['REF0'])
+
+    def test_available_copies_per_shelf(self):
+        """Shelves are annotated with their available linked copies"""
+        self.backfill()
+        BookCopy.objects.filter(reference_number='REF1').update(status='CO')
+        counts = dict(Shelf.objects.with_available_copies().values_list('name', 'available_copies'))
+        self.assertEqual(counts, {'A1': 1, 'B2': 1})
+
+    def test_shelf_location_follows_shelf(self):
+        """The shelf is the source of truth; shelf_location carries its label"""
+        self.backfill()
+        self.assertEqual(BookCopy.objects.get(reference_number='REF1').shelf_location, 'A1 (Planta 1)')
+
+        copy = BookCopy.objects.get(reference_number='REF0')
+        copy.shelf = self.history
+        copy.save(update_fields=['shelf'])
+        copy = BookCopy.objects.get(pk=copy.pk)
+        self.assertEqual(copy.shelf_location, 'B2 (Planta 2)')
+
+        with CaptureQueriesContext(connection) as captured:
+            copy.status = 'MA'
+            copy.save()
+        self.assertEqual(len(captured), 1)
+
+        self.history.location = "Sótano"
+        self.history.save()
+        self.assertEqual(set(BookCopy.objects.filter(shelf=self.history).values_list('shelf_location', flat=True)),
+                         {'B2 (Sótano)'})
+
+        copy = BookCopy.objects.create(book=self.book, reference_number="REF9", shelf=self.fiction,
+                                       shelf_location="ignored")
+        self.assertEqual(BookCopy.objects.get(pk=copy.pk).shelf_location, 'A1 (Planta 1)')
+
+
+class QueryProfilingTest(TestCase):
+    """Test cases for the query profiling middleware"""
+
+    def setUp(self):
+        """Create a librarian with a few members"""
+        self.user = User.objects.create_superuser(username='admin', email='admin@example.com',
+                                                  password='adminpassword')
+        for i in range(3):
+            user = User.objects.create_user(username=f'reader{i}', password='readerpassword')
+            Member.objects.create(user=user)
+
+    def get_profiled(self, **options):
+        profiling = {'ENABLED': True, 'SAMPLE_RATE': 1.0, 'THRESHOLD_MS': 100, **options}
+        with self.settings(QUERY_PROFILING=profiling):
+            client = Client()
+            client.force_login(self.user)
+            with self.assertLogs('config.profiling') as logs:
+                response = client.get(reverse('circulation:member_list'))
+        return response, json.loads(logs.records[0].getMessage()), logs.records[0]
+
+    def test_server_timing_and_log_line(self):
+        """Query count and SQL time are reported in the header and the log"""
+        response, record, log = self.get_profiled()
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        self.assertIn(f'desc="{record["queries"]} queries"', response['Server-Timing'])
+        self.assertEqual(record['view'], 'circulation:member_list')
+        self.assertGreater(record['queries'], 0)
+        self.assertLessEqual(len(record['slowest']), 3)
+        self.assertEqual(log.levelname, 'INFO')
+
+    def test_view_threshold_marks_slow_requests(self):
+        """A per-view threshold of zero logs the request as slow"""
+        response, record, log = self.get_profiled(VIEW_THRESHOLDS={'circulation:member_list': 0})
+        self.assertTrue(record['slow'])
+        self.assertEqual(log.levelname, 'WARNING')
+
+    def test_disabled_by_default(self):
+        """Without ENABLED the middleware is not installed"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('circulation:member_list'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_streaming_export_is_recorded_until_sent(self):
+        """The SQL an export runs while streaming its body reaches the log line"""
+        profiling = {'ENABLED': True, 'SAMPLE_RATE': 1.0, 'THRESHOLD_MS': 100}
+        with self.settings(QUERY_PROFILING=profiling):
+            client = Client()
+            client.force_login(self.user)
+            with self.assertLogs('config.profiling') as logs:
+                response = client.get(reverse('circulation:loan_export'))
+                self.assertEqual(logs.records, [])
+                with CaptureQueriesContext(connection) as body:
+                    b''.join(response.streaming_content)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'circulation:loan_export')
+        self.assertGreaterEqual(record['queries'], len(body) + 1)
+
+    def test_duplicate_fingerprints(self):
+        """Statements differing only in parameters are grouped"""
+        recorder = QueryRecorder()
+        for statement in ('SELECT 1 WHERE id IN (%s, %s)', 'SELECT 1 WHERE id IN (%s, %s, %s)', 'SELECT 2'):
+            recorder(lambda *args: None, statement, [], False, {})
+        duplicates = recorder.summary(slowest=3)['duplicates']
+        self.assertEqual(duplicates, [{'sql': 'SELECT 1 WHERE id IN (%s, ...)', 'count': 2}])
+
+
+class ExportTest(TestCase):
+    """Test cases for the streaming loan and fee exports"""
+
+    def setUp(self):
+        """Create a returned loan with a paid fee and an open loan"""
+        self.user = User.objects.create_superuser(username='admin', email='admin@example.com',
+                                                  password='adminpassword')
+        self.member = Member.objects.create(user=self.user, membership_type='PRE')
+        author = Author.objects.create(name="Italo Calvino")
+        book = Book.objects.create(title="Invisible Cities", author=author, isbn="9780156453806")
+        today = timezone.now().date()
+        self.loans = []
+        for i in range(2):
+            copy = BookCopy.objects.create(book=book, reference_number=f"INV-00{i}")
+            self.loans.append(Loan.objects.create(member=self.member, book_copy=copy,
+                                                  due_date=today + timezone.timedelta(days=14)))
+        Loan.objects.filter(pk=self.loans[0].pk).update(return_date=today, status='RE')
+        Fee.objects.create(loan=self.loans[0], amount=Decimal('2.50'), status='PA')
+        self.client.login(username='admin', password='adminpassword')
+
+    def read(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_loan_csv_has_member_and_copy_details(self):
+        """Every loan in range is exported with its member and copy"""
+        content = self.read(self.client.get(reverse('circulation:loan_export')))
+        lines = content.splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('id,checkout_date,'))
+        self.assertIn('INV-000', content)
+        self.assertIn('Invisible Cities', content)
+
+    def test_loan_status_filter_and_jsonl(self):
+        """status=active keeps open loans; format=jsonl writes one object per line"""
+        content = self.read(self.client.get(reverse('circulation:loan_export'),
+                                            {'status': 'active', 'format': 'jsonl'}))
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.loans[1].pk])
+        self.assertIsNone(rows[0]['return_date'])
+
+    def test_fee_export_matches_report_range(self):
+        """Fees are filtered by status and by their loan's checkout date"""
+        content = self.read(self.client.get(reverse('circulation:fee_export'), {'status': 'PA'}))
+        self.assertEqual(len(content.splitlines()), 2)
+        self.assertIn('2.50', content)
+
+        past = {'from_date': '2000-01-01', 'to_date': '2000-12-31'}
+        content = self.read(self.client.get(reverse('circulation:fee_export'), past))
+        self.assertEqual(len(content.splitlines()), 1)
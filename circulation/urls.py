@@ -8,4 +8,9 @@ urlpatterns = [
     path('loans/', views.loan_list, name='loan_list'),
     path('loans/overdue/', views.loan_overdue_list, name='loan_overdue_list'),
     path('reservations/', views.reservation_list, name='reservation_list'),
+    path('returns/batch/', views.batch_return, name='batch_return'),
+    path('reports/members/', views.member_report, name='member_report'),
+    path('reports/circulation/', views.circulation_report, name='circulation_report'),
+    path('exports/loans/', views.loan_export, name='loan_export'),
+    path('exports/fees/', views.fee_export, name='fee_export'),
 ]
\ No newline at end of file
@@ -2,10 +2,14 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, permission_required
 from django.utils import timezone
 from django.contrib import messages
-from django.db.models import Q, Sum, Count
-from django.core.paginator import Paginator
+from django.db.models import F, Q, Sum, Count
 
 from .models import Member, BookCopy, Loan, Reservation, Fee
+from . import services, stats
+from library.models import Category
+from search.index import rank_ordering, search_filter
+from config.exports import export_response
+from config.pagination import CursorPaginator
 
 
 @login_required
@@ -16,15 +20,19 @@ def member_list(request):
     member_status = request.GET.get('status', '')
     
     # Base queryset
-    members = Member.objects.all()
+    members = Member.objects.select_related('user')
     
     # Apply filters
     if search_query:
-        members = members.filter(
-            Q(user__username__icontains=search_query) |
-            Q(user__first_name__icontains=search_query) |
-            Q(user__last_name__icontains=search_query) |
-            Q(user__email__icontains=search_query)
+        members = search_filter(
+            members, search_query,
+            fallback=(
+                Q(user__username__icontains=search_query) |
+                Q(user__first_name__icontains=search_query) |
+                Q(user__last_name__icontains=search_query) |
+                Q(user__email__icontains=search_query)
+            ),
+            members='pk',
         )
         
     if member_status == 'active':
@@ -32,15 +40,9 @@ def member_list(request):
     elif member_status == 'inactive':
         members = members.filter(is_active=False)
     
-    # Add annotations
-    members = members.annotate(
-        active_loans=Count('loans', filter=Q(loans__return_date__isnull=True))
-    )
-    
     # Pagination
-    paginator = Paginator(members, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(members, rank_ordering(members, ('id',)), per_page=20, count='estimate')
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'page_obj': page_obj,
@@ -63,12 +65,18 @@ def loan_list(request):
     
     # Apply filters
     if search_query:
-        loans = loans.filter(
-            Q(book_copy__book__title__icontains=search_query) |
-            Q(book_copy__reference_number__icontains=search_query) |
-            Q(member__user__username__icontains=search_query) |
-            Q(member__user__first_name__icontains=search_query) |
-            Q(member__user__last_name__icontains=search_query)
+        loans = search_filter(
+            loans, search_query,
+            fallback=(
+                Q(book_copy__book__title__icontains=search_query) |
+                Q(book_copy__reference_number__icontains=search_query) |
+                Q(member__user__username__icontains=search_query) |
+                Q(member__user__first_name__icontains=search_query) |
+                Q(member__user__last_name__icontains=search_query)
+            ),
+            books='book_copy__book',
+            members='member',
+            also=Q(book_copy__reference_number=search_query),
         )
         
     if loan_status == 'active':
@@ -83,9 +91,8 @@ def loan_list(request):
         )
     
     # Pagination
-    paginator = Paginator(loans, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(loans, rank_ordering(loans, ('-checkout_date', '-id')), per_page=20, count='estimate')
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'page_obj': page_obj,
@@ -106,12 +113,11 @@ def loan_overdue_list(request):
     overdue_loans = Loan.objects.filter(
         return_date__isnull=True,
         due_date__lt=today
-    ).select_related('member__user', 'book_copy__book').order_by('due_date')
+    ).select_related('member__user', 'book_copy__book')
     
     # Pagination
-    paginator = Paginator(overdue_loans, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(overdue_loans, ('due_date', 'id'), per_page=20, count='estimate')
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'page_obj': page_obj,
@@ -180,11 +186,16 @@ def reservation_list(request):
     
     # Apply filters
     if search_query:
-        reservations = reservations.filter(
-            Q(book__title__icontains=search_query) |
-            Q(member__user__username__icontains=search_query) |
-            Q(member__user__first_name__icontains=search_query) |
-            Q(member__user__last_name__icontains=search_query)
+        reservations = search_filter(
+            reservations, search_query,
+            fallback=(
+                Q(book__title__icontains=search_query) |
+                Q(member__user__username__icontains=search_query) |
+                Q(member__user__first_name__icontains=search_query) |
+                Q(member__user__last_name__icontains=search_query)
+            ),
+            books='book',
+            members='member',
         )
         
     if reservation_status == 'active':
@@ -197,9 +208,8 @@ def reservation_list(request):
         reservations = reservations.filter(status='EX')
     
     # Pagination
-    paginator = Paginator(reservations, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(reservations, rank_ordering(reservations, ('reservation_date', 'id')), per_page=20, count='estimate')
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'page_obj': page_obj,
@@ -229,34 +239,22 @@ def checkout_book(request, copy_id=None):
             return redirect('circulation:checkout_book')
         
         try:
-            member = Member.objects.get(id=member_id)
-            book_copy = BookCopy.objects.get(id=book_copy_id)
+            member_id = int(member_id)
+            book_copy_id = int(book_copy_id)
             due_date = timezone.datetime.strptime(due_date, '%Y-%m-%d').date()
-            
-            # Check if member can borrow
-            if not member.can_borrow():
-                messages.error(request, f"{member} has reached borrowing limit or has an invalid membership")
-                return redirect('circulation:checkout_book')
-            
-            # Check if book is available
-            if not book_copy.is_available:
-                messages.error(request, f"Book copy {book_copy.reference_number} is not available")
-                return redirect('circulation:checkout_book')
-            
-            # Create loan
-            loan = Loan.objects.create(
-                member=member,
-                book_copy=book_copy,
-                checkout_date=timezone.now().date(),
-                due_date=due_date
-            )
-            
-            messages.success(request, f"Successfully checked out {book_copy.book.title} to {member}")
-            return redirect('circulation:loan_detail', loan_id=loan.id)
-            
-        except (Member.DoesNotExist, BookCopy.DoesNotExist, ValueError) as e:
+        except ValueError as e:
             messages.error(request, f"Error processing checkout: {str(e)}")
             return redirect('circulation:checkout_book')
+        
+        # Claim the copy and a borrowing slot atomically
+        result = services.checkout(member_id, book_copy_id, due_date)
+        if not result.ok:
+            messages.error(request, result.message)
+            return redirect('circulation:checkout_book')
+        
+        loan = result.loan
+        messages.success(request, f"Successfully checked out {loan.book_copy.book.title} to {loan.member}")
+        return redirect('circulation:loan_detail', loan_id=loan.id)
     
     # Display checkout form
     context = {
@@ -298,6 +296,35 @@ def return_book(request, loan_id):
     return render(request, 'circulation/return_form.html', context)
 
 
+@login_required
+@permission_required('circulation.change_loan')
+def batch_return(request):
+    """Process a batch of returns, e.g. from the overnight book drop"""
+    results = None
+    
+    if request.method == 'POST':
+        raw = request.POST.get('reference_numbers', '')
+        reference_numbers = raw.replace(',', ' ').split()
+        
+        if not reference_numbers:
+            messages.error(request, "Enter at least one reference number")
+            return redirect('circulation:batch_return')
+        
+        results = services.return_batch(reference_numbers)
+        returned = sum(1 for result in results if result.ok)
+        
+        if returned:
+            messages.success(request, f"Successfully processed {returned} of {len(results)} returns")
+        if returned < len(results):
+            messages.warning(request, f"{len(results) - returned} items could not be returned")
+    
+    context = {
+        'results': results,
+    }
+    
+    return render(request, 'circulation/batch_return.html', context)
+
+
 @login_required
 @permission_required('circulation.change_loan')
 def renew_loan(request, loan_id):
@@ -499,9 +526,11 @@ def member_report(request):
                             .annotate(count=Count('id')) \
                             .order_by('membership_type')
     
-    # Top borrowers
-    top_borrowers = Member.objects.annotate(
-        loan_count=Count('loans')
+    # Top borrowers, from the MemberLoanStats rollup
+    top_borrowers = Member.objects.select_related('user').filter(
+        loan_stats__isnull=False
+    ).annotate(
+        loan_count=F('loan_stats__loans')
     ).order_by('-loan_count')[:10]
     
     context = {
@@ -514,11 +543,8 @@ def member_report(request):
     return render(request, 'circulation/member_report.html', context)
 
 
-@login_required
-@permission_required('circulation.view_loan')
-def circulation_report(request):
-    """Generate circulation report"""
-    # Get date range for filtering
+def _report_dates(request):
+    """from_date and to_date from the query string, defaulting to the last 30 days"""
     from_date_str = request.GET.get('from_date')
     to_date_str = request.GET.get('to_date')
     
@@ -545,51 +571,115 @@ def circulation_report(request):
     if not to_date:
         to_date = today
     
-    # Loans in date range
-    loans = Loan.objects.filter(checkout_date__gte=from_date, checkout_date__lte=to_date)
-    total_loans = loans.count()
-    
-    # Returned loans
-    returned_loans = loans.filter(return_date__isnull=False).count()
+    return from_date, to_date
+
+
+@login_required
+@permission_required('circulation.view_loan')
+def circulation_report(request):
+    """Generate circulation report"""
+    from_date, to_date = _report_dates(request)
     
-    # Overdue loans
-    overdue_loans = loans.filter(
-        return_date__isnull=True,
-        due_date__lt=today
-    ).count()
+    # Loan and fee figures come from the daily rollups (see circulation.stats)
+    loan_totals = stats.loan_totals(from_date, to_date)
+    total_fees, collected_fees = stats.fee_totals(from_date, to_date)
     
     # Most borrowed categories
-    from django.db.models import Count
-    from library.models import Category
-    
     most_borrowed_categories = Category.objects.filter(
-        books__copies__loans__checkout_date__gte=from_date,
-        books__copies__loans__checkout_date__lte=to_date
+        daily_loans__day__gte=from_date,
+        daily_loans__day__lte=to_date
     ).annotate(
-        loan_count=Count('books__copies__loans')
+        loan_count=Sum('daily_loans__loans')
     ).order_by('-loan_count')[:5]
     
-    # Fee collection
-    total_fees = Fee.objects.filter(
-        loan__checkout_date__gte=from_date,
-        loan__checkout_date__lte=to_date
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    collected_fees = Fee.objects.filter(
-        loan__checkout_date__gte=from_date,
-        loan__checkout_date__lte=to_date,
-        status='PA'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
     context = {
         'from_date': from_date,
         'to_date': to_date,
-        'total_loans': total_loans,
-        'returned_loans': returned_loans,
-        'overdue_loans': overdue_loans,
+        'total_loans': loan_totals['total'],
+        'returned_loans': loan_totals['returned'],
+        'overdue_loans': loan_totals['overdue'],
+        'stats_refreshed_at': loan_totals['refreshed_at'],
         'most_borrowed_categories': most_borrowed_categories,
         'total_fees': total_fees,
         'collected_fees': collected_fees,
     }
     
-    return render(request, 'circulation/circulation_report.html', context)
\ No newline at end of file
+    return render(request, 'circulation/circulation_report.html', context)
+
+# Export columns: header -> lookup
+LOAN_EXPORT_COLUMNS = {
+    'id': 'id',
+    'checkout_date': 'checkout_date',
+    'due_date': 'due_date',
+    'return_date': 'return_date',
+    'status': 'status',
+    'renewed_count': 'renewed_count',
+    'member_id': 'member_id',
+    'username': 'member__user__username',
+    'first_name': 'member__user__first_name',
+    'last_name': 'member__user__last_name',
+    'email': 'member__user__email',
+    'membership_type': 'member__membership_type',
+    'copy_reference': 'book_copy__reference_number',
+    'book_title': 'book_copy__book__title',
+    'isbn': 'book_copy__book__isbn',
+}
+
+FEE_EXPORT_COLUMNS = {
+    'id': 'id',
+    'loan_id': 'loan_id',
+    'checkout_date': 'loan__checkout_date',
+    'fee_type': 'fee_type',
+    'amount': 'amount',
+    'date_assessed': 'date_assessed',
+    'date_paid': 'date_paid',
+    'status': 'status',
+    'username': 'loan__member__user__username',
+    'copy_reference': 'loan__book_copy__reference_number',
+}
+
+
+@login_required
+@permission_required('circulation.view_loan')
+def loan_export(request):
+    """
+    Stream loans checked out in the circulation_report date range.
+
+    ``status`` takes the loan_list filters (active, returned, overdue) and
+    ``format`` is csv or jsonl.
+    """
+    from_date, to_date = _report_dates(request)
+    loans = Loan.objects.filter(checkout_date__range=(from_date, to_date)).order_by('checkout_date', 'id')
+    
+    loan_status = request.GET.get('status', '')
+    if loan_status == 'active':
+        loans = loans.filter(return_date__isnull=True)
+    elif loan_status == 'returned':
+        loans = loans.filter(return_date__isnull=False)
+    elif loan_status == 'overdue':
+        loans = loans.filter(return_date__isnull=True, due_date__lt=timezone.now().date())
+    
+    return export_response(loans, LOAN_EXPORT_COLUMNS, f'loans-{from_date}-{to_date}',
+                           request.GET.get('format', 'csv'))
+
+
+@login_required
+@permission_required('circulation.view_fee')
+def fee_export(request):
+    """
+    Stream fees on loans checked out in the circulation_report date range,
+    the same rows its fee totals are summed from.
+
+    ``status`` is a fee status code (OU, PA, WA) and ``format`` is csv or jsonl.
+    """
+    from_date, to_date = _report_dates(request)
+    fees = Fee.objects.filter(
+        loan__checkout_date__range=(from_date, to_date)
+    ).order_by('loan__checkout_date', 'id')
+    
+    fee_status = request.GET.get('status', '')
+    if fee_status in dict(Fee.PAYMENT_STATUS_CHOICES):
+        fees = fees.filter(status=fee_status)
+    
+    return export_response(fees, FEE_EXPORT_COLUMNS, f'fees-{from_date}-{to_date}',
+                           request.GET.get('format', 'csv'))
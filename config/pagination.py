@@ -0,0 +1,171 @@
+"""
+Keyset (cursor) pagination for large list views.
+
+Django's Paginator runs a COUNT(*) over the filtered query and pages with
+OFFSET, so deep pages cost as much as reading every row before them.
+CursorPaginator instead orders by a unique key such as
+``('-checkout_date', '-id')`` and fetches the rows after (or before) the
+last key it handed out. Every page costs the same, and counting is
+optional.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+# Rows counted at most by count='estimate'
+COUNT_CAP = 1000
+
+
+def _encode(direction, values):
+    payload = json.dumps({'d': direction, 'v': values}, cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _decode(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload['d'] not in ('n', 'p') or not isinstance(payload['v'], list):
+            return None
+        return payload['d'], payload['v']
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return None
+
+
+class CursorPage:
+    """One page of a CursorPaginator, iterable like a Paginator page"""
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginate ``queryset`` by the unique key ``ordering``.
+
+    The last field of ``ordering`` must be unique (normally ``id``) and none
+    of the fields may be NULL. ``count`` is ``None`` (no count), ``'exact'``
+    or ``'estimate'``, which counts at most COUNT_CAP rows. Key fields may
+    also name annotations, such as the search rank (see
+    search.index.rank_ordering). Cursor values are converted through their
+    fields, and a cursor that does not convert gives the first page.
+    """
+
+    def __init__(self, queryset, ordering, per_page=20, count=None):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.count_mode = count
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        self._count = None
+
+    def _seek(self, values, forward):
+        """Rows strictly after (forward) or before the key ``values``"""
+        condition = Q()
+        for position, field in enumerate(self.ordering):
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[position]})
+            for earlier, value in zip(self.fields[:position], values):
+                step &= Q(**{earlier: value})
+            condition |= step
+        return condition
+
+    def _output_field(self, name):
+        """Model field (or annotation output field) behind a key field"""
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        model = self.queryset.model
+        *path, last = name.split('__')
+        for part in path:
+            model = model._meta.get_field(part).related_model
+        return model._meta.get_field(last)
+
+    def _parse(self, values):
+        """Cursor values converted through their fields, or None if any is invalid"""
+        if len(values) != len(self.fields):
+            return None
+        try:
+            parsed = [self._output_field(name).to_python(value) for name, value in zip(self.fields, values)]
+        except (ValidationError, TypeError, ValueError):
+            return None
+        return None if None in parsed else parsed
+
+    def _reversed(self):
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+
+    def _key(self, obj):
+        values = []
+        for field in self.fields:
+            value = obj
+            for part in field.split('__'):
+                value = getattr(value, part)
+            values.append(value)
+        return values
+
+    def get_page(self, cursor=None):
+        decoded = _decode(cursor) if cursor else None
+        values = self._parse(decoded[1]) if decoded else None
+        # A tampered or stale cursor falls back to the first page
+        direction = decoded[0] if values is not None else 'n'
+
+        if direction == 'n':
+            queryset = self.queryset.order_by(*self.ordering)
+            if values is not None:
+                queryset = queryset.filter(self._seek(values, forward=True))
+        else:
+            queryset = self.queryset.order_by(*self._reversed()).filter(self._seek(values, forward=False))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if direction == 'p':
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = _encode('n', self._key(rows[-1])) if rows and has_next else None
+        previous_cursor = _encode('p', self._key(rows[0])) if rows and has_previous else None
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
+    @property
+    def count(self):
+        """Number of rows, capped at COUNT_CAP when estimating, or None"""
+        if self.count_mode is None:
+            return None
+        if self._count is None:
+            if self.count_mode == 'exact':
+                self._count = self.queryset.count()
+            else:
+                self._count = self.queryset.order_by()[:COUNT_CAP + 1].count()
+        return self._count
+
+    @property
+    def count_is_exact(self):
+        return self.count_mode == 'exact' or (self.count is not None and self.count <= COUNT_CAP)
@@ -0,0 +1,149 @@
+"""
+Per-request SQL profiling.
+
+QueryProfilingMiddleware wraps every database connection with an
+execute_wrapper, so it works with DEBUG off. For each sampled request it
+records the query count, total SQL time, the slowest statements and any
+statement run more than once. It sends these back as a ``Server-Timing``
+header and logs them as a JSON line on the ``config.profiling`` logger.
+
+Streaming responses (the CSV/JSONL exports) run most of their SQL while
+the body is sent. Their content is wrapped so recording continues until
+the last chunk. The log line is written then, while the header, sent
+before the body, covers the view alone.
+
+Configured through the QUERY_PROFILING setting::
+
+    QUERY_PROFILING = {
+        'ENABLED': True,
+        'SAMPLE_RATE': 0.1,        # fraction of requests profiled
+        'THRESHOLD_MS': 100,       # SQL time above which a request is logged as slow
+        'VIEW_THRESHOLDS': {'circulation:loan_list': 50},
+        'SLOWEST': 3,              # statements kept in the log line
+    }
+
+When ENABLED is false the middleware removes itself at startup.
+"""
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('config.profiling')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,
+    'THRESHOLD_MS': 100,
+    'VIEW_THRESHOLDS': {},
+    'SLOWEST': 3,
+}
+
+# Runs of placeholders, so IN lists of any length share a fingerprint
+_PLACEHOLDER_RUN = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+def fingerprint(sql):
+    """SQL with its placeholder lists collapsed, identifying repeated statements"""
+    return _PLACEHOLDER_RUN.sub('%s, ...', sql)
+
+
+class QueryRecorder:
+    """execute_wrapper that times every statement on a connection"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.statements.append((sql, (time.perf_counter() - start) * 1000))
+
+    def summary(self, slowest):
+        counts = Counter(fingerprint(sql) for sql, _ in self.statements)
+        return {
+            'queries': len(self.statements),
+            'sql_ms': round(sum(ms for _, ms in self.statements), 2),
+            'slowest': [
+                {'sql': sql, 'ms': round(ms, 2)}
+                for sql, ms in sorted(self.statements, key=lambda s: s[1], reverse=True)[:slowest]
+            ],
+            'duplicates': [
+                {'sql': sql, 'count': count}
+                for sql, count in counts.most_common() if count > 1
+            ],
+        }
+
+
+class QueryProfilingMiddleware:
+    """Profile the SQL run by a sample of requests"""
+
+    def __init__(self, get_response):
+        self.options = {**DEFAULTS, **getattr(settings, 'QUERY_PROFILING', {})}
+        if not self.options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= self.options['SAMPLE_RATE']:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with self.recording(recorder):
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        profile = recorder.summary(self.options['SLOWEST'])
+        response['Server-Timing'] = (
+            f'sql;dur={profile["sql_ms"]:.2f};desc="{profile["queries"]} queries", '
+            f'total;dur={total_ms:.2f}'
+        )
+        if response.streaming and not response.is_async:
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response, recorder, start
+            )
+        else:
+            self.log(request, response, total_ms, profile)
+        return response
+
+    @staticmethod
+    def recording(recorder):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        return stack
+
+    def stream(self, content, request, response, recorder, start):
+        """Yield the body while recording its SQL, then log the whole request"""
+        try:
+            with self.recording(recorder):
+                yield from content
+        finally:
+            total_ms = (time.perf_counter() - start) * 1000
+            self.log(request, response, total_ms, recorder.summary(self.options['SLOWEST']))
+
+    def log(self, request, response, total_ms, profile):
+        match = request.resolver_match
+        view = match.view_name if match else None
+        threshold = self.options['VIEW_THRESHOLDS'].get(view, self.options['THRESHOLD_MS'])
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 2),
+            'slow': profile['sql_ms'] >= threshold,
+            **profile,
+        }
+        level = logging.WARNING if record['slow'] else logging.INFO
+        logger.log(level, json.dumps(record))
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,10 +41,16 @@ INSTALLED_APPS = [
     'library',
     'inventory',
     'circulation',
-    
+    'search',
 ]
 
+# The benchmarks app (seeding, benchmark_views, benchmark_indexes) is for
+# development machines and CI only: BENCHMARKS=1 enables it
+if os.environ.get('BENCHMARKS'):
+    INSTALLED_APPS.append('benchmarks')
+
 MIDDLEWARE = [
+    'config.profiling.QueryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -120,6 +127,40 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# The catalog cache (library.cache) backend is picked with CATALOG_CACHE:
+# locmem (per process), file (shared by processes on one host) or redis
+# (CATALOG_CACHE_URL, needs the redis package).
+
+CATALOG_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'catalog',
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CATALOG_CACHE_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': CATALOG_CACHE_BACKENDS[os.environ.get('CATALOG_CACHE', 'locmem')],
+}
+
+# Read Author/Category/Publisher.book_count in the admin instead of counting
+# books per changelist query; worthwhile for very large catalogs
+LIBRARY_BOOK_COUNT_COLUMN = False
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -127,3 +168,39 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Restock planning report (inventory.restock): loans counted over
+# DEMAND_DAYS, and the days an order takes to arrive
+RESTOCK_PLAN = {
+    'DEMAND_DAYS': 90,
+    'LEAD_DAYS': 14,
+}
+
+# Resized variants of covers and author photos (library.thumbnails)
+THUMBNAILS = {
+    'SIZES': {'small': 64, 'medium': 150, 'large': 400},
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'WORKERS': 2,
+}
+
+# Per-request SQL profiling (config.profiling); the middleware removes
+# itself when disabled
+QUERY_PROFILING = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.1,
+    'THRESHOLD_MS': 100,
+    'VIEW_THRESHOLDS': {},
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'config.profiling': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'library.thumbnails': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
@@ -9,6 +9,7 @@ urlpatterns = [
     path('inventory/', include('inventory.urls')),
     path('', RedirectView.as_view(url='/inventory/', permanent=False)),  # <--- ESTA LÍNEA
     path('circulation/', include('circulation.urls')),
+    path('library/', include('library.urls')),
     path('', lambda request: redirect('circulation/')),
 ]
 
@@ -1,6 +1,10 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, F, Q
 from django.utils.html import format_html
-from .models import Shelf, InventoryItem, Acquisition
+from . import placement, stock
+from .forms import AcquisitionForm
+from .models import Shelf, InventoryAudit, InventoryItem, Acquisition, StockMovement
 
 @admin.register(Shelf)
 class ShelfAdmin(admin.ModelAdmin):
@@ -10,16 +14,27 @@ class ShelfAdmin(admin.ModelAdmin):
     search_fields = ('name', 'location')
     ordering = ('name',)
 
+    def available_space(self, obj):
+        return obj.available_space
+    available_space.short_description = 'Espacio disponible'
+    available_space.admin_order_field = F('capacity') - F('used_space')
+
 @admin.register(InventoryItem)
 class InventoryItemAdmin(admin.ModelAdmin):
     list_display = ('book', 'shelf', 'quantity', 'condition',
                    'stock_status', 'last_checked')
     list_filter = ('condition', 'shelf', 'last_checked')
+    list_select_related = ('book', 'shelf')
     search_fields = ('book__title', 'shelf__name')
     ordering = ('book__title',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            below_minimum=ExpressionWrapper(Q(quantity__lte=F('minimum_quantity')), output_field=BooleanField())
+        )
+
     def stock_status(self, obj):
-        if obj.needs_restock:
+        if obj.below_minimum:
             return format_html(
                 '<span style="color: red;">Necesita Reposición</span>'
             )
@@ -27,6 +42,7 @@ class InventoryItemAdmin(admin.ModelAdmin):
             '<span style="color: green;">OK</span>'
         )
     stock_status.short_description = 'Estado del Stock'
+    stock_status.admin_order_field = 'below_minimum'
 
 @admin.register(Acquisition)
 class AcquisitionAdmin(admin.ModelAdmin):
@@ -34,4 +50,82 @@ class AcquisitionAdmin(admin.ModelAdmin):
                    'date_acquired', 'cost')
     list_filter = ('acquisition_type', 'date_acquired')
     search_fields = ('book__title', 'supplier', 'invoice_number')
-    ordering = ('-date_acquired',)
\ No newline at end of file
+    ordering = ('-date_acquired',)
+    form = AcquisitionForm
+    actions = ['place_on_shelves']
+
+    def get_fields(self, request, obj=None):
+        fields = super().get_fields(request, obj)
+        if obj is not None:
+            # Stock was received when the acquisition was added
+            fields = [f for f in fields if f not in ('shelf', 'condition')]
+        return fields
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None:
+            return ('book', 'quantity')
+        return ()
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            if change:
+                return
+            if form.cleaned_data['shelf'] is not None:
+                stock.receive(obj, form.cleaned_data['shelf'], form.cleaned_data['condition'],
+                              user=request.user)
+            else:
+                placement.place([obj], form.cleaned_data['condition'], user=request.user)
+
+    @admin.action(description='Colocar en estanterías las adquisiciones sin recibir')
+    def place_on_shelves(self, request, queryset):
+        pending = list(queryset.filter(movements__isnull=True))
+        placements = placement.place(pending, user=request.user)
+        unshelved = sum(p.quantity for p in placements if p.shelf_id is None)
+        self.message_user(request, f'{len(pending)} adquisiciones colocadas en '
+                                   f'{len({p.shelf_id for p in placements} - {None})} estanterías.')
+        if unshelved:
+            self.message_user(request, f'{unshelved} unidades quedaron sin estantería por falta de espacio.',
+                              messages.WARNING)
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'item', 'kind', 'quantity', 'acquisition', 'user', 'note')
+    list_filter = ('kind', 'created_at')
+    list_select_related = ('item__book', 'item__shelf', 'acquisition__book', 'user')
+    search_fields = ('item__book__title', 'note', 'batch')
+    ordering = ('-id',)
+
+    # The ledger is append-only; movements are written by inventory.stock
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(InventoryAudit)
+class InventoryAuditAdmin(admin.ModelAdmin):
+    list_display = ('shelf', 'created_at', 'user', 'scanned', 'discrepancy_count', 'unknown_count')
+    list_filter = ('shelf', 'created_at')
+    list_select_related = ('shelf', 'user')
+    ordering = ('-created_at',)
+    readonly_fields = ('shelf', 'user', 'created_at', 'scanned', 'duplicates',
+                       'unknown_references', 'discrepancies', 'batch')
+
+    def discrepancy_count(self, obj):
+        return len(obj.discrepancies)
+    discrepancy_count.short_description = 'Diferencias'
+
+    def unknown_count(self, obj):
+        return len(obj.unknown_references)
+    unknown_count.short_description = 'Referencias desconocidas'
+
+    # Audits are recorded through inventory.audit
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
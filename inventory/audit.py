@@ -0,0 +1,167 @@
+"""
+Shelf audits from scanned copy reference numbers.
+
+An AuditSession collects the BookCopy.reference_number values scanned on
+one shelf (from any iterable, so a request body or file can be streamed
+line by line). reconcile() then:
+
+* resolves the scanned numbers to books in chunks of SCAN_CHUNK,
+* compares counted copies per book with the quantities of the shelf's
+  inventory items, using set and Counter operations in memory,
+* appends one AUDIT ledger movement per changed item (one INSERT
+  batch), and
+* refreshes last_checked for the whole shelf with one UPDATE, writes
+  the corrected quantities with one UPDATE per distinct value, and
+  adjusts Shelf.used_space with one UPDATE.
+
+A shortage is taken from the item in the worst condition first. A
+surplus goes to the GOOD item, or to a new one for books the shelf had
+no item for. The outcome is saved as an InventoryAudit row.
+"""
+import uuid
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from circulation.models import BookCopy
+from .models import InventoryAudit, InventoryItem, Shelf, StockMovement
+
+# Reference numbers resolved per query
+SCAN_CHUNK = 2000
+
+# Conditions a shortage is taken from first
+WORST_FIRST = ['DAMAGED', 'POOR', 'FAIR', 'GOOD', 'NEW']
+
+# Condition of items created for books found on a shelf unexpectedly
+SURPLUS_CONDITION = 'GOOD'
+
+
+class AuditSession:
+    """Scanned reference numbers for one shelf"""
+
+    def __init__(self, shelf, user=None):
+        self.shelf = shelf
+        self.user = user
+        self.references = set()
+        self.duplicates = 0
+
+    def scan(self, references):
+        """Add scanned reference numbers; blank lines are ignored"""
+        for reference in references:
+            if isinstance(reference, bytes):
+                reference = reference.decode()
+            reference = reference.strip()
+            if not reference:
+                continue
+            if reference in self.references:
+                self.duplicates += 1
+            else:
+                self.references.add(reference)
+        return self
+
+    def _counted(self):
+        """Copies counted per book id, and the reference numbers matching no copy"""
+        references = sorted(self.references)
+        books = {}
+        for start in range(0, len(references), SCAN_CHUNK):
+            books.update(BookCopy.objects.filter(
+                reference_number__in=references[start:start + SCAN_CHUNK]
+            ).values_list('reference_number', 'book_id'))
+        return Counter(books.values()), sorted(self.references - books.keys())
+
+    def reconcile(self):
+        """Correct the shelf's items to the scan and return the saved InventoryAudit"""
+        counted, unknown = self._counted()
+        now = timezone.now()
+        with transaction.atomic():
+            items = list(InventoryItem.objects.select_for_update().filter(shelf=self.shelf).order_by())
+            expected = Counter()
+            by_book = {}
+            for item in items:
+                expected[item.book_id] += item.quantity
+                by_book.setdefault(item.book_id, []).append(item)
+
+            # Books new to the shelf get an empty item to receive the surplus
+            new_books = counted.keys() - expected.keys()
+            if new_books:
+                created = InventoryItem.objects.bulk_create(
+                    InventoryItem(book_id=book_id, shelf=self.shelf, condition=SURPLUS_CONDITION,
+                                  quantity=0, last_checked=now)
+                    for book_id in sorted(new_books)
+                )
+                items.extend(created)
+                for item in created:
+                    by_book[item.book_id] = [item]
+
+            discrepancies = []
+            deltas = {}
+            for book_id in sorted(expected.keys() | counted.keys()):
+                difference = counted[book_id] - expected[book_id]
+                if not difference:
+                    continue
+                discrepancies.append({'book': book_id, 'expected': expected[book_id], 'counted': counted[book_id]})
+                deltas.update(_spread(by_book[book_id], difference))
+
+            batch = uuid.uuid4() if deltas else None
+            if deltas:
+                StockMovement.objects.bulk_create(
+                    StockMovement(item=item, kind=StockMovement.AUDIT, quantity=delta, batch=batch,
+                                  user=self.user, note="Auditoría de estantería")
+                    for item, delta in deltas.items()
+                )
+                for item, delta in deltas.items():
+                    item.quantity += delta
+                Shelf.objects.filter(pk=self.shelf.pk).update(
+                    used_space=F('used_space') + sum(deltas.values())
+                )
+
+            # Every item on the shelf was checked; this also covers the new ones
+            InventoryItem.objects.filter(shelf=self.shelf).update(last_checked=now)
+            _write_quantities(deltas)
+            for item in items:
+                item.last_checked = now
+                # InventoryItem.save() diffs against this; see InventoryItem.from_db
+                item._stored_space = (item.shelf_id, item.quantity)
+
+            return InventoryAudit.objects.create(
+                shelf=self.shelf, user=self.user, scanned=len(self.references),
+                duplicates=self.duplicates, unknown_references=unknown,
+                discrepancies=discrepancies, batch=batch,
+            )
+
+
+def _write_quantities(items):
+    """
+    Save the quantities of items with one UPDATE per distinct value.
+
+    Shelf quantities are small numbers, so there are few distinct values.
+    This is far cheaper than bulk_update's CASE over thousands of rows.
+    """
+    by_quantity = defaultdict(list)
+    for item in items:
+        by_quantity[item.quantity].append(item.pk)
+    for quantity, pks in by_quantity.items():
+        for start in range(0, len(pks), SCAN_CHUNK):
+            InventoryItem.objects.filter(pk__in=pks[start:start + SCAN_CHUNK]).update(quantity=quantity)
+
+
+def _spread(items, difference):
+    """Per-item deltas adding up to difference; see the module docstring"""
+    if difference > 0:
+        target = next((item for item in items if item.condition == SURPLUS_CONDITION), items[0])
+        return {target: difference}
+    deltas = {}
+    shortage = -difference
+    for item in sorted(items, key=lambda item: WORST_FIRST.index(item.condition)):
+        take = min(item.quantity, shortage)
+        if take:
+            deltas[item] = -take
+            shortage -= take
+    return deltas
+
+
+def audit_shelf(shelf, references, user=None):
+    """Scan references for shelf and reconcile in one call"""
+    return AuditSession(shelf, user).scan(references).reconcile()
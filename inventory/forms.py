@@ -19,6 +19,20 @@ class InventoryItemForm(forms.ModelForm):
         }
 
 class AcquisitionForm(forms.ModelForm):
+    # Where the acquired copies go; not stored on the acquisition itself.
+    # Left blank, inventory.placement picks the shelves.
+    shelf = forms.ModelChoiceField(
+        queryset=Shelf.objects.filter(is_active=True),
+        required=False,
+        empty_label='Automática'
+    )
+    condition = forms.ChoiceField(
+        choices=InventoryItem.CONDITION_CHOICES,
+        initial='NEW'
+    )
+    # The model allows 0, but receiving stock needs at least one unit
+    quantity = forms.IntegerField(min_value=1)
+
     class Meta:
         model = Acquisition
         fields = ['book', 'quantity', 'acquisition_type', 'cost',
@@ -27,10 +41,20 @@ class AcquisitionForm(forms.ModelForm):
             'notes': forms.Textarea(attrs={'rows': 3}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            # Stock was received when the acquisition was added
+            del self.fields['shelf'], self.fields['condition']
+
 class InventorySearchForm(forms.Form):
     search = forms.CharField(required=False)
     condition = forms.ChoiceField(
         choices=[('', '---')] + InventoryItem.CONDITION_CHOICES,
         required=False
     )
-    needs_restock = forms.BooleanField(required=False)
\ No newline at end of file
+    needs_restock = forms.BooleanField(required=False)
+
+class RestockPlanForm(forms.Form):
+    demand_days = forms.IntegerField(min_value=1, max_value=3650, required=False)
+    lead_days = forms.IntegerField(min_value=0, max_value=365, required=False)
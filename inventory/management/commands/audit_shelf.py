@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import audit
+from inventory.models import Shelf
+
+
+class Command(BaseCommand):
+    help = "Reconcile a shelf against a file of scanned copy reference numbers, one per line"
+
+    def add_arguments(self, parser):
+        parser.add_argument('shelf', type=int, help="Shelf id")
+        parser.add_argument('path', help="Scan file, or - for standard input")
+
+    def handle(self, *args, **options):
+        try:
+            shelf = Shelf.objects.get(pk=options['shelf'])
+        except Shelf.DoesNotExist:
+            raise CommandError(f"Shelf {options['shelf']} does not exist")
+
+        path = options['path']
+        try:
+            stream = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+        with stream:
+            result = audit.audit_shelf(shelf, stream)
+
+        for reference in result.unknown_references:
+            self.stderr.write(f"Unknown reference {reference}")
+        for row in result.discrepancies:
+            self.stdout.write(f"Book {row['book']}: expected {row['expected']}, counted {row['counted']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Audited {shelf.name}: {result.scanned} scanned, {len(result.discrepancies)} discrepancies, "
+            f"{len(result.unknown_references)} unknown"
+        ))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+
+from inventory import stock
+from inventory.models import InventoryItem, Shelf
+
+
+class Command(BaseCommand):
+    help = "Replay the stock ledger to verify or rebuild InventoryItem.quantity and Shelf.used_space"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Only report items whose quantity differs from the ledger; exit non-zero if any",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=stock.REPLAY_CHUNK,
+            help="Ledger rows read per query",
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        with transaction.atomic():
+            totals = stock.replay(options['chunk_size'])
+            drifted = [
+                (pk, quantity, totals.get(pk, 0))
+                for pk, quantity in InventoryItem.objects.values_list('pk', 'quantity').iterator()
+                if quantity != totals.get(pk, 0)
+            ]
+
+            if options['check']:
+                for pk, stored, replayed in drifted:
+                    self.stdout.write(f"Item {pk}: stored {stored}, ledger {replayed}")
+                if drifted:
+                    raise CommandError(f"{len(drifted)} item quantity(ies) out of step with the ledger")
+                self.stdout.write(self.style.SUCCESS("All item quantities match the ledger"))
+                return
+
+            size = options['chunk_size']
+            for start in range(0, len(drifted), size):
+                chunk = drifted[start:start + size]
+                InventoryItem.objects.filter(pk__in=[pk for pk, _, _ in chunk]).update(quantity=Case(
+                    *[When(pk=pk, then=Value(replayed)) for pk, _, replayed in chunk],
+                    output_field=IntegerField(),
+                ))
+            Shelf.objects.refresh_used_space()
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stock from the ledger ({len(drifted)} corrected)"))
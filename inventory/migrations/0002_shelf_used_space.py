@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-16 23:15
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_used_space(apps, schema_editor):
+    Shelf = apps.get_model('inventory', 'Shelf')
+    InventoryItem = apps.get_model('inventory', 'InventoryItem')
+    used = InventoryItem.objects.filter(shelf=OuterRef('pk')).order_by().values(
+        'shelf'
+    ).annotate(total=Sum('quantity')).values('total')
+    Shelf.objects.update(used_space=Coalesce(Subquery(used), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shelf',
+            name='used_space',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Suma de cantidades de los items, mantenida por InventoryItem'),
+        ),
+        migrations.RunPython(backfill_used_space, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-16 23:43
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+def open_balances(apps, schema_editor):
+    # Existing quantities become the first entry of each item's ledger
+    InventoryItem = apps.get_model('inventory', 'InventoryItem')
+    StockMovement = apps.get_model('inventory', 'StockMovement')
+    StockMovement.objects.bulk_create(
+        (StockMovement(item_id=pk, kind='OPENING', quantity=quantity, batch=uuid.uuid4())
+         for pk, quantity in InventoryItem.objects.filter(quantity__gt=0).values_list('pk', 'quantity').iterator()),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0002_shelf_used_space'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('OPENING', 'Saldo inicial'), ('ACQUISITION', 'Adquisición'), ('WITHDRAWAL', 'Baja'), ('TRANSFER', 'Traslado'), ('CONDITION', 'Cambio de estado'), ('ADJUSTMENT', 'Ajuste')], max_length=12)),
+                ('quantity', models.IntegerField()),
+                ('batch', models.UUIDField(db_index=True, default=uuid.uuid4, editable=False)),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('acquisition', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='inventory.acquisition')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='inventory.inventoryitem')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['item', 'id'], name='stockmovement_item_idx')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-16 23:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_stockmovement'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='kind',
+            field=models.CharField(choices=[('OPENING', 'Saldo inicial'), ('ACQUISITION', 'Adquisición'), ('WITHDRAWAL', 'Baja'), ('TRANSFER', 'Traslado'), ('CONDITION', 'Cambio de estado'), ('ADJUSTMENT', 'Ajuste'), ('AUDIT', 'Auditoría')], max_length=12),
+        ),
+        migrations.CreateModel(
+            name='InventoryAudit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('scanned', models.PositiveIntegerField(default=0)),
+                ('duplicates', models.PositiveIntegerField(default=0)),
+                ('unknown_references', models.JSONField(blank=True, default=list)),
+                ('discrepancies', models.JSONField(blank=True, default=list)),
+                ('batch', models.UUIDField(blank=True, help_text='Lote de movimientos de stock con los ajustes', null=True)),
+                ('shelf', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='audits', to='inventory.shelf')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -1,8 +1,37 @@
-from django.db import models
+import uuid
+
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
+from circulation.models import BookCopy
 from library.models import Book
 from django.urls import reverse
 
+class ShelfQuerySet(models.QuerySet):
+    def with_space(self):
+        """Annotate used and free space from the items in one aggregate query"""
+        return self.annotate(
+            used_quantity=Coalesce(Sum('items__quantity'), 0),
+            free_space=F('capacity') - Coalesce(Sum('items__quantity'), 0),
+        )
+
+    def with_available_copies(self):
+        """Annotate the number of available copies linked to each shelf"""
+        copies = BookCopy.objects.filter(shelf=OuterRef('pk'), status='AV').order_by().values(
+            'shelf'
+        ).annotate(total=Count('pk')).values('total')
+        return self.annotate(available_copies=Coalesce(Subquery(copies), 0))
+
+    def refresh_used_space(self):
+        """Recompute the cached used_space column from the items"""
+        used = InventoryItem.objects.filter(shelf=OuterRef('pk')).order_by().values(
+            'shelf'
+        ).annotate(total=Sum('quantity')).values('total')
+        return self.update(used_space=Coalesce(Subquery(used), 0))
+
+
 class Shelf(models.Model):
     """Modelo para estanterías de la biblioteca"""
     name = models.CharField(max_length=50)
@@ -13,9 +42,16 @@ class Shelf(models.Model):
     )
     description = models.TextField(blank=True)
     is_active = models.BooleanField(default=True)
+    used_space = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Suma de cantidades de los items, mantenida por InventoryItem"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ShelfQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = 'Shelves'
         ordering = ['name']
@@ -28,9 +64,52 @@ class Shelf(models.Model):
 
     @property
     def available_space(self):
-        used_space = sum(item.quantity for item in self.items.all())
+        # Prefer the live figure when the row came from with_space()
+        used_space = getattr(self, 'used_quantity', self.used_space)
         return self.capacity - used_space
 
+class InventoryItemQuerySet(models.QuerySet):
+    def release_shelves(self):
+        """
+        Lower Shelf.used_space by the stored quantities of these items.
+
+        One UPDATE covers every shelf, however many items there are. Run it
+        before the items are deleted: deletes through the ORM go through
+        InventoryItemQuerySet.delete() and InventoryItem.delete(), and
+        cascades from Book through inventory.signals.
+        """
+        released = dict(
+            self.filter(shelf__isnull=False, quantity__gt=0).order_by().values('shelf').annotate(
+                units=Sum('quantity')
+            ).values_list('shelf', 'units')
+        )
+        if released:
+            Shelf.objects.filter(pk__in=list(released)).update(used_space=F('used_space') - Case(
+                *[When(pk=pk, then=Value(units)) for pk, units in released.items()],
+                default=Value(0), output_field=IntegerField(),
+            ))
+
+    def close_ledger(self):
+        """
+        Write a closing withdrawal for the stock of each of these items.
+
+        The movements outlive the items (their item becomes NULL), so the
+        note records which book the units belonged to.
+        """
+        StockMovement.objects.bulk_create(
+            StockMovement(item_id=pk, kind=StockMovement.WITHDRAWAL, quantity=-quantity,
+                          note=f"Item eliminado: {title}"[:200])
+            for pk, quantity, title in self.filter(quantity__gt=0).order_by().values_list(
+                'pk', 'quantity', 'book__title'
+            )
+        )
+
+    def delete(self):
+        with transaction.atomic():
+            self.close_ledger()
+            self.release_shelves()
+            return super().delete()
+
 class InventoryItem(models.Model):
     """Modelo para items en inventario"""
     CONDITION_CHOICES = [
@@ -67,6 +146,8 @@ class InventoryItem(models.Model):
     notes = models.TextField(blank=True)
     last_checked = models.DateTimeField(auto_now=True)
 
+    objects = InventoryItemQuerySet.as_manager()
+
     class Meta:
         ordering = ['book__title']
         unique_together = ['book', 'shelf', 'condition']
@@ -74,6 +155,43 @@ class InventoryItem(models.Model):
     def __str__(self):
         return f"{self.book.title} - {self.quantity} unidades"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored placement to adjust Shelf.used_space on save
+        instance._stored_space = (instance.__dict__.get('shelf_id'), instance.__dict__.get('quantity'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        old_shelf, old_quantity = getattr(self, '_stored_space', (None, 0))
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if old_shelf == self.shelf_id:
+                self._adjust_shelf(self.shelf_id, self.quantity - (old_quantity or 0))
+            else:
+                self._adjust_shelf(old_shelf, -(old_quantity or 0))
+                self._adjust_shelf(self.shelf_id, self.quantity)
+            if self.quantity != (old_quantity or 0):
+                # Quantities typed in by hand are recorded as ledger adjustments
+                StockMovement.objects.create(
+                    item=self, kind=StockMovement.ADJUSTMENT,
+                    quantity=self.quantity - (old_quantity or 0),
+                )
+        self._stored_space = (self.shelf_id, self.quantity)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            items = InventoryItem.objects.filter(pk=self.pk)
+            items.close_ledger()
+            items.release_shelves()
+            return super().delete(*args, **kwargs)
+
+    @staticmethod
+    def _adjust_shelf(shelf_id, delta):
+        if shelf_id is None or not delta:
+            return
+        Shelf.objects.filter(pk=shelf_id).update(used_space=F('used_space') + delta)
+
     @property
     def needs_restock(self):
         return self.quantity <= self.minimum_quantity
@@ -108,4 +226,106 @@ class Acquisition(models.Model):
     notes = models.TextField(blank=True)
 
     def __str__(self):
-        return f"{self.book.title} - {self.quantity} unidades ({self.get_acquisition_type_display()})"
\ No newline at end of file
+        return f"{self.book.title} - {self.quantity} unidades ({self.get_acquisition_type_display()})"
+
+class StockMovement(models.Model):
+    """
+    Append-only stock ledger. InventoryItem.quantity is the running sum of
+    an item's movements; see inventory.stock for how both are written.
+    Deleting an item closes its stock with a withdrawal and keeps its
+    movements, detached from the item.
+    """
+    OPENING = 'OPENING'
+    ACQUISITION = 'ACQUISITION'
+    WITHDRAWAL = 'WITHDRAWAL'
+    TRANSFER = 'TRANSFER'
+    CONDITION = 'CONDITION'
+    ADJUSTMENT = 'ADJUSTMENT'
+    AUDIT = 'AUDIT'
+    KIND_CHOICES = [
+        (OPENING, 'Saldo inicial'),
+        (ACQUISITION, 'Adquisición'),
+        (WITHDRAWAL, 'Baja'),
+        (TRANSFER, 'Traslado'),
+        (CONDITION, 'Cambio de estado'),
+        (ADJUSTMENT, 'Ajuste'),
+        (AUDIT, 'Auditoría'),
+    ]
+
+    item = models.ForeignKey(
+        InventoryItem,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='movements'
+    )
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    # Signed: positive adds units to the item, negative removes them
+    quantity = models.IntegerField()
+    # Rows written together (both legs of a transfer) share a batch
+    batch = models.UUIDField(default=uuid.uuid4, editable=False, db_index=True)
+    acquisition = models.ForeignKey(
+        Acquisition,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='movements'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    note = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['item', 'id'], name='stockmovement_item_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity:+d} ({self.item_id})"
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Stock movements are append-only")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Stock movements are append-only")
+
+class InventoryAudit(models.Model):
+    """Result of reconciling a shelf against a scan of its copies"""
+    shelf = models.ForeignKey(
+        Shelf,
+        on_delete=models.CASCADE,
+        related_name='audits'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    scanned = models.PositiveIntegerField(default=0)
+    duplicates = models.PositiveIntegerField(default=0)
+    # Scanned reference numbers that match no BookCopy
+    unknown_references = models.JSONField(default=list, blank=True)
+    # One {"book": id, "expected": n, "counted": n} per book that differed
+    discrepancies = models.JSONField(default=list, blank=True)
+    batch = models.UUIDField(
+        null=True,
+        blank=True,
+        help_text="Lote de movimientos de stock con los ajustes"
+    )
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.shelf.name} {self.created_at:%Y-%m-%d %H:%M} ({len(self.discrepancies)} diferencias)"
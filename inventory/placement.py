@@ -0,0 +1,158 @@
+"""
+Shelf placement for incoming stock.
+
+plan() assigns a batch of (book, quantity) requests to active shelves.
+Free space comes from one aggregate query (Shelf.objects.with_space()).
+A second query finds the categories already on each shelf, and a third
+finds each book's categories.
+
+Requests are grouped by category and the groups placed largest first.
+A group goes whole onto the shelf that already holds most of its
+category and has room. Ties go to the shelf with the fewest units of
+other categories, then to the tightest fit. If no single shelf has
+room, the group is spread over shelves in the same order (largest free
+space before tightest fit), largest books first. Units that fit nowhere
+are left unshelved (shelf None).
+
+apply() writes the result: missing InventoryItem rows are created with
+one bulk_create, and the units are added through one ledger batch (see
+inventory.stock), whatever the number of requests.
+"""
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import Sum
+
+from library.models import Book
+from . import stock
+from .models import InventoryItem, Shelf, StockMovement
+
+
+@dataclass
+class Request:
+    book_id: int
+    quantity: int
+    acquisition_id: Optional[int] = None
+
+
+@dataclass
+class Placement:
+    book_id: int
+    shelf_id: Optional[int]
+    quantity: int
+    acquisition_id: Optional[int] = None
+
+
+@dataclass
+class _Space:
+    id: int
+    free: int
+    # Units per category already on the shelf
+    categories: Counter = field(default_factory=Counter)
+
+    def mixed(self, category):
+        """Units of other categories that category would share the shelf with"""
+        return sum(self.categories.values()) - self.categories[category]
+
+
+def load_shelves():
+    """Free space and category units of every active shelf"""
+    shelves = {
+        shelf.pk: _Space(shelf.pk, max(shelf.available_space, 0))
+        for shelf in Shelf.objects.filter(is_active=True).with_space()
+    }
+    rows = InventoryItem.objects.filter(
+        shelf__in=list(shelves), quantity__gt=0, book__categories__isnull=False,
+    ).order_by().values('shelf', 'book__categories').annotate(
+        units=Sum('quantity')
+    ).values_list('shelf', 'book__categories', 'units')
+    for shelf_id, category_id, units in rows:
+        shelves[shelf_id].categories[category_id] += units
+    return shelves
+
+
+def _book_categories(book_ids, shelves):
+    """The category each book is grouped under: the one most shelved already"""
+    shelved = Counter()
+    for space in shelves.values():
+        shelved.update(space.categories)
+    links = defaultdict(list)
+    for book_id, category_id in Book.categories.through.objects.filter(
+        book_id__in=book_ids
+    ).values_list('book_id', 'category_id'):
+        links[book_id].append(category_id)
+    return {
+        book_id: max(categories, key=lambda pk: (shelved[pk], -pk))
+        for book_id, categories in links.items()
+    }
+
+
+def plan(requests, shelves=None):
+    """List of Placements for requests; see the module docstring"""
+    shelves = load_shelves() if shelves is None else shelves
+    requests = [r for r in requests if r.quantity > 0]
+    category_of = _book_categories({r.book_id for r in requests}, shelves)
+
+    groups = defaultdict(list)
+    for request in requests:
+        groups[category_of.get(request.book_id)].append(request)
+
+    placements = []
+    for category, group in sorted(groups.items(), key=lambda g: -sum(r.quantity for r in g[1])):
+        total = sum(r.quantity for r in group)
+        fitting = [s for s in shelves.values() if s.free >= total]
+        if fitting:
+            order = [min(fitting, key=lambda s: (-s.categories[category], s.mixed(category), s.free, s.id))]
+        else:
+            order = sorted(shelves.values(),
+                           key=lambda s: (-s.categories[category], s.mixed(category), -s.free, s.id))
+
+        for request in sorted(group, key=lambda r: -r.quantity):
+            remaining = request.quantity
+            for space in order:
+                take = min(space.free, remaining)
+                if take <= 0:
+                    continue
+                placements.append(Placement(request.book_id, space.id, take, request.acquisition_id))
+                space.free -= take
+                if category is not None:
+                    space.categories[category] += take
+                remaining -= take
+                if not remaining:
+                    break
+            if remaining:
+                placements.append(Placement(request.book_id, None, remaining, request.acquisition_id))
+    return placements
+
+
+def apply(placements, condition='NEW', user=None, note=''):
+    """Create the missing items and add the placed units in one ledger batch"""
+    if not placements:
+        return []
+    pairs = {(p.book_id, p.shelf_id) for p in placements}
+    with transaction.atomic():
+        items = {
+            (book_id, shelf_id): pk
+            for pk, book_id, shelf_id in InventoryItem.objects.filter(
+                book_id__in={book_id for book_id, _ in pairs}, condition=condition,
+            ).order_by().values_list('pk', 'book_id', 'shelf_id')
+            if (book_id, shelf_id) in pairs
+        }
+        created = InventoryItem.objects.bulk_create(
+            InventoryItem(book_id=book_id, shelf_id=shelf_id, condition=condition, quantity=0)
+            for book_id, shelf_id in sorted(pairs - set(items), key=str)
+        )
+        items.update({(item.book_id, item.shelf_id): item.pk for item in created})
+        stock.record([
+            stock.Movement(items[p.book_id, p.shelf_id], p.quantity, StockMovement.ACQUISITION, p.acquisition_id)
+            for p in placements
+        ], user=user, note=note)
+    return placements
+
+
+def place(acquisitions, condition='NEW', user=None):
+    """Plan and apply shelf placements for acquisitions; returns the Placements"""
+    return apply(plan([Request(a.book_id, a.quantity, a.pk) for a in acquisitions]),
+                 condition=condition, user=user)
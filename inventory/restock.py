@@ -0,0 +1,79 @@
+"""
+Restock planning report.
+
+plan() ranks the books to buy in a single query. Inventory items are
+grouped by book, summing stock and minimums over every shelf and
+condition, and correlated subqueries add the book's loans in the demand
+window and its last acquisition. The quantity to order covers the minimum plus the
+loans expected while an order is on its way::
+
+    lead_demand = ceil(loans * lead_days / demand_days)
+    order_quantity = minimum + lead_demand - stock
+
+Acquisitions record when copies arrived but not when they were ordered,
+so the lead time is the RESTOCK_PLAN['LEAD_DAYS'] setting rather than a
+per-supplier figure. Acquired units already count towards stock through
+the ledger (see inventory.stock).
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import Count, DateField, F, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from circulation.models import Loan
+from .models import Acquisition, InventoryItem
+
+DEFAULTS = {
+    'DEMAND_DAYS': 90,
+    'LEAD_DAYS': 14,
+}
+
+# Export headers -> plan() lookups
+COLUMNS = {
+    'book_id': 'book',
+    'title': 'book__title',
+    'isbn': 'book__isbn',
+    'stock': 'stock',
+    'minimum': 'minimum',
+    'loans': 'recent_loans',
+    'last_acquired': 'last_acquired',
+    'order_quantity': 'order_quantity',
+}
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'RESTOCK_PLAN', {})}
+
+
+def _per_book(queryset, aggregate, output_field=None):
+    """Correlated subquery aggregating queryset for the outer row's book"""
+    return Subquery(
+        queryset.filter(book=OuterRef('book')).order_by().values('book').annotate(
+            value=aggregate
+        ).values('value'),
+        output_field=output_field or IntegerField(),
+    )
+
+
+def plan(demand_days=None, lead_days=None, today=None):
+    """One dict per book that falls short, largest order_quantity first"""
+    opts = options()
+    demand_days = demand_days or opts['DEMAND_DAYS']
+    lead_days = opts['LEAD_DAYS'] if lead_days is None else lead_days
+    today = today or timezone.now().date()
+    since = today - datetime.timedelta(days=demand_days)
+
+    loans = Loan.objects.filter(checkout_date__gt=since).annotate(book=F('book_copy__book'))
+    return InventoryItem.objects.order_by().values(
+        'book', 'book__title', 'book__isbn',
+    ).annotate(
+        stock=Sum('quantity'),
+        minimum=Sum('minimum_quantity'),
+        recent_loans=Coalesce(_per_book(loans, Count('pk')), 0),
+        last_acquired=_per_book(Acquisition.objects.all(), Max('date_acquired'), output_field=DateField()),
+        # Integer ceiling division, evaluated by the database
+        lead_demand=(F('recent_loans') * Value(lead_days) + Value(demand_days - 1)) / Value(demand_days),
+        order_quantity=F('minimum') + F('lead_demand') - F('stock'),
+    ).filter(order_quantity__gt=0).order_by('-order_quantity', '-recent_loans', 'book__title')
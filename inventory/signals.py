@@ -0,0 +1,24 @@
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from circulation.models import BookCopy
+from library.models import Book
+from .models import InventoryItem, Shelf
+
+
+@receiver(pre_delete, sender=Book)
+def retire_book_items(sender, instance, **kwargs):
+    # The cascade deletes the book's items without calling their delete()
+    # methods, so close their stock and release the shelf space beforehand
+    items = InventoryItem.objects.filter(book=instance)
+    items.close_ledger()
+    items.release_shelves()
+
+
+@receiver(post_save, sender=Shelf)
+def relabel_shelf_copies(sender, instance, created, raw=False, **kwargs):
+    # BookCopy.shelf_location mirrors the label of the copy's shelf
+    if raw or created:
+        return
+    label = str(instance)[:50]
+    BookCopy.objects.filter(shelf=instance).exclude(shelf_location=label).update(shelf_location=label)
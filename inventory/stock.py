@@ -0,0 +1,191 @@
+"""
+Stock ledger operations.
+
+Every change to a stock level is a StockMovement row. InventoryItem.quantity
+and Shelf.used_space are projections of the ledger: record() appends a
+batch of movements and then applies their summed deltas with one UPDATE
+on the items and one on the shelves, whatever the size of the batch.
+
+Transfers and condition changes move units between two items (an item
+is a book on a shelf in a condition), so they write two movements in the
+same batch. The target item is created with quantity 0 if needed.
+
+The ``rebuild_stock`` command replays the ledger in chunks to check or
+repair the projections. Movements of deleted items stay in the ledger
+with no item and are left out of the replay.
+"""
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from .models import InventoryItem, Shelf, StockMovement
+
+# Movements read per query when replaying the ledger
+REPLAY_CHUNK = 5000
+
+
+class StockError(ValueError):
+    pass
+
+
+@dataclass
+class Movement:
+    item_id: int
+    quantity: int
+    kind: str
+    acquisition_id: Optional[int] = None
+
+
+def _delta_update(queryset, field, deltas):
+    """Add deltas[pk] to field on each row in one UPDATE"""
+    if not deltas:
+        return
+    whens = [When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()]
+    queryset.filter(pk__in=list(deltas)).update(**{
+        field: F(field) + Case(*whens, default=Value(0), output_field=IntegerField()),
+    })
+
+
+def record(movements, user=None, note=''):
+    """
+    Append movements as one batch and apply them to the projections.
+
+    Raises StockError, writing nothing, if an item would go below zero.
+    Returns the batch id.
+    """
+    item_deltas = defaultdict(int)
+    for movement in movements:
+        item_deltas[movement.item_id] += movement.quantity
+
+    batch = uuid.uuid4()
+    with transaction.atomic():
+        stored = {
+            pk: (shelf_id, quantity)
+            for pk, shelf_id, quantity in InventoryItem.objects.select_for_update().filter(
+                pk__in=list(item_deltas)
+            ).order_by().values_list('pk', 'shelf_id', 'quantity')
+        }
+        shelf_deltas = defaultdict(int)
+        for item_id, delta in item_deltas.items():
+            if item_id not in stored:
+                raise StockError(f"Inventory item {item_id} does not exist")
+            shelf_id, quantity = stored[item_id]
+            if quantity + delta < 0:
+                raise StockError(f"Inventory item {item_id} has {quantity} units, cannot remove {-delta}")
+            if shelf_id is not None:
+                shelf_deltas[shelf_id] += delta
+
+        StockMovement.objects.bulk_create(
+            StockMovement(item_id=movement.item_id, kind=movement.kind, quantity=movement.quantity,
+                          acquisition_id=movement.acquisition_id, batch=batch, user=user, note=note)
+            for movement in movements
+        )
+        _delta_update(InventoryItem.objects, 'quantity', {pk: d for pk, d in item_deltas.items() if d})
+        _delta_update(Shelf.objects, 'used_space', {pk: d for pk, d in shelf_deltas.items() if d})
+    return batch
+
+
+def _item(book_id, shelf, condition):
+    """The item for a book on a shelf in a condition, created empty if missing"""
+    item = InventoryItem.objects.filter(book_id=book_id, shelf=shelf, condition=condition).first()
+    if item is None:
+        item = InventoryItem.objects.create(book_id=book_id, shelf=shelf, condition=condition, quantity=0)
+    return item
+
+
+def _sync(*items):
+    """Bring in-memory items in line with the projection after record()"""
+    quantities = dict(InventoryItem.objects.filter(
+        pk__in=[item.pk for item in items]
+    ).order_by().values_list('pk', 'quantity'))
+    for item in items:
+        item.quantity = quantities[item.pk]
+        # InventoryItem.save() diffs against this; see InventoryItem.from_db
+        item._stored_space = (item.shelf_id, item.quantity)
+
+
+def _positive(quantity):
+    if quantity is None or quantity <= 0:
+        raise StockError("Quantity must be positive")
+    return quantity
+
+
+def receive(acquisition, shelf=None, condition='NEW', user=None):
+    """Add an acquisition's units to the matching item; returns the item"""
+    with transaction.atomic():
+        item = _item(acquisition.book_id, shelf, condition)
+        record([Movement(item.pk, _positive(acquisition.quantity), StockMovement.ACQUISITION, acquisition.pk)],
+               user=user, note=acquisition.invoice_number)
+        _sync(item)
+    return item
+
+
+def withdraw(item, quantity, user=None, note=''):
+    """Remove units from an item (lost, discarded, given away)"""
+    batch = record([Movement(item.pk, -_positive(quantity), StockMovement.WITHDRAWAL)], user=user, note=note)
+    _sync(item)
+    return batch
+
+
+def _move(item, target, quantity, kind, user, note):
+    quantity = _positive(item.quantity if quantity is None else quantity)
+    batch = record([
+        Movement(item.pk, -quantity, kind),
+        Movement(target.pk, quantity, kind),
+    ], user=user, note=note)
+    _sync(item, target)
+    return target, batch
+
+
+def transfer(item, shelf, quantity=None, user=None, note=''):
+    """Move units (all by default) to another shelf; returns the target item and batch"""
+    if shelf == item.shelf:
+        raise StockError("The item is already on that shelf")
+    with transaction.atomic():
+        return _move(item, _item(item.book_id, shelf, item.condition), quantity,
+                     StockMovement.TRANSFER, user, note)
+
+
+def change_condition(item, condition, quantity=None, user=None, note=''):
+    """Move units (all by default) to the item for another condition"""
+    if condition == item.condition:
+        raise StockError("The item is already in that condition")
+    with transaction.atomic():
+        return _move(item, _item(item.book_id, item.shelf, condition), quantity,
+                     StockMovement.CONDITION, user, note)
+
+
+def open_balances(items=None):
+    """Opening movements for items with stock but no ledger rows (bulk-loaded data)"""
+    items = (InventoryItem.objects.all() if items is None else items).filter(
+        quantity__gt=0, movements__isnull=True,
+    )
+    return len(StockMovement.objects.bulk_create(
+        (StockMovement(item_id=pk, kind=StockMovement.OPENING, quantity=quantity)
+         for pk, quantity in items.order_by().values_list('pk', 'quantity').iterator()),
+        batch_size=REPLAY_CHUNK,
+    ))
+
+
+def replay(chunk_size=REPLAY_CHUNK):
+    """Quantity per item id from the ledger, summed REPLAY_CHUNK movements at a time"""
+    totals = defaultdict(int)
+    last = 0
+    while True:
+        bounds = list(StockMovement.objects.filter(pk__gt=last).order_by('pk').values_list(
+            'pk', flat=True
+        )[chunk_size - 1:chunk_size])
+        chunk = StockMovement.objects.filter(pk__gt=last, item__isnull=False)
+        if bounds:
+            chunk = chunk.filter(pk__lte=bounds[0])
+        for item_id, total in chunk.order_by().values('item').annotate(
+            total=Sum('quantity')
+        ).values_list('item', 'total'):
+            totals[item_id] += total
+        if not bounds:
+            return totals
+        last = bounds[0]
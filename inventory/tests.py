@@ -1,3 +1,429 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Sum
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from circulation.models import BookCopy, Loan, Member
+from library.models import Author, Book, Category
+from . import audit, placement, restock, stock
+from .models import Shelf, InventoryAudit, InventoryItem, Acquisition, StockMovement
+
+
+class ShelfSpaceTest(TestCase):
+    """Test cases for the cached Shelf.used_space column"""
+
+    def setUp(self):
+        """Create two shelves and a book"""
+        author = Author.objects.create(name="Mario Vargas Llosa")
+        self.book = Book.objects.create(title="La ciudad y los perros", author=author, isbn="9788420412146")
+        self.shelf_a = Shelf.objects.create(name="A1", location="Planta 1", capacity=50)
+        self.shelf_b = Shelf.objects.create(name="B1", location="Planta 2", capacity=30)
+
+    def test_used_space_follows_item_changes(self):
+        """Test create, quantity change, move and delete keep used_space current"""
+        item = InventoryItem.objects.create(book=self.book, shelf=self.shelf_a, quantity=5)
+        self.shelf_a.refresh_from_db()
+        self.assertEqual(self.shelf_a.available_space, 45)
+
+        item = InventoryItem.objects.get(pk=item.pk)
+        item.quantity = 8
+        item.save()
+        self.shelf_a.refresh_from_db()
+        self.assertEqual(self.shelf_a.used_space, 8)
+
+        item.shelf = self.shelf_b
+        item.save()
+        self.shelf_a.refresh_from_db()
+        self.shelf_b.refresh_from_db()
+        self.assertEqual((self.shelf_a.used_space, self.shelf_b.used_space), (0, 8))
+
+        item.delete()
+        self.shelf_b.refresh_from_db()
+        self.assertEqual(self.shelf_b.used_space, 0)
+
+    def test_used_space_follows_bulk_deletes(self):
+        """Test queryset deletes and cascades from the book release the space"""
+        InventoryItem.objects.create(book=self.book, shelf=self.shelf_a, quantity=4, condition='NEW')
+        InventoryItem.objects.create(book=self.book, shelf=self.shelf_a, quantity=3, condition='GOOD')
+        InventoryItem.objects.filter(condition='NEW').delete()
+        self.shelf_a.refresh_from_db()
+        self.assertEqual(self.shelf_a.used_space, 3)
+
+        self.book.delete()
+        self.shelf_a.refresh_from_db()
+        self.assertEqual(self.shelf_a.used_space, 0)
+
+    def test_bulk_delete_queries_do_not_grow_with_items(self):
+        """Test one UPDATE releases the space of every deleted item"""
+        def delete_queries(count):
+            book = Book.objects.create(title=f"Lote {count}", author=self.book.author, isbn=f"97800000000{count:02d}")
+            shelves = [self.shelf_a, self.shelf_b]
+            for i in range(count):
+                InventoryItem.objects.create(book=book, shelf=shelves[i % 2], quantity=2,
+                                             condition=InventoryItem.CONDITION_CHOICES[i][0])
+            with CaptureQueriesContext(connection) as captured:
+                book.delete()
+            return len(captured)
+
+        self.assertEqual(delete_queries(2), delete_queries(5))
+        self.shelf_a.refresh_from_db()
+        self.shelf_b.refresh_from_db()
+        self.assertEqual((self.shelf_a.used_space, self.shelf_b.used_space), (0, 0))
+
+    def test_with_space_matches_column(self):
+        """Test with_space() annotates the same figures without per-row queries"""
+        InventoryItem.objects.create(book=self.book, shelf=self.shelf_a, quantity=7, condition='NEW')
+        InventoryItem.objects.create(book=self.book, shelf=self.shelf_a, quantity=3, condition='GOOD')
+        with self.assertNumQueries(1):
+            shelves = {shelf.name: shelf.available_space for shelf in Shelf.objects.with_space()}
+        self.assertEqual(shelves, {'A1': 40, 'B1': 30})
+
+        Shelf.objects.update(used_space=0)
+        Shelf.objects.refresh_used_space()
+        self.assertEqual(Shelf.objects.get(pk=self.shelf_a.pk).used_space, 10)
+
+
+class InventoryExportTest(TestCase):
+    """Test cases for the streaming inventory export"""
+
+    def setUp(self):
+        """Create an item in stock and one below its minimum"""
+        self.user = User.objects.create_user(username='almacen', password='almacenpassword')
+        author = Author.objects.create(name="Julio Cortázar")
+        shelf = Shelf.objects.create(name="C1", location="Planta 1", capacity=50)
+        for i, quantity in enumerate((5, 0)):
+            book = Book.objects.create(title=f"Rayuela {i}", author=author, isbn=f"978843760{i:04d}")
+            InventoryItem.objects.create(book=book, shelf=shelf, quantity=quantity, minimum_quantity=1)
+        self.client.login(username='almacen', password='almacenpassword')
+
+    def test_export_applies_list_filters(self):
+        """The export streams the rows the item list would show"""
+        response = self.client.get(reverse('inventory:item-export'), {'needs_restock': 'on'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,book_title,isbn,shelf,quantity,minimum_quantity,condition')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Rayuela 1', lines[1])
+
+
+class StockLedgerTest(TestCase):
+    """Test cases for the stock movement ledger and its projections"""
+
+    def setUp(self):
+        """Create two shelves, a book and a stocked item"""
+        author = Author.objects.create(name="Gabriela Mistral")
+        self.book = Book.objects.create(title="Desolación", author=author, isbn="9789560000001")
+        self.shelf_a = Shelf.objects.create(name="D1", location="Planta 1", capacity=50)
+        self.shelf_b = Shelf.objects.create(name="D2", location="Planta 2", capacity=50)
+        self.item = InventoryItem.objects.create(book=self.book, shelf=self.shelf_a, quantity=10, condition='GOOD')
+
+    def used_space(self):
+        return tuple(Shelf.objects.filter(pk__in=[self.shelf_a.pk, self.shelf_b.pk])
+                     .order_by('name').values_list('used_space', flat=True))
+
+    def test_movements_update_projection(self):
+        """Withdrawals, transfers and condition changes keep quantities and shelves in step"""
+        with CaptureQueriesContext(connection) as queries:
+            stock.withdraw(self.item, 2, note="Perdidos")
+        self.assertEqual(self.item.quantity, 8)
+        # One UPDATE for the items and one for the shelves
+        self.assertEqual(sum(q['sql'].startswith('UPDATE') for q in queries), 2)
+
+        target, batch = stock.transfer(self.item, self.shelf_b, 3)
+        self.assertEqual((self.item.quantity, target.quantity), (5, 3))
+        self.assertEqual(self.used_space(), (5, 3))
+        self.assertEqual(list(StockMovement.objects.filter(batch=batch).values_list('quantity', flat=True)), [-3, 3])
+
+        damaged, _ = stock.change_condition(target, 'DAMAGED')
+        self.assertEqual((target.quantity, damaged.quantity, damaged.shelf_id), (0, 3, self.shelf_b.pk))
+        self.assertEqual(self.used_space(), (5, 3))
+
+        with self.assertRaises(stock.StockError):
+            stock.withdraw(self.item, 6)
+        self.assertEqual(InventoryItem.objects.get(pk=self.item.pk).quantity, 5)
+
+        # A later hand edit is diffed against the projection, not the stale value
+        self.item.notes = "Revisado"
+        self.item.save()
+        self.assertEqual(StockMovement.objects.filter(kind=StockMovement.ADJUSTMENT).count(), 1)
+
+    def test_acquisition_view_receives_stock(self):
+        """Registering an acquisition adds its units to the chosen shelf"""
+        User.objects.create_user(username='compras', password='compraspassword')
+        self.client.login(username='compras', password='compraspassword')
+        response = self.client.post(reverse('inventory:acquisition-create'), {
+            'book': self.book.pk, 'quantity': 4, 'acquisition_type': 'PURCHASE',
+            'shelf': self.shelf_b.pk, 'condition': 'NEW',
+        })
+        self.assertEqual(response.status_code, 302)
+        item = InventoryItem.objects.get(book=self.book, shelf=self.shelf_b, condition='NEW')
+        self.assertEqual(item.quantity, 4)
+        movement = item.movements.get()
+        self.assertEqual((movement.kind, movement.acquisition, movement.user.username),
+                         (StockMovement.ACQUISITION, Acquisition.objects.get(), 'compras'))
+        self.assertEqual(self.used_space(), (10, 4))
+
+    def test_acquisition_of_no_units_is_rejected(self):
+        """A zero quantity is a form error in the view and the admin, not a server error"""
+        User.objects.create_superuser(username='compras', password='compraspassword')
+        self.client.login(username='compras', password='compraspassword')
+        data = {'book': self.book.pk, 'quantity': 0, 'acquisition_type': 'PURCHASE',
+                'shelf': self.shelf_b.pk, 'condition': 'NEW'}
+        for url in (reverse('inventory:acquisition-create'), reverse('admin:inventory_acquisition_add')):
+            response = self.client.post(url, data)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['adminform' if 'admin' in url else 'form'].errors)
+        self.assertFalse(Acquisition.objects.exists())
+
+        # Once added, an acquisition can be edited without receiving stock again
+        acquisition = Acquisition.objects.create(book=self.book, quantity=2, acquisition_type='PURCHASE')
+        response = self.client.post(reverse('admin:inventory_acquisition_change', args=[acquisition.pk]), {
+            'acquisition_type': 'DONATION', 'supplier': 'Biblioteca Nacional',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Acquisition.objects.get().acquisition_type, 'DONATION')
+
+    def test_deleting_items_keeps_their_movements(self):
+        """Deleted items leave their movements and a closing withdrawal in the ledger"""
+        stock.withdraw(self.item, 2)
+        movements = list(self.item.movements.values_list('pk', flat=True))
+
+        self.item.delete()
+        closed = StockMovement.objects.filter(item__isnull=True)
+        self.assertEqual(closed.count(), len(movements) + 1)
+        self.assertTrue(closed.filter(pk__in=movements).exists())
+        closing = closed.latest('pk')
+        self.assertEqual((closing.kind, closing.quantity), (StockMovement.WITHDRAWAL, -8))
+        self.assertIn(self.book.title, closing.note)
+        self.assertEqual(closed.aggregate(total=Sum('quantity'))['total'], 0)
+
+        item = InventoryItem.objects.create(book=self.book, shelf=self.shelf_b, quantity=3)
+        self.book.delete()
+        self.assertFalse(InventoryItem.objects.filter(pk=item.pk).exists())
+        self.assertEqual(StockMovement.objects.filter(item__isnull=True).aggregate(total=Sum('quantity'))['total'], 0)
+        self.assertEqual(self.used_space(), (0, 0))
+        call_command('rebuild_stock', '--check', stdout=StringIO())
+
+    def test_rebuild_replays_ledger(self):
+        """rebuild_stock reports and repairs drift from the ledger, reading it in chunks"""
+        stock.withdraw(self.item, 1)
+        stock.transfer(self.item, self.shelf_b, 4)
+        InventoryItem.objects.filter(pk=self.item.pk).update(quantity=99)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_stock', '--check', '--chunk-size', '2', stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_stock', '--chunk-size', '2', stdout=out)
+        self.assertIn("1 corrected", out.getvalue())
+        self.assertEqual(InventoryItem.objects.get(pk=self.item.pk).quantity, 5)
+        self.assertEqual(self.used_space(), (5, 4))
+        call_command('rebuild_stock', '--check', stdout=StringIO())
+
+    def test_ledger_is_append_only(self):
+        """Movements cannot be changed or deleted one by one"""
+        movement = self.item.movements.get()
+        self.assertEqual((movement.kind, movement.quantity), (StockMovement.ADJUSTMENT, 10))
+        with self.assertRaises(ValueError):
+            movement.save()
+        with self.assertRaises(ValueError):
+            movement.delete()
+
+
+class RestockPlanTest(TestCase):
+    """Test cases for the restock planning report"""
+
+    def setUp(self):
+        """Create books with stock spread over shelves, loans and an acquisition"""
+        self.user = User.objects.create_user(username='compras', password='compraspassword')
+        author = Author.objects.create(name="Pablo Neruda")
+        shelf_a = Shelf.objects.create(name="E1", location="Planta 1", capacity=50)
+        shelf_b = Shelf.objects.create(name="E2", location="Planta 2", capacity=50)
+        self.popular = Book.objects.create(title="Veinte poemas", author=author, isbn="9789560000101")
+        self.stocked = Book.objects.create(title="Canto general", author=author, isbn="9789560000102")
+        self.short = Book.objects.create(title="Residencia", author=author, isbn="9789560000103")
+        # Stock and minimums are summed over shelves and conditions
+        InventoryItem.objects.create(book=self.popular, shelf=shelf_a, quantity=1, minimum_quantity=2)
+        InventoryItem.objects.create(book=self.popular, shelf=shelf_b, quantity=1, minimum_quantity=1,
+                                     condition='POOR')
+        InventoryItem.objects.create(book=self.stocked, shelf=shelf_a, quantity=9, minimum_quantity=2)
+        InventoryItem.objects.create(book=self.short, shelf=shelf_b, quantity=0, minimum_quantity=1)
+        Acquisition.objects.create(book=self.short, quantity=1, acquisition_type='DONATION')
+
+        member = Member.objects.create(user=self.user)
+        copy = BookCopy.objects.create(book=self.popular, reference_number="NER-1")
+        today = timezone.now().date()
+        for days_ago in (1, 10, 20, 30, 200):
+            Loan.objects.create(member=member, book_copy=copy, checkout_date=today - timedelta(days=days_ago),
+                                due_date=today, return_date=today)
+
+    def test_plan_ranks_shortfalls_in_one_query(self):
+        """Shortfall plus lead-time demand, largest order first"""
+        with self.assertNumQueries(1):
+            rows = list(restock.plan(demand_days=90, lead_days=30))
+        # Popular: minimum 3 + ceil(4 loans * 30 / 90) = 5, minus 2 in stock
+        self.assertEqual(
+            [(row['book__title'], row['stock'], row['recent_loans'], row['order_quantity']) for row in rows],
+            [("Veinte poemas", 2, 4, 3), ("Residencia", 0, 0, 1)],
+        )
+        self.assertEqual(rows[1]['last_acquired'], timezone.now().date())
+
+    def test_report_and_export(self):
+        """The report page lists the plan and the export streams it"""
+        self.client.login(username='compras', password='compraspassword')
+        response = self.client.get(reverse('inventory:restock-plan'), {'lead_days': 0})
+        self.assertEqual([row['book'] for row in response.context['rows']], [self.popular.pk, self.short.pk])
+        self.assertContains(response, "Veinte poemas")
+
+        response = self.client.get(reverse('inventory:restock-export'), {'lead_days': 0})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'book_id,title,isbn,stock,minimum,loans,last_acquired,order_quantity')
+        self.assertTrue(lines[1].startswith(f'{self.popular.pk},Veinte poemas,9789560000101,2,3,4,,'))
+        self.assertEqual(len(lines), 3)
+
+
+class PlacementTest(TestCase):
+    """Test cases for automatic shelf placement of acquisitions"""
+
+    def setUp(self):
+        """Create shelves, one already holding poetry, and books in two categories"""
+        author = Author.objects.create(name="Alfonsina Storni")
+        self.poetry = Category.objects.create(name="Poesía")
+        self.essay = Category.objects.create(name="Ensayo")
+        self.poetry_shelf = Shelf.objects.create(name="F1", location="Planta 1", capacity=10)
+        self.big_shelf = Shelf.objects.create(name="F2", location="Planta 1", capacity=30)
+        self.small_shelf = Shelf.objects.create(name="F3", location="Planta 2", capacity=6)
+        Shelf.objects.create(name="F4", location="Sótano", capacity=100, is_active=False)
+        self.books = []
+        for i, category in enumerate((self.poetry, self.poetry, self.essay, self.essay)):
+            book = Book.objects.create(title=f"Obra {i}", author=author, isbn=f"97895600002{i:02d}")
+            book.categories.add(category)
+            self.books.append(book)
+        InventoryItem.objects.create(book=self.books[0], shelf=self.poetry_shelf, quantity=4)
+
+    def acquire(self, book, quantity):
+        return Acquisition.objects.create(book=book, quantity=quantity, acquisition_type='PURCHASE')
+
+    def test_plan_keeps_categories_together(self):
+        """Poetry joins the poetry shelf; the essay group takes the tightest shelf it fits"""
+        placements = placement.plan([
+            placement.Request(self.books[1].pk, 5),
+            placement.Request(self.books[2].pk, 3),
+            placement.Request(self.books[3].pk, 2),
+        ])
+        shelf_of = {p.book_id: p.shelf_id for p in placements}
+        self.assertEqual(shelf_of[self.books[1].pk], self.poetry_shelf.pk)
+        self.assertEqual(shelf_of[self.books[2].pk], self.small_shelf.pk)
+        self.assertEqual(shelf_of[self.books[3].pk], self.small_shelf.pk)
+
+    def test_place_splits_and_writes_in_bulk(self):
+        """Overflowing groups spill onto other shelves; leftovers stay unshelved"""
+        acquisitions = [self.acquire(self.books[1], 30), self.acquire(self.books[2], 20)]
+        with CaptureQueriesContext(connection) as queries:
+            placements = placement.place(acquisitions)
+        self.assertEqual(sum(q['sql'].startswith('INSERT') for q in queries), 2)
+        self.assertEqual(sum(q['sql'].startswith('UPDATE') for q in queries), 2)
+
+        self.assertEqual(sum(p.quantity for p in placements), 50)
+        stocked = dict(InventoryItem.objects.filter(condition='NEW').values_list('shelf', 'quantity')
+                       .order_by('shelf'))
+        # 30 poetry fill the big shelf; 20 essays take the rest of the poetry and small shelves
+        self.assertEqual(stocked, {
+            self.poetry_shelf.pk: 6, self.big_shelf.pk: 30, self.small_shelf.pk: 6, None: 8,
+        })
+        self.assertEqual(
+            list(Shelf.objects.filter(is_active=True).order_by('name').values_list('used_space', flat=True)),
+            [10, 30, 6],
+        )
+        self.assertEqual(StockMovement.objects.filter(acquisition__in=acquisitions).count(), len(placements))
+        call_command('rebuild_stock', '--check', stdout=StringIO())
+
+    def test_admin_action_places_pending_acquisitions(self):
+        """The admin action only places acquisitions that were never received"""
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpassword')
+        self.client.login(username='admin', password='adminpassword')
+        received = self.acquire(self.books[0], 2)
+        stock.receive(received, self.poetry_shelf)
+        pending = self.acquire(self.books[3], 3)
+        self.client.post(reverse('admin:inventory_acquisition_changelist'), {
+            'action': 'place_on_shelves', '_selected_action': [received.pk, pending.pk],
+        })
+        self.assertEqual(received.movements.count(), 1)
+        self.assertEqual(list(pending.movements.values_list('item__shelf', 'quantity')), [(self.small_shelf.pk, 3)])
+
+
+class ShelfAuditTest(TestCase):
+    """Test cases for reconciling shelves against scanned copies"""
+
+    def setUp(self):
+        """Create a shelf with items for three books and their copies"""
+        self.user = User.objects.create_user(username='auditor', password='auditorpassword')
+        author = Author.objects.create(name="Juan Rulfo")
+        self.shelf = Shelf.objects.create(name="G1", location="Planta 1", capacity=50)
+        self.books = [
+            Book.objects.create(title=f"Pedro Páramo {i}", author=author, isbn=f"97860700003{i:02d}")
+            for i in range(4)
+        ]
+        self.good = InventoryItem.objects.create(book=self.books[0], shelf=self.shelf, quantity=2)
+        self.poor = InventoryItem.objects.create(book=self.books[0], shelf=self.shelf, quantity=1, condition='POOR')
+        self.exact = InventoryItem.objects.create(book=self.books[1], shelf=self.shelf, quantity=2)
+        self.short = InventoryItem.objects.create(book=self.books[2], shelf=self.shelf, quantity=1)
+        InventoryItem.objects.filter(shelf=self.shelf).update(last_checked=timezone.now() - timedelta(days=30))
+        for book, copies in zip(self.books, (3, 2, 3, 1)):
+            for n in range(copies):
+                BookCopy.objects.create(book=book, reference_number=f"R{book.pk}-{n}")
+
+    def scan(self):
+        # Book 0: two of three copies; book 1: both; book 2: three, one more
+        # than stocked; book 3: not stocked here. Plus a repeat and a typo.
+        b = [book.pk for book in self.books]
+        return [f"R{b[0]}-0", f"R{b[0]}-1", f"R{b[1]}-0", f"R{b[1]}-1", f"R{b[1]}-1",
+                f"R{b[2]}-0", f"R{b[2]}-1", f"R{b[2]}-2", f"R{b[3]}-0", "", "XX-999"]
+
+    def test_reconcile_corrects_items(self):
+        """Shortages come off the worst condition; surpluses and new books are added"""
+        result = audit.audit_shelf(self.shelf, self.scan(), user=self.user)
+        self.assertEqual((result.scanned, result.duplicates, result.unknown_references), (9, 1, ["XX-999"]))
+        self.assertEqual(result.discrepancies, [
+            {'book': self.books[0].pk, 'expected': 3, 'counted': 2},
+            {'book': self.books[2].pk, 'expected': 1, 'counted': 3},
+            {'book': self.books[3].pk, 'expected': 0, 'counted': 1},
+        ])
+        quantities = dict(InventoryItem.objects.filter(shelf=self.shelf).values_list('pk', 'quantity'))
+        self.assertEqual((quantities.pop(self.good.pk), quantities.pop(self.poor.pk),
+                          quantities.pop(self.exact.pk), quantities.pop(self.short.pk)), (2, 0, 2, 3))
+        self.assertEqual(list(quantities.values()), [1])
+        self.shelf.refresh_from_db()
+        self.assertEqual(self.shelf.used_space, 8)
+        self.assertFalse(InventoryItem.objects.filter(
+            shelf=self.shelf, last_checked__lt=timezone.now() - timedelta(days=1)
+        ).exists())
+        self.assertEqual(StockMovement.objects.filter(batch=result.batch).count(), 3)
+        call_command('rebuild_stock', '--check', stdout=StringIO())
+
+    def test_write_queries_do_not_grow_with_shelf(self):
+        """Write queries depend on distinct quantities, not on the number of items"""
+        with CaptureQueriesContext(connection) as small:
+            audit.audit_shelf(self.shelf, self.scan())
+        for book in self.books[1:]:
+            for condition in ('NEW', 'FAIR', 'DAMAGED'):
+                InventoryItem.objects.create(book=book, shelf=self.shelf, quantity=0, condition=condition)
+        with CaptureQueriesContext(connection) as large:
+            audit.audit_shelf(self.shelf, self.scan())
+        self.assertLessEqual(len(large), len(small))
 
-# Create your tests here.
+    def test_view_accepts_scanned_lines(self):
+        """The audit endpoint reads reference numbers from the request body"""
+        self.client.login(username='auditor', password='auditorpassword')
+        response = self.client.post(reverse('inventory:shelf-audit', args=[self.shelf.pk]),
+                                    '\n'.join(self.scan()), content_type='text/plain')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['scanned'], len(data['discrepancies'])), (9, 3))
+        self.assertEqual(InventoryAudit.objects.get().user, self.user)
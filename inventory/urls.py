@@ -6,7 +6,11 @@ app_name = 'inventory'
 urlpatterns = [
     path('shelves/', views.ShelfListView.as_view(), name='shelf-list'),
     path('shelf/<int:pk>/', views.ShelfDetailView.as_view(), name='shelf-detail'),
+    path('shelf/<int:pk>/audit/', views.ShelfAuditView.as_view(), name='shelf-audit'),
     path('items/', views.InventoryItemListView.as_view(), name='item-list'),
+    path('items/export/', views.InventoryItemExportView.as_view(), name='item-export'),
+    path('restock/', views.RestockPlanView.as_view(), name='restock-plan'),
+    path('restock/export/', views.RestockPlanExportView.as_view(), name='restock-export'),
     path('acquisition/create/', views.AcquisitionCreateView.as_view(),
          name='acquisition-create'),
 ]
\ No newline at end of file
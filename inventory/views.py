@@ -1,9 +1,17 @@
-from django.views.generic import ListView, DetailView, CreateView, UpdateView
+from django.views.generic import ListView, DetailView, CreateView, UpdateView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
 from django.contrib import messages
+from django.db import transaction
+from django.db.models import F, Q
+from search.index import rank_ordering, search_filter
+from config.exports import export_response
+from config.pagination import CursorPaginator
+from . import audit, placement, restock, stock
 from .models import Shelf, InventoryItem, Acquisition
-from .forms import ShelfForm, InventoryItemForm, AcquisitionForm, InventorySearchForm
+from .forms import ShelfForm, InventoryItemForm, AcquisitionForm, InventorySearchForm, RestockPlanForm
 
 class ShelfListView(LoginRequiredMixin, ListView):
     model = Shelf
@@ -11,11 +19,39 @@ class ShelfListView(LoginRequiredMixin, ListView):
     template_name = 'inventory/shelf_list.html'
     paginate_by = 10
 
+    def get_queryset(self):
+        # available_space reads the cached used_space column: joining the
+        # items here would group the copies subquery by every item row
+        return Shelf.objects.with_available_copies().order_by('name', 'pk')
+
 class ShelfDetailView(LoginRequiredMixin, DetailView):
     model = Shelf
     context_object_name = 'shelf'
     template_name = 'inventory/shelf_detail.html'
 
+    def get_queryset(self):
+        return Shelf.objects.with_available_copies()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['items'] = self.object.items.select_related('book')
+        return context
+
+class ShelfAuditView(LoginRequiredMixin, View):
+    """Reconcile a shelf against scanned reference numbers, one per line of the body"""
+
+    def post(self, request, pk):
+        shelf = get_object_or_404(Shelf, pk=pk)
+        # The body is read line by line rather than loaded whole
+        result = audit.audit_shelf(shelf, request, user=request.user)
+        return JsonResponse({
+            'audit': result.pk,
+            'scanned': result.scanned,
+            'duplicates': result.duplicates,
+            'unknown_references': result.unknown_references,
+            'discrepancies': result.discrepancies,
+        })
+
 class InventoryItemListView(LoginRequiredMixin, ListView):
     model = InventoryItem
     context_object_name = 'items'
@@ -23,12 +59,14 @@ class InventoryItemListView(LoginRequiredMixin, ListView):
     paginate_by = 20
 
     def get_queryset(self):
-        queryset = InventoryItem.objects.all()
+        queryset = InventoryItem.objects.select_related('book', 'shelf')
         form = InventorySearchForm(self.request.GET)
         if form.is_valid():
             if form.cleaned_data['search']:
-                queryset = queryset.filter(
-                    book__title__icontains=form.cleaned_data['search']
+                queryset = search_filter(
+                    queryset, form.cleaned_data['search'],
+                    fallback=Q(book__title__icontains=form.cleaned_data['search']),
+                    books='book',
                 )
             if form.cleaned_data['condition']:
                 queryset = queryset.filter(
@@ -36,21 +74,81 @@ class InventoryItemListView(LoginRequiredMixin, ListView):
                 )
             if form.cleaned_data['needs_restock']:
                 queryset = queryset.filter(
-                    quantity__lte=models.F('minimum_quantity')
+                    quantity__lte=F('minimum_quantity')
                 )
         return queryset
 
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(
+            queryset, rank_ordering(queryset, ('book__title', 'id')), per_page=page_size, count='estimate'
+        )
+        page = paginator.get_page(self.request.GET.get('cursor'))
+        return paginator, page, page.object_list, page.has_other_pages()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search_form'] = InventorySearchForm(self.request.GET)
         return context
 
+class InventoryItemExportView(InventoryItemListView):
+    """Stream the filtered inventory as CSV or JSONL (?format=jsonl)"""
+    columns = {
+        'id': 'id',
+        'book_title': 'book__title',
+        'isbn': 'book__isbn',
+        'shelf': 'shelf__name',
+        'quantity': 'quantity',
+        'minimum_quantity': 'minimum_quantity',
+        'condition': 'condition',
+    }
+
+    def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset().order_by('id')
+        return export_response(queryset, self.columns, 'inventory',
+                               request.GET.get('format', 'csv'))
+
+class RestockPlanView(LoginRequiredMixin, ListView):
+    """Books to reorder, ranked by the quantity missing (see inventory.restock)"""
+    context_object_name = 'rows'
+    template_name = 'inventory/restock_plan.html'
+    paginate_by = 50
+
+    def get_form(self):
+        return RestockPlanForm(self.request.GET)
+
+    def get_queryset(self):
+        form = self.get_form()
+        params = form.cleaned_data if form.is_valid() else {}
+        return restock.plan(demand_days=params.get('demand_days'), lead_days=params.get('lead_days'))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['form'] = self.get_form()
+        context['options'] = restock.options()
+        return context
+
+class RestockPlanExportView(RestockPlanView):
+    """Stream the restock plan as CSV or JSONL (?format=jsonl)"""
+
+    def get(self, request, *args, **kwargs):
+        return export_response(self.get_queryset(), restock.COLUMNS, 'restock-plan',
+                               request.GET.get('format', 'csv'))
+
 class AcquisitionCreateView(LoginRequiredMixin, CreateView):
     model = Acquisition
     form_class = AcquisitionForm
     template_name = 'inventory/acquisition_form.html'
-    success_url = reverse_lazy('inventory:acquisition-list')
+    success_url = reverse_lazy('inventory:item-list')
 
     def form_valid(self, form):
+        shelf, condition = form.cleaned_data['shelf'], form.cleaned_data['condition']
+        with transaction.atomic():
+            response = super().form_valid(form)
+            if shelf is not None:
+                stock.receive(self.object, shelf, condition, user=self.request.user)
+            else:
+                placements = placement.place([self.object], condition, user=self.request.user)
         messages.success(self.request, 'Adquisición registrada exitosamente.')
-        return super().form_valid(form)
\ No newline at end of file
+        if shelf is None and any(p.shelf_id is None for p in placements):
+            messages.warning(self.request, 'No hay espacio suficiente: parte de la adquisición quedó sin estantería.')
+        return response
\ No newline at end of file
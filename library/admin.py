@@ -1,6 +1,16 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.conf import settings
+from django.db import transaction
+from django.db.models import CharField, Count, Exists, F, OuterRef, Value
+from django.db.models.functions import Cast, Concat
+from django.urls import reverse
 from django.utils.html import format_html
+from search.mixins import FullTextSearchMixin
 from .models import Category, Author, AuthorProfile, Publisher, Book, Publication
+from .slugs import SlugAllocator
+from . import cache as catalog_cache, thumbnails
 
 # Author admin with inline profile
 class AuthorProfileInline(admin.StackedInline):
@@ -9,28 +19,56 @@ class AuthorProfileInline(admin.StackedInline):
     can_delete = False
     verbose_name = "Author Profile"
     verbose_name_plural = "Profile"
+    readonly_fields = ['display_photo']
+
+    def display_photo(self, obj):
+        """Display a thumbnail of the author photo"""
+        return thumbnails.picture(obj.photo, 'medium', alt=obj.author.name) or "No photo available"
+    display_photo.short_description = "Photo Preview"
+
+class BookCountAdminMixin:
+    """
+    Annotate each row's book count for the changelist.
+
+    Counting is done in the changelist query, or read from the book_count
+    column when LIBRARY_BOOK_COUNT_COLUMN is on (see library.counts).
+    """
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if settings.LIBRARY_BOOK_COUNT_COLUMN:
+            return queryset.annotate(num_books=F('book_count'))
+        return queryset.annotate(num_books=Count('books', distinct=True))
 
 @admin.register(Author)
-class AuthorAdmin(admin.ModelAdmin):
+class AuthorAdmin(BookCountAdminMixin, admin.ModelAdmin):
     """Admin configuration for authors"""
-    list_display = ('name', 'birth_date', 'death_date', 'book_count', 'has_profile')
+    list_display = ('name', 'birth_date', 'death_date', 'books_count', 'has_profile')
     search_fields = ('name',)
     list_filter = ('birth_date',)
     date_hierarchy = 'birth_date'
     inlines = [AuthorProfileInline]
 
-    def book_count(self, obj):
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            profile_exists=Exists(AuthorProfile.objects.filter(author=OuterRef('pk')))
+        )
+
+    def books_count(self, obj):
         """Count books written by this author"""
-        count = obj.books.count()
-        return format_html('<a href="?author__id__exact={}">{} book{}</a>',
+        count = obj.num_books
+        return format_html('<a href="{}?author__id__exact={}">{} book{}</a>',
+                           reverse('admin:library_book_changelist'),
                            obj.id, count, 's' if count != 1 else '')
-    book_count.short_description = "Books"
+    books_count.short_description = "Books"
+    books_count.admin_order_field = 'num_books'
 
     def has_profile(self, obj):
         """Check if author has a profile"""
-        return hasattr(obj, 'profile')
+        return obj.profile_exists
     has_profile.boolean = True
     has_profile.short_description = "Has Profile"
+    has_profile.admin_order_field = 'profile_exists'
 
 # Book admin with inline publications
 class PublicationInline(admin.TabularInline):
@@ -38,13 +76,89 @@ class PublicationInline(admin.TabularInline):
     model = Publication
     extra = 1
 
+class UniqueSlugAdminMixin:
+    """Leave the slug optional so the model allocates a free one on save"""
+    actions = ['regenerate_slugs']
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        if 'slug' in form.base_fields:
+            form.base_fields['slug'].required = False
+            form.base_fields['slug'].help_text = "Leave blank to generate a unique slug."
+        return form
+
+    @admin.action(description="Regenerate slugs of selected items")
+    def regenerate_slugs(self, request, queryset):
+        """Give the selected rows fresh slugs from their titles or names"""
+        source = self.model.slug_source
+        objects = list(queryset.only('pk', 'slug', source))
+        allocator = SlugAllocator(self.model)
+        allocator.reserve(getattr(obj, source) for obj in objects)
+        # The selected rows' current slugs are free to be handed out again
+        allocator.taken.difference_update(obj.slug for obj in objects)
+        for obj in objects:
+            obj.slug = allocator.allocate(getattr(obj, source))
+        with transaction.atomic():
+            # Park the rows on temporary slugs so the swap cannot collide
+            self.model.objects.filter(pk__in=[obj.pk for obj in objects]).update(
+                slug=Concat(Value('~'), Cast('pk', CharField()))
+            )
+            self.model.objects.bulk_update(objects, ['slug'], batch_size=500)
+        if self.model is Book:
+            catalog_cache.invalidate_books([obj.pk for obj in objects])
+        else:
+            catalog_cache.invalidate_categories()
+        self.message_user(request, f"{len(objects)} slug(s) regenerated.", messages.SUCCESS)
+
+class AuthorAutocompleteFilter(admin.SimpleListFilter):
+    """
+    Filter by author with an autocomplete box instead of a link per author.
+
+    Only the selected author is looked up, so the sidebar costs at most one
+    query however many authors exist. Suggestions come from AuthorAdmin's
+    autocomplete view.
+    """
+    title = 'author'
+    parameter_name = 'author__id__exact'
+    template = 'admin/library/author_autocomplete_filter.html'
+
+    def lookups(self, request, model_admin):
+        # The widget looks up the selected author itself
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value and value.isdigit():
+            return queryset.filter(author_id=value)
+        return queryset
+
+    def choices(self, changelist):
+        field = forms.ModelChoiceField(
+            Author.objects.all(), required=False,
+            widget=AutocompleteSelect(Book._meta.get_field('author'), admin.site),
+        )
+        author_id = self.value() if self.value() and self.value().isdigit() else None
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'display': 'All',
+            'widget': field.widget.render(self.parameter_name, author_id, attrs={'id': 'author-filter'}),
+            # Other filters and the search box survive picking an author
+            'hidden': [(key, value) for key, value in changelist.params.items() if key != self.parameter_name],
+        }
+
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(UniqueSlugAdminMixin, FullTextSearchMixin, admin.ModelAdmin):
     """Admin configuration for books"""
-    list_display = ('title', 'author', 'isbn', 'publication_date', 'display_categories')
-    list_filter = ('categories', 'author', 'publication_date')
+    list_display = ('cover_thumbnail', 'title', 'author', 'isbn', 'publication_date', 'display_categories')
+    list_filter = ('categories', AuthorAutocompleteFilter, 'publication_date')
+    list_display_links = ('title',)
+    list_select_related = ('author',)
     search_fields = ('title', 'isbn', 'author__name')
-    prepopulated_fields = {'slug': ('title',)}
+    search_book_path = 'pk'
     autocomplete_fields = ['author', 'categories']
     readonly_fields = ['display_cover']
     filter_horizontal = ('categories',)
@@ -66,41 +180,54 @@ class BookAdmin(admin.ModelAdmin):
         }),
     )
 
+    @property
+    def media(self):
+        # The author filter's autocomplete widget needs select2
+        return super().media + AutocompleteSelect(Book._meta.get_field('author'), admin.site).media
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('categories')
+
     def display_categories(self, obj):
         """Display categories as a list"""
         return ", ".join([category.name for category in obj.categories.all()])
     display_categories.short_description = "Categories"
 
+    def cover_thumbnail(self, obj):
+        """Small cover thumbnail for the changelist"""
+        return thumbnails.picture(obj.cover, 'small', alt=obj.title)
+    cover_thumbnail.short_description = "Cover"
+
     def display_cover(self, obj):
         """Display book cover image"""
         if obj.cover:
-            return format_html('<img src="{}" width="150" />', obj.cover.url)
+            return thumbnails.picture(obj.cover, 'medium', alt=obj.title)
         return "No cover available"
     display_cover.short_description = "Cover Preview"
 
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(UniqueSlugAdminMixin, BookCountAdminMixin, admin.ModelAdmin):
     """Admin configuration for categories"""
-    list_display = ('name', 'slug', 'book_count')
+    list_display = ('name', 'slug', 'books_count')
     search_fields = ('name',)
-    prepopulated_fields = {'slug': ('name',)}
 
-    def book_count(self, obj):
+    def books_count(self, obj):
         """Count books in this category"""
-        count = obj.books.count()
-        return count
-    book_count.short_description = "Books"
+        return obj.num_books
+    books_count.short_description = "Books"
+    books_count.admin_order_field = 'num_books'
 
 @admin.register(Publisher)
-class PublisherAdmin(admin.ModelAdmin):
+class PublisherAdmin(BookCountAdminMixin, admin.ModelAdmin):
     """Admin configuration for publishers"""
-    list_display = ('name', 'website', 'book_count')
+    list_display = ('name', 'website', 'books_count')
     search_fields = ('name',)
 
-    def book_count(self, obj):
+    def books_count(self, obj):
         """Count books from this publisher"""
-        return obj.books.count()
-    book_count.short_description = "Books"
+        return obj.num_books
+    books_count.short_description = "Books"
+    books_count.admin_order_field = 'num_books'
 
 @admin.register(Publication)
 class PublicationAdmin(admin.ModelAdmin):
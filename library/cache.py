@@ -0,0 +1,181 @@
+"""
+Cached catalog reads: book details, the category list and authors with
+their book counts. The library catalog views (library.views) are served
+from here.
+
+Entries live in the ``catalog`` cache (see CACHES in settings). Keys embed
+version numbers kept in the same cache, so invalidating means bumping a
+version rather than finding and deleting every derived key:
+
+* ``book:<pk>``    a book's own fields, author name, categories and
+  publications
+* ``author:<pk>``  an author's name and book count
+* ``books``, ``categories``, ``publishers``  global versions for changes
+  that affect many entries, such as renaming a category
+
+Renaming an author bumps only that author's ``book:<pk>`` versions.
+
+library.signals bumps the versions on post_save, post_delete and
+m2m_changed. Bulk writes that skip signals (the catalog importer) call
+the ``invalidate_*`` helpers themselves.
+
+Hits and misses are counted per process. The
+``library:catalog-cache-metrics`` view serves the counts in Prometheus
+text format.
+"""
+from collections import Counter
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Author, Book, Category
+
+CACHE_ALIAS = 'catalog'
+PREFIX = 'catalog'
+
+# Seconds an entry lives even if nothing invalidates it
+TIMEOUT = 60 * 60
+
+hits = Counter()
+misses = Counter()
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_key(name):
+    return f'{PREFIX}:v:{name}'
+
+
+def _versions(*names):
+    """Current version of each name, starting at 1"""
+    found = _cache().get_many([_version_key(name) for name in names])
+    return [found.get(_version_key(name), 1) for name in names]
+
+
+def bump(*names):
+    """Invalidate every entry built from the given versions"""
+    _bump(names)
+    # Readers can re-cache the old rows until the current transaction commits
+    transaction.on_commit(lambda: _bump(names))
+
+
+def _bump(names):
+    cache = _cache()
+    for name in names:
+        key = _version_key(name)
+        # add() is a no-op if the key exists, so incr() starts from a known value
+        cache.add(key, 1, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(key, 2, timeout=None)
+
+
+def _cached(kind, key, build):
+    cache = _cache()
+    value = cache.get(key)
+    if value is not None:
+        hits[kind] += 1
+        return value
+    misses[kind] += 1
+    value = build()
+    cache.set(key, value, TIMEOUT)
+    return value
+
+
+# Reads -----------------------------------------------------------------
+
+def _book_data(pk):
+    book = (
+        Book.objects.select_related('author')
+        .prefetch_related('categories', 'publication_set__publisher')
+        .filter(pk=pk).first()
+    )
+    if book is None:
+        # Cached too, so repeated lookups of a missing id stay cheap
+        return {}
+    return {
+        'id': book.pk,
+        'title': book.title,
+        'subtitle': book.subtitle,
+        'slug': book.slug,
+        'isbn': book.isbn,
+        'publication_date': book.publication_date,
+        'page_count': book.page_count,
+        'summary': book.summary,
+        'author': {'id': book.author_id, 'name': book.author.name},
+        'categories': [{'id': c.pk, 'name': c.name, 'slug': c.slug} for c in book.categories.all()],
+        'publications': [
+            {'publisher': p.publisher.name, 'publication_date': p.publication_date, 'edition': p.edition}
+            for p in book.publication_set.all()
+        ],
+    }
+
+
+def book(pk):
+    """A book with its author, categories and publications as a dict, or None"""
+    version, categories, publishers = _versions(f'book:{pk}', 'categories', 'publishers')
+    key = f'{PREFIX}:book:{pk}:{version}.{categories}.{publishers}'
+    return _cached('book', key, lambda: _book_data(pk)) or None
+
+
+def categories():
+    """Every category with its book count, ordered by name"""
+    version, books = _versions('categories', 'books')
+    key = f'{PREFIX}:categories:{version}.{books}'
+    return _cached('categories', key, lambda: list(
+        Category.objects.values('id', 'name', 'slug', 'book_count')
+    ))
+
+
+def _author_data(pk):
+    author = Author.objects.filter(pk=pk).values('id', 'name', 'birth_date', 'death_date').first()
+    if author is None:
+        return {}
+    author['book_count'] = Book.objects.filter(author_id=pk).count()
+    return author
+
+
+def author(pk):
+    """An author with their number of books as a dict, or None"""
+    version, = _versions(f'author:{pk}')
+    key = f'{PREFIX}:author:{pk}:{version}'
+    return _cached('author', key, lambda: _author_data(pk)) or None
+
+
+# Invalidation ----------------------------------------------------------
+
+def invalidate_books(book_ids=(), author_ids=()):
+    """After books are added, changed or removed"""
+    bump('books', *(f'book:{pk}' for pk in book_ids), *(f'author:{pk}' for pk in author_ids))
+
+
+def invalidate_authors(author_ids=(), renamed=False):
+    """After authors change; a rename also reaches the entries of their books"""
+    book_ids = Book.objects.filter(author_id__in=author_ids).values_list('pk', flat=True) if renamed else ()
+    bump(*(f'author:{pk}' for pk in author_ids), *(f'book:{pk}' for pk in book_ids))
+
+
+def invalidate_categories():
+    bump('categories')
+
+
+def invalidate_publishers():
+    bump('publishers')
+
+
+# Metrics ---------------------------------------------------------------
+
+def metrics():
+    """Prometheus text exposition of the hit and miss counters"""
+    lines = [
+        '# HELP catalog_cache_requests_total Catalog cache lookups by result.',
+        '# TYPE catalog_cache_requests_total counter',
+    ]
+    for kind in sorted(set(hits) | set(misses)):
+        lines.append(f'catalog_cache_requests_total{{kind="{kind}",result="hit"}} {hits[kind]}')
+        lines.append(f'catalog_cache_requests_total{{kind="{kind}",result="miss"}} {misses[kind]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,45 @@
+"""
+Denormalized ``book_count`` columns on Author, Category and Publisher.
+
+Signals in library.signals call refresh() for the rows a change touches.
+refresh() recounts those rows from the books, category links and
+publications in one UPDATE per model, so the columns cannot drift the
+way +1/-1 counters can. Bulk writes that skip signals call refresh()
+themselves, or run ``rebuild_book_counts`` afterwards.
+
+The admin reads the columns instead of counting when the
+LIBRARY_BOOK_COUNT_COLUMN setting is on.
+"""
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Author, Book, Category, Publication, Publisher
+
+
+def _counts(model):
+    """Subquery counting the distinct books of the outer model's row"""
+    if model is Author:
+        rows, key, book = Book.objects, 'author', 'pk'
+    elif model is Category:
+        rows, key, book = Book.categories.through.objects, 'category', 'book'
+    else:
+        rows, key, book = Publication.objects, 'publisher', 'book'
+    counts = rows.filter(**{key: OuterRef('pk')}).order_by().values(key).annotate(
+        n=Count(book, distinct=True)
+    ).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def refresh(model, ids=None):
+    """Recount book_count for the given ids of model, or for every row"""
+    rows = model.objects.all()
+    if ids is not None:
+        ids = {pk for pk in ids if pk is not None}
+        if not ids:
+            return 0
+        rows = rows.filter(pk__in=ids)
+    return rows.update(book_count=_counts(model))
+
+
+def refresh_all():
+    return {model: refresh(model) for model in (Author, Category, Publisher)}
@@ -0,0 +1,297 @@
+"""
+Bulk catalog import from CSV, JSON Lines or MARC text (.mrk) records.
+
+Records are read lazily and written in batches. Authors, publishers and
+categories are resolved through in-memory name -> id maps, and only the
+names not seen before are created. Books are inserted with bulk_create,
+using slugs from library.slugs.SlugAllocator. Category and Publication
+through rows are inserted in bulk afterwards. Each batch runs in its own
+transaction and then refreshes the search index, the catalog cache and
+the book_count columns for the books it added.
+
+Every format yields dicts with these keys (all optional except title,
+isbn and author)::
+
+    title, subtitle, isbn, author, publication_date, page_count, summary,
+    categories (list), publisher, edition
+"""
+import csv
+import datetime
+import json
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+from django.db import transaction
+
+from search import index
+from . import cache as catalog_cache, counts
+from .models import Author, Book, Category, Publication, Publisher
+from .slugs import SlugAllocator
+
+BATCH_SIZE = 2000
+
+# Separator between category names in a CSV cell
+CATEGORY_SEPARATOR = '|'
+
+# Errors kept on the result; later ones are only counted
+MAX_ERRORS = 100
+
+
+class RecordError(ValueError):
+    pass
+
+
+@dataclass
+class ImportResult:
+    """Totals for one import run"""
+    created: int = 0
+    skipped: int = 0
+    failed: int = 0
+    authors: int = 0
+    publishers: int = 0
+    categories: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f"Record {line}: {message}")
+
+
+# Readers ---------------------------------------------------------------
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        row = {key.strip(): (value or '').strip() for key, value in row.items() if key}
+        categories = row.get('categories', '')
+        row['categories'] = [name.strip() for name in categories.split(CATEGORY_SEPARATOR) if name.strip()]
+        yield row
+
+
+def read_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Reported by clean() so the line number is kept
+            yield None
+
+
+# MARC fields read by read_marc: tag -> {subfield: key}
+MARC_FIELDS = {
+    '020': {'a': 'isbn'},
+    '100': {'a': 'author'},
+    '245': {'a': 'title', 'b': 'subtitle'},
+    '250': {'a': 'edition'},
+    '260': {'b': 'publisher', 'c': 'publication_date'},
+    '264': {'b': 'publisher', 'c': 'publication_date'},
+    '300': {'a': 'page_count'},
+    '520': {'a': 'summary'},
+}
+MARC_CATEGORY_TAGS = ('650', '655')
+
+
+def _marc_value(value):
+    # Trailing ISBD punctuation (" /", " :", ",", ".") is not part of the value
+    return value.strip().rstrip(' /:;,.').strip()
+
+
+def read_marc(stream):
+    """
+    Read MARC text records (MarcEdit .mrk): one ``=TAG  II$aValue$bValue``
+    line per field, records separated by blank lines.
+    """
+    record = {}
+    for line in stream:
+        line = line.rstrip('\n')
+        if not line.strip():
+            if record:
+                yield record
+            record = {}
+            continue
+        if not line.startswith('=') or len(line) < 5:
+            continue
+        tag, data = line[1:4], line[6:]
+        subfields = [(part[0], _marc_value(part[1:])) for part in data.split('$')[1:] if part]
+        if tag in MARC_CATEGORY_TAGS:
+            record.setdefault('categories', []).extend(value for code, value in subfields if code == 'a')
+        for code, value in subfields:
+            key = MARC_FIELDS.get(tag, {}).get(code)
+            if key and value and key not in record:
+                record[key] = value
+    if record:
+        yield record
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+    'marc': read_marc,
+}
+
+
+def detect_format(filename):
+    suffix = filename.rsplit('.', 1)[-1].lower()
+    return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl', 'mrk': 'marc', 'marc': 'marc'}.get(suffix)
+
+
+# Cleaning --------------------------------------------------------------
+
+_YEAR = re.compile(r'\d{4}')
+
+
+def parse_date(value):
+    """ISO date, or a bare year as January 1st; None if neither"""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return datetime.date.fromisoformat(value[:10])
+    except ValueError:
+        match = _YEAR.search(value)
+        return datetime.date(int(match.group()), 1, 1) if match else None
+
+
+def parse_int(value):
+    match = re.search(r'\d+', str(value or ''))
+    return int(match.group()) if match else None
+
+
+def clean(record):
+    """Normalized record, or raise RecordError saying what is wrong"""
+    if not isinstance(record, dict):
+        raise RecordError("not a valid record")
+    data = {key: record.get(key) for key in (
+        'title', 'subtitle', 'isbn', 'author', 'publisher', 'summary',
+    )}
+    data = {key: (str(value).strip() if value else '') for key, value in data.items()}
+    for required in ('title', 'isbn', 'author'):
+        if not data[required]:
+            raise RecordError(f"missing {required}")
+    data['isbn'] = data['isbn'].split()[0].replace('-', '')[:20]
+    data['author'] = data['author'][:200]
+    data['publisher'] = data['publisher'][:200]
+    data['publication_date'] = parse_date(record.get('publication_date'))
+    data['page_count'] = parse_int(record.get('page_count'))
+    data['edition'] = parse_int(record.get('edition')) or 1
+    categories = record.get('categories') or []
+    if isinstance(categories, str):
+        categories = categories.split(CATEGORY_SEPARATOR)
+    data['categories'] = [name.strip()[:100] for name in categories if name and name.strip()]
+    return data
+
+
+# Import ----------------------------------------------------------------
+
+class CatalogImporter:
+    """Import records in batches; see the module docstring"""
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.result = ImportResult()
+        self.authors = dict(Author.objects.values_list('name', 'id'))
+        self.publishers = dict(Publisher.objects.values_list('name', 'id'))
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        self.book_slugs = SlugAllocator(Book)
+        self.category_slugs = SlugAllocator(Category)
+        self.seen_isbns = set()
+
+    def run(self, records):
+        batch = []
+        for line, record in enumerate(records, start=1):
+            try:
+                data = clean(record)
+            except (RecordError, TypeError) as e:
+                self.result.error(line, e)
+                continue
+            if data['isbn'] in self.seen_isbns:
+                self.result.skipped += 1
+                continue
+            self.seen_isbns.add(data['isbn'])
+            batch.append(data)
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+        return self.result
+
+    def _resolve(self, names, mapping, create):
+        """Ids for names, creating the ones not in mapping"""
+        missing = sorted({name for name in names if name and name not in mapping})
+        if missing:
+            for obj in create(missing):
+                mapping[obj.name] = obj.pk
+        return len(missing)
+
+    def _create_categories(self, names):
+        self.category_slugs.reserve(names)
+        return Category.objects.bulk_create(
+            Category(name=name, slug=self.category_slugs.allocate(name)) for name in names
+        )
+
+    def write(self, batch):
+        with transaction.atomic():
+            existing = set(Book.objects.filter(
+                isbn__in=[data['isbn'] for data in batch]
+            ).values_list('isbn', flat=True))
+            batch = [data for data in batch if data['isbn'] not in existing]
+            self.result.skipped += len(existing)
+            if not batch:
+                return
+
+            self.result.authors += self._resolve(
+                (data['author'] for data in batch), self.authors,
+                lambda names: Author.objects.bulk_create(Author(name=name) for name in names),
+            )
+            self.result.publishers += self._resolve(
+                (data['publisher'] for data in batch), self.publishers,
+                lambda names: Publisher.objects.bulk_create(Publisher(name=name) for name in names),
+            )
+            self.result.categories += self._resolve(
+                (name for data in batch for name in data['categories']), self.categories,
+                self._create_categories,
+            )
+
+            self.book_slugs.reserve(data['title'] for data in batch)
+            books = Book.objects.bulk_create(
+                Book(
+                    title=data['title'][:200],
+                    subtitle=data['subtitle'][:200],
+                    slug=self.book_slugs.allocate(data['title']),
+                    isbn=data['isbn'],
+                    publication_date=data['publication_date'],
+                    page_count=data['page_count'],
+                    summary=data['summary'],
+                    author_id=self.authors[data['author']],
+                ) for data in batch
+            )
+
+            Book.categories.through.objects.bulk_create(
+                Book.categories.through(book_id=book.pk, category_id=self.categories[name])
+                for book, data in zip(books, batch)
+                for name in dict.fromkeys(data['categories'])
+            )
+            # Publication.publication_date is required, so undated editions get none
+            Publication.objects.bulk_create(
+                Publication(book_id=book.pk, publisher_id=self.publishers[data['publisher']],
+                            publication_date=data['publication_date'], edition=data['edition'])
+                for book, data in zip(books, batch)
+                if data['publisher'] and data['publication_date']
+            )
+
+            index.index_books(Book.objects.filter(pk__in=[book.pk for book in books]))
+            counts.refresh(Author, {book.author_id for book in books})
+            counts.refresh(Category, {self.categories[name] for data in batch for name in data['categories']})
+            counts.refresh(Publisher, {self.publishers[data['publisher']] for data in batch if data['publisher']})
+            catalog_cache.invalidate_books(author_ids={book.author_id for book in books})
+            self.result.created += len(books)
+
+
+def import_catalog(stream, fmt, batch_size=BATCH_SIZE):
+    """Import every record in stream and return an ImportResult"""
+    return CatalogImporter(batch_size).run(READERS[fmt](stream))
@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import thumbnails
+from library.models import AuthorProfile, Book
+
+
+class Command(BaseCommand):
+    help = "Create the thumbnail variants of book covers and author photos that have none yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=thumbnails.options()['WORKERS'] or 1,
+            help="Images processed in parallel",
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be positive")
+
+        names = set(Book.objects.exclude(cover='').filter(cover_digest='').values_list(
+            'cover', flat=True
+        ).iterator())
+        names.update(AuthorProfile.objects.exclude(photo='').filter(photo_digest='').values_list(
+            'photo', flat=True
+        ).iterator())
+
+        names = sorted(names)
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            digests = list(pool.map(thumbnails.create_variants, names))
+        # Recorded from this thread; the pool only reads and writes files
+        for name, digest in zip(names, digests):
+            if digest is not None:
+                thumbnails.store_digest(name, digest)
+
+        failed = digests.count(None)
+        if failed:
+            self.stderr.write(f"{failed} images could not be read")
+        self.stdout.write(self.style.SUCCESS(
+            f"Thumbnails ready for {len(digests) - failed} of {len(digests)} images"
+        ))
@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import importer
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-load books, authors, publishers and categories from CSV, JSON Lines "
+        "or MARC text records; books whose ISBN already exists are skipped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or - for standard input")
+        parser.add_argument(
+            '--format',
+            choices=sorted(importer.READERS),
+            help="Input format; guessed from the file extension if omitted",
+        )
+        parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE, help="Records per transaction")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or (None if path == '-' else importer.detect_format(path))
+        if fmt is None:
+            raise CommandError("Cannot tell the input format; pass --format")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+        with stream:
+            result = importer.import_catalog(stream, fmt, batch_size=options['batch_size'])
+
+        for error in result.errors:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.created} books ({result.authors} new authors, "
+            f"{result.publishers} new publishers, {result.categories} new categories); "
+            f"skipped {result.skipped} existing, {result.failed} invalid"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library import counts
+
+
+class Command(BaseCommand):
+    help = "Recount the book_count columns of every author, category and publisher"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = counts.refresh_all()
+        summary = ', '.join(f"{rows} {model._meta.verbose_name_plural}" for model, rows in updated.items())
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt book counts for {summary}"))
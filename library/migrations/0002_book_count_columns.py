@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-16 23:37
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_book_counts(apps, schema_editor):
+    Author = apps.get_model('library', 'Author')
+    Category = apps.get_model('library', 'Category')
+    Publisher = apps.get_model('library', 'Publisher')
+    Book = apps.get_model('library', 'Book')
+    Publication = apps.get_model('library', 'Publication')
+    for model, rows, key, book in (
+        (Author, Book.objects, 'author', 'pk'),
+        (Category, Book.categories.through.objects, 'category', 'book'),
+        (Publisher, Publication.objects, 'publisher', 'book'),
+    ):
+        counts = rows.filter(**{key: OuterRef('pk')}).order_by().values(key).annotate(
+            n=Count(book, distinct=True)
+        ).values('n')
+        model.objects.update(book_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='book_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='book_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='publisher',
+            name='book_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_book_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-17 00:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0002_book_count_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorprofile',
+            name='photo_digest',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='cover_digest',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -1,11 +1,14 @@
 from django.db import models
-from django.utils.text import slugify
 
-class Category(models.Model):
+from .slugs import UniqueSlugMixin
+
+class Category(UniqueSlugMixin, models.Model):
     """Book category/genre"""
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True)
+    # Maintained by library.counts; read by the admin when LIBRARY_BOOK_COUNT_COLUMN is on
+    book_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
 
     class Meta:
         verbose_name_plural = "categories"
@@ -14,20 +17,24 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
-    def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
-
 class Author(models.Model):
     """Book author"""
     name = models.CharField(max_length=200)
     birth_date = models.DateField(null=True, blank=True)
     death_date = models.DateField(null=True, blank=True)
+    # Maintained by library.counts; read by the admin when LIBRARY_BOOK_COUNT_COLUMN is on
+    book_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored name so only a rename invalidates cached books
+        instance._loaded_name = instance.__dict__.get('name')
+        return instance
+
     @property
     def is_alive(self):
         """Check if author is alive"""
@@ -44,20 +51,31 @@ class AuthorProfile(models.Model):
     biography = models.TextField(blank=True)
     website = models.URLField(blank=True)
     photo = models.ImageField(upload_to='authors/', blank=True)
+    # sha256 of the photo once its thumbnails exist; see library.thumbnails
+    photo_digest = models.CharField(max_length=64, blank=True, editable=False)
 
     def __str__(self):
         return f"Profile for {self.author.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored file so a new photo drops the old digest
+        instance._loaded_photo = instance.__dict__.get('photo')
+        return instance
+
 class Publisher(models.Model):
     """Book publisher"""
     name = models.CharField(max_length=200)
     address = models.TextField(blank=True)
     website = models.URLField(blank=True)
+    # Maintained by library.counts; read by the admin when LIBRARY_BOOK_COUNT_COLUMN is on
+    book_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
 
     def __str__(self):
         return self.name
 
-class Book(models.Model):
+class Book(UniqueSlugMixin, models.Model):
     """Book model with various relationships"""
     title = models.CharField(max_length=200)
     subtitle = models.CharField(max_length=200, blank=True)
@@ -66,6 +84,8 @@ class Book(models.Model):
     isbn = models.CharField('ISBN', max_length=20, unique=True)
     page_count = models.PositiveIntegerField(null=True, blank=True)
     cover = models.ImageField(upload_to='covers/', blank=True)
+    # sha256 of the cover once its thumbnails exist; see library.thumbnails
+    cover_digest = models.CharField(max_length=64, blank=True, editable=False)
     summary = models.TextField(blank=True)
 
     # One-to-Many relationship: One author can write many books
@@ -91,13 +111,19 @@ class Book(models.Model):
     class Meta:
         ordering = ['-publication_date', 'title']
 
+    slug_source = 'title'
+
     def __str__(self):
         return self.title
 
-    def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.title)
-        super().save(*args, **kwargs)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored author so a reassignment can refresh both authors
+        instance._loaded_author_id = instance.__dict__.get('author_id')
+        # and the stored cover so a new one drops the old digest
+        instance._loaded_cover = instance.__dict__.get('cover')
+        return instance
 
 class Publication(models.Model):
     """Intermediate model for Book-Publisher many-to-many relationship"""
@@ -109,5 +135,12 @@ class Publication(models.Model):
     class Meta:
         unique_together = ('book', 'publisher', 'edition')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored publisher so a change can recount both publishers
+        instance._loaded_publisher_id = instance.__dict__.get('publisher_id')
+        return instance
+
     def __str__(self):
         return f"{self.book.title} ({self.edition}ed.) by {self.publisher.name}"
\ No newline at end of file
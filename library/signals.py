@@ -0,0 +1,115 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache, counts, thumbnails
+from .models import Author, AuthorProfile, Book, Category, Publication, Publisher
+
+
+def _book_authors(book):
+    return {book.author_id, getattr(book, '_loaded_author_id', None)} - {None}
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    authors = _book_authors(instance)
+    if created or len(authors) > 1:
+        counts.refresh(Author, authors)
+    cache.invalidate_books([instance.pk], authors)
+    instance._loaded_author_id = instance.author_id
+
+
+@receiver(pre_delete, sender=Book)
+def remember_book_categories(sender, instance, **kwargs):
+    # The category links are gone by post_delete
+    instance._category_ids = list(instance.categories.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    counts.refresh(Author, [instance.author_id])
+    counts.refresh(Category, getattr(instance, '_category_ids', ()))
+    cache.invalidate_books([instance.pk], _book_authors(instance))
+
+
+@receiver(m2m_changed, sender=Book.categories.through)
+def book_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._category_ids = list(instance.categories.values_list('pk', flat=True))
+    if not action.startswith('post_'):
+        return
+
+    if reverse:
+        counts.refresh(Category, [instance.pk])
+    else:
+        counts.refresh(Category, pk_set if pk_set is not None else getattr(instance, '_category_ids', ()))
+
+    if reverse and not pk_set:
+        # A category's books were cleared; book entries embed the category version
+        cache.invalidate_categories()
+    else:
+        cache.invalidate_books(pk_set if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if not created:
+        # Cached books embed the author's name; other fields only reach author:<pk>
+        renamed = instance.name != getattr(instance, '_loaded_name', None)
+        cache.invalidate_authors([instance.pk], renamed=renamed)
+    instance._loaded_name = instance.name
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+    cache.invalidate_authors([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, raw=False, **kwargs):
+    if not raw:
+        cache.invalidate_categories()
+
+
+@receiver(post_save, sender=Publisher)
+@receiver(post_delete, sender=Publisher)
+def invalidate_publisher(sender, raw=False, **kwargs):
+    if not raw:
+        cache.invalidate_publishers()
+
+
+@receiver(post_save, sender=Publication)
+@receiver(post_delete, sender=Publication)
+def publication_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    counts.refresh(Publisher, {instance.publisher_id, getattr(instance, '_loaded_publisher_id', None)})
+    instance._loaded_publisher_id = instance.publisher_id
+    cache.invalidate_books([instance.book_id])
+
+
+@receiver(pre_save, sender=Book)
+@receiver(pre_save, sender=AuthorProfile)
+def reset_thumbnail_digest(sender, instance, raw=False, **kwargs):
+    image = instance.cover if sender is Book else instance.photo
+    loaded = getattr(instance, f'_loaded_{image.field.name}', None)
+    # A new upload, or another stored file, needs its own thumbnails
+    if not raw and (not image._committed or (loaded is not None and loaded != image.name)):
+        setattr(instance, f'{image.field.name}_digest', '')
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=AuthorProfile)
+def create_thumbnails(sender, instance, raw=False, **kwargs):
+    image = instance.cover if sender is Book else instance.photo
+    setattr(instance, f'_loaded_{image.field.name}', image.name)
+    if raw or not image or thumbnails.is_ready(image):
+        return
+    name = image.name
+    # The worker must not read the file before the row pointing at it is committed
+    transaction.on_commit(lambda: thumbnails.schedule(name))
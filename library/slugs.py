@@ -0,0 +1,133 @@
+"""
+Collision-free slugs for models with a unique ``slug`` field.
+
+A slug is the slugified text, or the text followed by ``-2``, ``-3``
+and so on when that is taken. The free suffix is found with one query
+per base slug, not one query per attempt. That query matches only the
+base and its numbered forms, so a short title such as "It" does not
+load every slug that merely starts with "it".
+SlugAllocator is the batch mode: it loads the taken slugs for many bases
+in a few queries and then allocates in memory. The bulk importer and the
+admin's "regenerate slugs" action both use it.
+"""
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+# Characters kept free after the prefix for a "-<n>" suffix
+SUFFIX_ROOM = 8
+
+# Base slugs per prefix query in batch mode
+PREFIX_CHUNK = 200
+
+
+def _max_length(model):
+    return model._meta.get_field('slug').max_length
+
+
+def base_slug(text, max_length):
+    return slugify(text)[:max_length].strip('-') or 'item'
+
+
+def _prefix(base, max_length):
+    # Every suffixed form of base starts with this, whatever the suffix length
+    return base[:max_length - SUFFIX_ROOM].rstrip('-') or base
+
+
+def _taken_condition(base, max_length):
+    """Q matching every stored slug that could collide with a candidate for base"""
+    if len(base) > max_length - SUFFIX_ROOM:
+        # Suffixed forms cut into the base; they share only the prefix
+        return Q(slug__startswith=_prefix(base, max_length))
+    numbered = Q(slug__startswith=f'{base}-', slug__regex=rf'^{re.escape(base)}-[0-9]+$')
+    return Q(slug=base) | numbered
+
+
+def _candidate(base, suffix, max_length):
+    if suffix == 1:
+        return base
+    tail = f'-{suffix}'
+    return base[:max_length - len(tail)].rstrip('-') + tail
+
+
+def unique_slug(model, text, exclude_pk=None):
+    """Free slug for text on model, found with a single query"""
+    max_length = _max_length(model)
+    base = base_slug(text, max_length)
+    taken = model._default_manager.filter(_taken_condition(base, max_length))
+    if exclude_pk is not None:
+        taken = taken.exclude(pk=exclude_pk)
+    taken = set(taken.values_list('slug', flat=True))
+    suffix = 1
+    while _candidate(base, suffix, max_length) in taken:
+        suffix += 1
+    return _candidate(base, suffix, max_length)
+
+
+class SlugAllocator:
+    """
+    Allocate many unique slugs for one model.
+
+    ``reserve(texts)`` loads the taken slugs for every new base with one
+    query per PREFIX_CHUNK bases. ``allocate(text)`` then works in memory
+    and remembers the last suffix per base, so a thousand titles like
+    "Poems" cost a thousand set lookups, not a million.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.max_length = _max_length(model)
+        self.taken = set()
+        self.loaded = set()
+        self.next_suffix = {}
+
+    def reserve(self, texts):
+        bases = {base_slug(text, self.max_length) for text in texts}
+        bases = sorted(bases - self.loaded)
+        for start in range(0, len(bases), PREFIX_CHUNK):
+            condition = Q()
+            for base in bases[start:start + PREFIX_CHUNK]:
+                condition |= _taken_condition(base, self.max_length)
+            self.taken.update(self.model._default_manager.filter(condition).values_list('slug', flat=True))
+        self.loaded.update(bases)
+
+    def allocate(self, text):
+        base = base_slug(text, self.max_length)
+        if base not in self.loaded:
+            self.reserve([text])
+        suffix = self.next_suffix.get(base, 1)
+        while _candidate(base, suffix, self.max_length) in self.taken:
+            suffix += 1
+        slug = _candidate(base, suffix, self.max_length)
+        self.next_suffix[base] = suffix
+        self.taken.add(slug)
+        return slug
+
+
+class UniqueSlugMixin:
+    """
+    Fill an empty ``slug`` from ``slug_source`` on save.
+
+    If a concurrent save takes the same slug first, a new one is
+    allocated and the insert retried (in a savepoint) a few times.
+    """
+    slug_source = 'name'
+    slug_attempts = 3
+
+    def save(self, *args, **kwargs):
+        if self.slug:
+            return super().save(*args, **kwargs)
+
+        model = type(self)
+        for attempt in range(self.slug_attempts):
+            self.slug = unique_slug(model, getattr(self, self.slug_source), exclude_pk=self.pk)
+            try:
+                with transaction.atomic(using=kwargs.get('using')):
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                taken = model._default_manager.filter(slug=self.slug).exclude(pk=self.pk).exists()
+                if not taken or attempt == self.slug_attempts - 1:
+                    self.slug = ''
+                    raise
@@ -1,7 +1,21 @@
-from django.test import TestCase
+import datetime
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
-from .models import Author, Book, Category, Publisher, Publication
+from PIL import Image
+from .models import Author, AuthorProfile, Book, Category, Publisher, Publication
+from . import cache as catalog_cache, importer, thumbnails
+from .slugs import SlugAllocator, unique_slug
 
 class AuthorModelTest(TestCase):
     """Test cases for the Author model"""
@@ -71,4 +85,421 @@ class AdminAccessTest(TestCase):
         models = ['author', 'book', 'category', 'publisher', 'publication']
         for model in models:
             response = self.client.get(reverse(f'admin:library_{model}_changelist'))
-            self.assertEqual(response.status_code, 200)
\ No newline at end of file
+            self.assertEqual(response.status_code, 200)
+class CatalogImportTest(TestCase):
+    """Test cases for the bulk catalog importer"""
+
+    def setUp(self):
+        """Create an existing author, category and book"""
+        self.author = Author.objects.create(name="Gabriel García Márquez")
+        self.category = Category.objects.create(name="Fiction")
+        Book.objects.create(title="Poems", author=self.author, isbn="9780000000001")
+
+    def test_csv_import_resolves_names_and_slugs(self):
+        """New names are created once, slugs stay unique, through rows are written"""
+        data = StringIO(
+            "title,isbn,author,categories,publisher,publication_date\n"
+            "Poems,9780000000002,Gabriel García Márquez,Fiction|Poetry,Sudamericana,1967\n"
+            "Poems,9780000000003,Pablo Neruda,Poetry,Losada,1924-06-01\n"
+            "Poems,9780000000001,Pablo Neruda,Poetry,,\n"
+            ",9780000000004,Nobody,,,\n"
+        )
+        result = importer.import_catalog(data, 'csv', batch_size=2)
+
+        self.assertEqual((result.created, result.skipped, result.failed), (2, 1, 1))
+        self.assertEqual((result.authors, result.categories, result.publishers), (1, 1, 2))
+        self.assertEqual(sorted(Book.objects.values_list('slug', flat=True)), ['poems', 'poems-2', 'poems-3'])
+        book = Book.objects.get(isbn="9780000000002")
+        self.assertEqual(book.author, self.author)
+        self.assertEqual(sorted(book.categories.values_list('name', flat=True)), ['Fiction', 'Poetry'])
+        self.assertEqual(Publication.objects.get(book=book).publication_date.year, 1967)
+        self.assertEqual(Author.objects.filter(name="Pablo Neruda").count(), 1)
+
+    def test_jsonl_and_marc_readers(self):
+        """JSON Lines and MARC text records import the same fields"""
+        jsonl = StringIO(
+            '{"title": "Ficciones", "isbn": "978-0-8021-3030-3", "author": "Jorge Luis Borges",'
+            ' "categories": ["Fiction"]}\n'
+            'not json\n'
+        )
+        result = importer.import_catalog(jsonl, 'jsonl')
+        self.assertEqual((result.created, result.failed), (1, 1))
+        self.assertTrue(Book.objects.filter(isbn="9780802130303", categories=self.category).exists())
+
+        marc = StringIO(
+            "=020  \\\\$a9788437604947\n"
+            "=100  1\\$aCortázar, Julio.\n"
+            "=245  10$aRayuela /$bnovela.\n"
+            "=260  \\\\$aBuenos Aires :$bSudamericana,$c1963.\n"
+            "=650  \\0$aFiction.\n"
+            "\n"
+        )
+        result = importer.import_catalog(marc, 'marc')
+        self.assertEqual(result.created, 1)
+        book = Book.objects.get(isbn="9788437604947")
+        self.assertEqual((book.title, book.subtitle, book.author.name), ("Rayuela", "novela", "Cortázar, Julio"))
+        self.assertEqual(book.publishers.get().name, "Sudamericana")
+
+    def test_slug_allocator_truncates_to_field_length(self):
+        """Suffixed slugs never exceed the slug column"""
+        allocator = SlugAllocator(Book)
+        title = "A Very Long Title " * 5
+        slugs = [allocator.allocate(title) for _ in range(12)]
+        self.assertEqual(len(set(slugs)), 12)
+        self.assertTrue(all(len(slug) <= 50 for slug in slugs))
+        self.assertTrue(slugs[11].endswith('-12'))
+
+
+class UniqueSlugTest(TestCase):
+    """Test cases for collision-free slug allocation"""
+
+    def setUp(self):
+        """Create an author and an admin user"""
+        self.author = Author.objects.create(name="Walt Whitman")
+        self.admin_user = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='adminpassword'
+        )
+
+    def test_same_title_gets_next_suffix_in_one_query(self):
+        """Editions of one title get -2, -3 from a single prefix query"""
+        Book.objects.create(title="Collected Works", author=self.author, isbn="9780000000010")
+        Book.objects.create(title="Collected Works", author=self.author, isbn="9780000000011")
+        with self.assertNumQueries(1):
+            slug = unique_slug(Book, "Collected Works")
+        self.assertEqual(slug, "collected-works-3")
+        self.assertEqual(Category.objects.create(name="Poetry").slug, "poetry")
+        self.assertEqual(Category.objects.create(name="Poetry").slug, "poetry-2")
+
+    def test_batch_reserve_uses_few_queries(self):
+        """reserve() loads many bases at once; allocate() then stays in memory"""
+        Book.objects.create(title="Poems", author=self.author, isbn="9780000000012")
+        allocator = SlugAllocator(Book)
+        titles = ["Poems"] * 500 + [f"Leaves {i}" for i in range(300)]
+        with self.assertNumQueries(2):
+            allocator.reserve(titles)
+            slugs = [allocator.allocate(title) for title in titles]
+        self.assertEqual(len(set(slugs)), 800)
+        self.assertEqual(slugs[499], "poems-501")
+
+    def test_short_titles_load_only_their_own_slugs(self):
+        """A short base loads itself and its numbered forms, not every slug it prefixes"""
+        for i, title in enumerate(["It", "It", "Italian Journeys", "It Ends with Us"]):
+            Book.objects.create(title=title, author=self.author, isbn=f"978000000003{i}")
+        allocator = SlugAllocator(Book)
+        allocator.reserve(["It"])
+        self.assertEqual(allocator.taken, {"it", "it-2"})
+        self.assertEqual(allocator.allocate("It"), "it-3")
+        self.assertEqual(unique_slug(Book, "It"), "it-3")
+
+        # Long bases still find suffixed forms that cut into the base
+        title = "A" * 60
+        first = Book.objects.create(title=title, author=self.author, isbn="9780000000040")
+        second = Book.objects.create(title=title, author=self.author, isbn="9780000000041")
+        self.assertNotEqual(first.slug, second.slug)
+        self.assertNotIn(unique_slug(Book, title), {first.slug, second.slug})
+
+    def test_admin_blank_slug_and_regenerate_action(self):
+        """The admin leaves slugs blank for the model and can regenerate them"""
+        self.client.login(username='admin', password='adminpassword')
+        category = Category.objects.create(name="Free Verse", slug="wrong")
+        response = self.client.post(reverse('admin:library_category_changelist'), {
+            'action': 'regenerate_slugs', '_selected_action': [category.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        category.refresh_from_db()
+        self.assertEqual(category.slug, "free-verse")
+
+        response = self.client.post(reverse('admin:library_category_add'), {'name': "Free Verse", 'slug': ''})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Category.objects.filter(slug="free-verse-2").exists())
+
+
+class CatalogCacheTest(TestCase):
+    """Test cases for the versioned catalog cache"""
+
+    def setUp(self):
+        """Start from an empty cache with one categorized book"""
+        caches['catalog'].clear()
+        self.author = Author.objects.create(name="Emily Dickinson")
+        self.category = Category.objects.create(name="Poetry")
+        self.book = Book.objects.create(title="Poems", author=self.author, isbn="9780000000020")
+        self.book.categories.add(self.category)
+
+    def test_book_is_cached_until_changed(self):
+        """A second read is a hit; saving the book or renaming its category invalidates it"""
+        self.assertEqual(catalog_cache.book(self.book.pk)['categories'][0]['name'], "Poetry")
+        with self.assertNumQueries(0):
+            catalog_cache.book(self.book.pk)
+
+        self.book.title = "Selected Poems"
+        self.book.save()
+        self.assertEqual(catalog_cache.book(self.book.pk)['title'], "Selected Poems")
+
+        self.category.name = "Verse"
+        self.category.save()
+        self.assertEqual(catalog_cache.book(self.book.pk)['categories'][0]['name'], "Verse")
+        self.assertIsNone(catalog_cache.book(0))
+
+    def test_counts_follow_books_and_categories(self):
+        """Author counts and the category list follow book and m2m changes"""
+        other = Author.objects.create(name="Sylvia Plath")
+        self.assertEqual(catalog_cache.author(self.author.pk)['book_count'], 1)
+        self.assertEqual(catalog_cache.categories()[0]['book_count'], 1)
+
+        book = Book.objects.get(pk=self.book.pk)
+        book.author = other
+        book.save()
+        self.assertEqual(catalog_cache.author(self.author.pk)['book_count'], 0)
+        self.assertEqual(catalog_cache.author(other.pk)['book_count'], 1)
+
+        self.category.books.clear()
+        self.assertEqual(catalog_cache.categories()[0]['book_count'], 0)
+
+    def test_author_edits_invalidate_only_what_changed(self):
+        """Saving an author without renaming keeps cached books; a rename reaches only their books"""
+        other = Author.objects.create(name="Sylvia Plath")
+        ariel = Book.objects.create(title="Ariel", author=other, isbn="9780000000021")
+        catalog_cache.book(self.book.pk)
+        catalog_cache.book(ariel.pk)
+
+        author = Author.objects.get(pk=self.author.pk)
+        author.birth_date = datetime.date(1830, 12, 10)
+        author.save()
+        with self.assertNumQueries(0):
+            catalog_cache.book(self.book.pk)
+        self.assertEqual(catalog_cache.author(self.author.pk)['birth_date'], datetime.date(1830, 12, 10))
+
+        author.name = "E. Dickinson"
+        author.save()
+        self.assertEqual(catalog_cache.book(self.book.pk)['author']['name'], "E. Dickinson")
+        with self.assertNumQueries(0):
+            catalog_cache.book(ariel.pk)
+
+    def test_catalog_views_read_through_cache(self):
+        """The book, category and author views are answered from the cache"""
+        User.objects.create_user(username='reader', password='readerpassword')
+        self.client.login(username='reader', password='readerpassword')
+        urls = [
+            reverse('library:book-detail', args=[self.book.pk]),
+            reverse('library:category-list'),
+            reverse('library:author-detail', args=[self.author.pk]),
+        ]
+        for url in urls:
+            self.client.get(url)
+        misses = dict(catalog_cache.misses)
+        responses = [self.client.get(url) for url in urls]
+        self.assertEqual(dict(catalog_cache.misses), misses)
+        self.assertEqual(responses[0].json()['title'], "Poems")
+        self.assertEqual(responses[1].json()['categories'][0]['name'], "Poetry")
+        self.assertEqual(responses[2].json()['book_count'], 1)
+        self.assertEqual(self.client.get(reverse('library:book-detail', args=[0])).status_code, 404)
+
+    def test_metrics_count_hits_and_misses(self):
+        """The metrics view reports hits and misses by kind"""
+        catalog_cache.categories()
+        catalog_cache.categories()
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpassword')
+        self.client.login(username='admin', password='adminpassword')
+        response = self.client.get(reverse('library:catalog-cache-metrics'))
+        self.assertContains(response, 'catalog_cache_requests_total{kind="categories",result="hit"}')
+        self.assertContains(response, 'catalog_cache_requests_total{kind="categories",result="miss"}')
+
+
+class BookAdminChangelistTest(TestCase):
+    """Test cases for the BookAdmin changelist query budget"""
+
+    def setUp(self):
+        """Create an admin user and a category"""
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpassword')
+        self.client.login(username='admin', password='adminpassword')
+        self.category = Category.objects.create(name="Essays")
+
+    def add_books(self, count, start=0):
+        for i in range(start, start + count):
+            author = Author.objects.create(name=f"Author {i}")
+            book = Book.objects.create(title=f"Essays {i}", author=author, isbn=f"97800000{i:05d}")
+            book.categories.add(self.category)
+
+    def changelist_queries(self, params=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('admin:library_book_changelist'), params or {})
+        self.assertEqual(response.status_code, 200)
+        return len(captured), response
+
+    def test_query_count_does_not_grow_with_rows_or_authors(self):
+        """Rows, authors and the author filter cost a fixed number of queries"""
+        self.add_books(3)
+        small, _ = self.changelist_queries()
+        self.add_books(30, start=3)
+        large, response = self.changelist_queries()
+        self.assertEqual(small, large)
+        self.assertNotContains(response, "Author 20</a>")
+
+    def test_author_filter_shows_selected_author(self):
+        """Filtering keeps the selected author in the autocomplete box"""
+        self.add_books(3)
+        author = Author.objects.get(name="Author 1")
+        _, response = self.changelist_queries({'author__id__exact': author.pk})
+        self.assertEqual(list(response.context['cl'].result_list), list(author.books.all()))
+        self.assertContains(response, f'<option value="{author.pk}" selected>Author 1</option>', html=True)
+
+
+class BookCountTest(TestCase):
+    """Test cases for annotated and denormalized book counts"""
+
+    def setUp(self):
+        """Create authors, a category and a publisher with a few books"""
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpassword')
+        self.client.login(username='admin', password='adminpassword')
+        self.author = Author.objects.create(name="Jorge Amado")
+        self.other = Author.objects.create(name="Clarice Lispector")
+        self.category = Category.objects.create(name="Brazilian Fiction")
+        self.publisher = Publisher.objects.create(name="Companhia das Letras")
+        self.books = []
+        for i in range(3):
+            book = Book.objects.create(title=f"Novel {i}", author=self.author, isbn=f"97800000300{i}")
+            book.categories.add(self.category)
+            Publication.objects.create(book=book, publisher=self.publisher, publication_date="1958-01-01")
+            self.books.append(book)
+        # A second edition of the same book counts once
+        Publication.objects.create(book=self.books[0], publisher=self.publisher,
+                                   publication_date="1970-01-01", edition=2)
+
+    def assertCounts(self, author, other, category, publisher):
+        for obj in (self.author, self.other, self.category, self.publisher):
+            obj.refresh_from_db()
+        self.assertEqual(
+            (self.author.book_count, self.other.book_count, self.category.book_count, self.publisher.book_count),
+            (author, other, category, publisher),
+        )
+
+    def test_columns_follow_signals(self):
+        """Saves, reassignments, m2m changes and deletes keep the columns exact"""
+        self.assertCounts(3, 0, 3, 3)
+
+        book = Book.objects.get(pk=self.books[1].pk)
+        book.author = self.other
+        book.save()
+        self.assertCounts(2, 1, 3, 3)
+
+        book.categories.clear()
+        self.assertCounts(2, 1, 2, 3)
+
+        Book.objects.get(pk=self.books[0].pk).delete()
+        self.assertCounts(1, 1, 1, 2)
+
+        self.category.books.clear()
+        self.assertCounts(1, 1, 0, 2)
+
+    def test_changelists_annotate_counts(self):
+        """Changelist queries do not grow with rows; counts and profiles are annotated"""
+        AuthorProfile.objects.create(author=self.author, biography="Bahia")
+        for model in ('author', 'category', 'publisher'):
+            url = reverse(f'admin:library_{model}_changelist')
+            with CaptureQueriesContext(connection) as small:
+                self.client.get(url)
+            Author.objects.create(name=f"Extra {model}")
+            Category.objects.create(name=f"Extra {model}")
+            Publisher.objects.create(name=f"Extra {model}")
+            with CaptureQueriesContext(connection) as large:
+                response = self.client.get(url, {'o': '3'})
+            self.assertEqual(len(small), len(large), model)
+            self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(reverse('admin:library_author_changelist'))
+        author = next(row for row in response.context['cl'].result_list if row.pk == self.author.pk)
+        self.assertEqual((author.num_books, author.profile_exists), (3, True))
+
+    def test_column_setting_reads_denormalized_count(self):
+        """With LIBRARY_BOOK_COUNT_COLUMN the admin reads book_count"""
+        Author.objects.filter(pk=self.author.pk).update(book_count=42)
+        with self.settings(LIBRARY_BOOK_COUNT_COLUMN=True):
+            response = self.client.get(reverse('admin:library_author_changelist'))
+        self.assertContains(response, "42 books")
+        call_command('rebuild_book_counts', stdout=StringIO())
+        self.assertCounts(3, 0, 3, 3)
+
+
+@override_settings(THUMBNAILS={'WORKERS': 0})
+class ThumbnailTest(TestCase):
+    """Test cases for cover and photo thumbnails"""
+
+    def setUp(self):
+        """Use a throwaway media directory and log in"""
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.author = Author.objects.create(name="Cecília Meireles")
+        User.objects.create_user(username='lector', password='lectorpassword')
+        self.client.login(username='lector', password='lectorpassword')
+
+    def upload(self, name, size=(800, 1200), mode='RGB'):
+        out = BytesIO()
+        Image.new(mode, size, 'navy').save(out, format='PNG')
+        return SimpleUploadedFile(name, out.getvalue(), content_type='image/png')
+
+    def test_variants_created_on_save_and_shared_by_content(self):
+        """Saving a cover writes every variant; identical uploads share them"""
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(title="Viagem", author=self.author, isbn="9780000004001",
+                                       cover=self.upload('viagem.png'))
+        book.refresh_from_db()
+        url = thumbnails.thumbnail_url(book.cover, 'small', 'jpeg')
+        self.assertTrue(url.startswith('/media/thumbnails/'))
+        with default_storage.open(url.removeprefix('/media/')) as f:
+            self.assertEqual(Image.open(f).size, (43, 64))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Book.objects.create(title="Mar Absoluto", author=self.author, isbn="9780000004002",
+                                        cover=self.upload('mar.png'))
+        other.refresh_from_db()
+        self.assertNotEqual(book.cover.name, other.cover.name)
+        self.assertEqual(thumbnails.thumbnail_url(other.cover, 'small', 'jpeg'), url)
+        self.assertEqual(len(default_storage.listdir(url.removeprefix('/media/').rsplit('/', 1)[0])[1]), 6)
+
+        # Ready variants are served from the stored digest without rehashing the file
+        with mock.patch.object(thumbnails, 'file_digest', side_effect=AssertionError("rehashed")):
+            response = self.client.get(reverse('library:thumbnail', args=['large', 'webp', book.cover.name]))
+        self.assertRedirects(response, thumbnails.thumbnail_url(book.cover, 'large'), fetch_redirect_response=False)
+
+        # A new cover drops the digest of the old one
+        book.cover = self.upload('otra.png', size=(300, 300))
+        book.save()
+        self.assertFalse(thumbnails.is_ready(book.cover))
+        self.assertFalse(Book.objects.filter(pk=book.pk).exclude(cover_digest='').exists())
+
+    def test_view_generates_on_demand(self):
+        """Images saved without thumbnails get them from the view"""
+        profile = AuthorProfile.objects.create(author=self.author, photo=self.upload('cecilia.png', mode='RGBA'))
+        self.assertFalse(thumbnails.is_ready(profile.photo))
+        self.assertIn('/library/thumbnails/', thumbnails.thumbnail_url(profile.photo, 'medium'))
+
+        response = self.client.get(reverse('library:thumbnail', args=['medium', 'webp', profile.photo.name]))
+        self.assertEqual(response.status_code, 302)
+        profile.refresh_from_db()
+        self.assertTrue(thumbnails.is_ready(profile.photo))
+        self.assertEqual(response['Location'], thumbnails.thumbnail_url(profile.photo, 'medium'))
+
+        for args in (['huge', 'webp', profile.photo.name], ['small', 'gif', profile.photo.name],
+                     ['small', 'webp', 'authors/../../settings.py']):
+            self.assertEqual(self.client.get(reverse('library:thumbnail', args=args)).status_code, 404)
+        with self.assertLogs('library.thumbnails', 'WARNING'):
+            response = self.client.get(reverse('library:thumbnail', args=['small', 'webp', 'authors/missing.png']))
+        self.assertEqual(response.status_code, 404)
+
+        self.client.logout()
+        response = self.client.get(reverse('library:thumbnail', args=['medium', 'webp', profile.photo.name]))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/login/', response['Location'])
+
+    def test_command_reports_unreadable_images(self):
+        """generate_thumbnails fills in old uploads and counts broken files"""
+        Book.objects.create(title="Ou Isto ou Aquilo", author=self.author, isbn="9780000004003",
+                            cover=self.upload('isto.png'))
+        Book.objects.create(title="Romanceiro", author=self.author, isbn="9780000004004",
+                            cover=SimpleUploadedFile('broken.png', b'not an image'))
+        stdout, stderr = StringIO(), StringIO()
+        with self.assertLogs('library.thumbnails', 'WARNING'):
+            call_command('generate_thumbnails', stdout=stdout, stderr=stderr)
+        self.assertIn("1 of 2 images", stdout.getvalue())
+        self.assertIn("1 images could not be read", stderr.getvalue())
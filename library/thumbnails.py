@@ -0,0 +1,229 @@
+"""
+Resized variants of uploaded images (Book.cover, AuthorProfile.photo).
+
+Each original is hashed, and its variants are stored next to the other
+media as ``thumbnails/<aa>/<digest>-<size>.<format>``. Two uploads with
+the same bytes therefore share their thumbnails, and a variant never
+changes once written, so it can be served with a long cache lifetime.
+
+Variants are generated in a thread pool when an image is saved (Pillow
+releases the GIL while decoding, resizing and encoding). The
+``generate_thumbnails`` command does the same for images uploaded before.
+Once every variant of a file exists, its digest is stored on the rows
+using it (Book.cover_digest, AuthorProfile.photo_digest), so
+``thumbnail_url()`` reads it from the instance with no cache or file
+system access, in every process. Until then it points at the
+``library:thumbnail`` view, which generates the variants on demand.
+
+Configured through the THUMBNAILS setting::
+
+    THUMBNAILS = {
+        'SIZES': {'small': 64, 'medium': 150, 'large': 400},  # bounding box in px
+        'FORMATS': ('webp', 'jpeg'),   # the first one is preferred
+        'QUALITY': 80,
+        'WORKERS': 2,                  # 0 generates in the saving thread
+    }
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import AuthorProfile, Book
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SIZES': {'small': 64, 'medium': 150, 'large': 400},
+    'FORMATS': ('webp', 'jpeg'),
+    'QUALITY': 80,
+    'WORKERS': 2,
+}
+
+ROOT = 'thumbnails'
+
+# Upload directory -> model and image field; the view only reads files below them
+SOURCES = {
+    'covers/': (Book, 'cover'),
+    'authors/': (AuthorProfile, 'photo'),
+}
+SOURCE_DIRS = tuple(SOURCES)
+
+CONTENT_TYPES = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'THUMBNAILS', {})}
+
+
+def _source(name):
+    """Model and image field of an uploaded file name"""
+    return next(source for directory, source in SOURCES.items() if name.startswith(directory))
+
+
+def stored_digest(name):
+    """Digest recorded for an uploaded file whose variants exist, or None"""
+    model, field = _source(name)
+    return model.objects.filter(**{field: name}).exclude(**{f'{field}_digest': ''}).values_list(
+        f'{field}_digest', flat=True
+    ).first()
+
+
+def store_digest(name, digest):
+    """Record on the rows using ``name`` that its variants exist"""
+    model, field = _source(name)
+    model.objects.filter(**{field: name}).exclude(**{f'{field}_digest': digest}).update(
+        **{f'{field}_digest': digest}
+    )
+
+
+def file_digest(name):
+    """sha256 of a stored file, read in chunks"""
+    sha = hashlib.sha256()
+    with default_storage.open(name, 'rb') as f:
+        for chunk in f.chunks():
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def variant_name(digest, size, fmt):
+    return f'{ROOT}/{digest[:2]}/{digest}-{size}.{fmt}'
+
+
+def _render(image, box, fmt, quality):
+    variant = image.copy()
+    variant.thumbnail((box, box), Image.Resampling.LANCZOS)
+    if fmt == 'jpeg' and variant.mode != 'RGB':
+        # JPEG has no alpha channel; flatten transparent images onto white
+        background = Image.new('RGB', variant.size, 'white')
+        rgba = variant.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        variant = background
+    out = BytesIO()
+    variant.save(out, format=fmt.upper(), quality=quality, **({'method': 4} if fmt == 'webp' else {}))
+    return out.getvalue()
+
+
+def create_variants(name):
+    """
+    Write every missing variant of the stored file ``name``, without
+    touching the database.
+
+    Returns the file's digest, or None if it is missing or not an image.
+    """
+    opts = options()
+    try:
+        digest = file_digest(name)
+        missing = [
+            (size, box, fmt)
+            for size, box in opts['SIZES'].items()
+            for fmt in opts['FORMATS']
+            if not default_storage.exists(variant_name(digest, size, fmt))
+        ]
+        if missing:
+            with default_storage.open(name, 'rb') as f:
+                image = Image.open(f)
+                # Decode at a reduced scale when the format allows it (JPEG)
+                image.draft('RGB', (max(box for _, box, _ in missing),) * 2)
+                image = ImageOps.exif_transpose(image)
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+                for size, box, fmt in missing:
+                    data = _render(image, box, fmt, opts['QUALITY'])
+                    target = variant_name(digest, size, fmt)
+                    saved = default_storage.save(target, ContentFile(data))
+                    if saved != target:
+                        # Another worker wrote the same variant first; keep theirs
+                        default_storage.delete(saved)
+    except (OSError, UnidentifiedImageError) as e:
+        # Missing files surface as OSError, broken images as UnidentifiedImageError
+        logger.warning("Cannot create thumbnails for %s: %s", name, e)
+        return None
+    return digest
+
+
+def generate(name):
+    """create_variants() and record the digest; returns it, or None"""
+    digest = create_variants(name)
+    if digest is not None:
+        store_digest(name, digest)
+    return digest
+
+
+def _generate_in_worker(name):
+    try:
+        return generate(name)
+    finally:
+        # Pool threads outlive the request; do not leave their connection open
+        connection.close()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=options()['WORKERS'], thread_name_prefix='thumbnails')
+        return _executor
+
+
+def schedule(name):
+    """Generate the variants of ``name`` in the pool, or inline without workers"""
+    if not options()['WORKERS']:
+        generate(name)
+        return None
+    return _get_executor().submit(_generate_in_worker, name)
+
+
+def _digest(file):
+    return getattr(file.instance, f'{file.field.name}_digest', '')
+
+
+def is_ready(file):
+    """Whether the variants of the FieldFile ``file`` are known to exist"""
+    return bool(file) and bool(_digest(file))
+
+
+def thumbnail_url(file, size, fmt=None):
+    """
+    URL of a variant of the FieldFile ``file``, or '' for an empty field.
+
+    Points at the stored variant when it is known to exist, otherwise at
+    the view that generates it.
+    """
+    if not file:
+        return ''
+    fmt = fmt or options()['FORMATS'][0]
+    digest = _digest(file)
+    if digest:
+        return default_storage.url(variant_name(digest, size, fmt))
+    return reverse('library:thumbnail', args=[size, fmt, file.name])
+
+
+def picture(file, size, alt=''):
+    """``<picture>`` offering each configured format, the last one as fallback"""
+    if not file:
+        return ''
+    *preferred, fallback = options()['FORMATS']
+    sources = format_html_join(
+        '', '<source srcset="{}" type="{}">',
+        ((thumbnail_url(file, size, fmt), CONTENT_TYPES[fmt]) for fmt in preferred),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" alt="{}" loading="lazy"></picture>',
+        sources, thumbnail_url(file, size, fallback), alt,
+    )
@@ -0,0 +1,12 @@
+from django.urls import path
+from . import views
+
+app_name = 'library'
+
+urlpatterns = [
+    path('books/<int:pk>/', views.book_detail, name='book-detail'),
+    path('categories/', views.category_list, name='category-list'),
+    path('authors/<int:pk>/', views.author_detail, name='author-detail'),
+    path('metrics/catalog-cache/', views.catalog_cache_metrics, name='catalog-cache-metrics'),
+    path('thumbnails/<str:size>/<str:fmt>/<path:name>', views.thumbnail, name='thumbnail'),
+]
@@ -1,3 +1,53 @@
-from django.shortcuts import render
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.views.decorators.cache import cache_control
 
-# Create your views here.
+from . import cache, thumbnails
+
+
+@login_required
+def book_detail(request, pk):
+    """A book with its author, categories and publications, from the catalog cache"""
+    book = cache.book(pk)
+    if book is None:
+        raise Http404("Book not found")
+    return JsonResponse(book)
+
+
+@login_required
+def category_list(request):
+    """Every category with its book count, from the catalog cache"""
+    return JsonResponse({'categories': cache.categories()})
+
+
+@login_required
+def author_detail(request, pk):
+    """An author with their book count, from the catalog cache"""
+    author = cache.author(pk)
+    if author is None:
+        raise Http404("Author not found")
+    return JsonResponse(author)
+
+
+@staff_member_required
+def catalog_cache_metrics(request):
+    """Catalog cache hit and miss counters for Prometheus"""
+    return HttpResponse(cache.metrics(), content_type='text/plain; version=0.0.4')
+
+
+@login_required
+@cache_control(private=True, max_age=60 * 60 * 24)
+def thumbnail(request, size, fmt, name):
+    """Generate the variants of an uploaded image if needed and redirect to one"""
+    opts = thumbnails.options()
+    if size not in opts['SIZES'] or fmt not in opts['FORMATS']:
+        raise Http404("Unknown thumbnail size or format")
+    if not name.startswith(thumbnails.SOURCE_DIRS) or '..' in name.split('/'):
+        raise Http404("Not an uploaded image")
+    # Only hash the file when its variants are not recorded as ready yet
+    digest = thumbnails.stored_digest(name) or thumbnails.generate(name)
+    if digest is None:
+        raise Http404("Image not found")
+    return HttpResponseRedirect(default_storage.url(thumbnails.variant_name(digest, size, fmt)))
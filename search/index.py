@@ -0,0 +1,193 @@
+"""
+Full-text search over books and members backed by SQLite FTS5.
+
+Two FTS5 tables mirror the searchable text of Book (with its author's name)
+and Member (with its user's names and email), keyed by the source row's id.
+Signals in search.signals keep them current; rebuild_search_index reloads
+them from scratch. On databases without FTS5 every helper reports the index
+as unavailable and callers fall back to their ``icontains`` filters.
+"""
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+BOOK_TABLE = 'search_book_fts'
+MEMBER_TABLE = 'search_member_fts'
+
+BOOK_COLUMNS = ('title', 'subtitle', 'isbn', 'author_name')
+MEMBER_COLUMNS = ('username', 'first_name', 'last_name', 'email')
+
+# Matches ranked by relevance in search_filter; later matches are still
+# returned, after these, in the queryset's own order
+RESULT_LIMIT = 500
+
+# Annotation holding a row's position in the ranking
+RANK = 'search_rank'
+
+_available = {}
+
+
+def is_available(using=DEFAULT_DB_ALIAS):
+    """Whether the FTS tables exist on this database"""
+    if using not in _available:
+        connection = connections[using]
+        _available[using] = (
+            connection.vendor == 'sqlite'
+            and BOOK_TABLE in connection.introspection.table_names()
+        )
+    return _available[using]
+
+
+def build_match(query):
+    """Turn free text into an FTS5 query: every word must match as a prefix"""
+    terms = []
+    for word in query.split():
+        word = word.replace('"', '""')
+        terms.append(f'"{word}"*')
+    return ' '.join(terms)
+
+
+def _match(table, query, limit, using):
+    match = build_match(query)
+    if not match:
+        return []
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY rank LIMIT %s',
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _match_subquery(table, match):
+    """Every rowid matching an FTS5 query, for use in an ``__in`` lookup"""
+    return RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [match])
+
+
+def match_books(query, limit=RESULT_LIMIT, using=DEFAULT_DB_ALIAS):
+    """Ids of books matching query, best first"""
+    return _match(BOOK_TABLE, query, limit, using)
+
+
+def match_members(query, limit=RESULT_LIMIT, using=DEFAULT_DB_ALIAS):
+    """Ids of members matching query, best first"""
+    return _match(MEMBER_TABLE, query, limit, using)
+
+
+def rank_by(field, ids):
+    """Expression giving each row its position in ids (None if absent)"""
+    return Case(
+        *[When(**{field: pk}, then=Value(position)) for position, pk in enumerate(ids)],
+        default=None,
+        output_field=IntegerField(),
+    )
+
+
+def search_filter(queryset, query, fallback, books=None, members=None, also=None):
+    """
+    Restrict queryset to rows whose book or member matches query, best first.
+
+    Every match is kept: the best RESULT_LIMIT come first by relevance and
+    the rest follow in the queryset's ordering. The position is annotated
+    as RANK.
+
+    ``books`` and ``members`` are lookup paths from the queryset's model to
+    the Book and Member primary keys. ``also`` is an extra condition ORed
+    in (for exact identifiers the index does not hold). Without FTS5 the
+    queryset is filtered with ``fallback`` instead.
+    """
+    if not is_available(queryset.db):
+        return queryset.filter(fallback)
+
+    condition = also or Q()
+    ranks = []
+    match = build_match(query)
+    for path, table in ((books, BOOK_TABLE), (members, MEMBER_TABLE)):
+        if path is None:
+            continue
+        if not match:
+            condition |= Q(**{f'{path}__in': []})
+            continue
+        # Filter on every match; only the best RESULT_LIMIT are ranked
+        condition |= Q(**{f'{path}__in': _match_subquery(table, match)})
+        ids = _match(table, query, RESULT_LIMIT, queryset.db)
+        if ids:
+            ranks.append(rank_by(path, ids))
+
+    queryset = queryset.filter(condition)
+    if not ranks:
+        return queryset
+    # Unranked matches share the last position, so the rank is never NULL
+    # and can lead a cursor key (see rank_ordering)
+    ordering = queryset.query.order_by or queryset.model._meta.ordering
+    queryset = queryset.annotate(**{
+        RANK: Coalesce(*ranks, Value(RESULT_LIMIT), output_field=IntegerField()),
+    })
+    return queryset.order_by(RANK, *ordering)
+
+
+def rank_ordering(queryset, ordering):
+    """ordering led by the search rank when search_filter ranked queryset"""
+    if RANK in queryset.query.annotations:
+        return (RANK, *ordering)
+    return tuple(ordering)
+
+
+def _replace(table, columns, rows, using):
+    """Insert or overwrite index rows given as (id, *column values)"""
+    rows = list(rows)
+    if not rows or not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {table} WHERE rowid = %s', [(row[0],) for row in rows])
+        placeholders = ', '.join(['%s'] * (len(columns) + 1))
+        cursor.executemany(
+            f'INSERT INTO {table} (rowid, {", ".join(columns)}) VALUES ({placeholders})',
+            [tuple('' if value is None else value for value in row) for row in rows],
+        )
+
+
+def _remove(table, ids, using):
+    ids = list(ids)
+    if not ids or not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {table} WHERE rowid = %s', [(pk,) for pk in ids])
+
+
+def book_rows(queryset):
+    return queryset.values_list('pk', 'title', 'subtitle', 'isbn', 'author__name')
+
+
+def member_rows(queryset):
+    return queryset.values_list(
+        'pk', 'user__username', 'user__first_name', 'user__last_name', 'user__email'
+    )
+
+
+def index_books(queryset):
+    """(Re)index the books in queryset"""
+    _replace(BOOK_TABLE, BOOK_COLUMNS, book_rows(queryset).iterator(), queryset.db)
+
+
+def index_members(queryset):
+    """(Re)index the members in queryset"""
+    _replace(MEMBER_TABLE, MEMBER_COLUMNS, member_rows(queryset).iterator(), queryset.db)
+
+
+def remove_books(ids, using=DEFAULT_DB_ALIAS):
+    _remove(BOOK_TABLE, ids, using)
+
+
+def remove_members(ids, using=DEFAULT_DB_ALIAS):
+    _remove(MEMBER_TABLE, ids, using)
+
+
+def clear(using=DEFAULT_DB_ALIAS):
+    """Empty both FTS tables"""
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {BOOK_TABLE}')
+        cursor.execute(f'DELETE FROM {MEMBER_TABLE}')
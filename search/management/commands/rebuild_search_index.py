@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from circulation.models import Member
+from library.models import Book
+from search import index
+
+
+class Command(BaseCommand):
+    help = "Reload the full-text search tables from the Book and Member rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help="Number of rows indexed per statement batch",
+        )
+
+    def handle(self, *args, **options):
+        if not index.is_available():
+            raise CommandError("Full-text search is not available on this database")
+        chunk_size = options['chunk_size']
+
+        with transaction.atomic():
+            index.clear()
+            books = self.reindex(Book.objects.order_by('pk'), index.index_books, chunk_size)
+            members = self.reindex(Member.objects.order_by('pk'), index.index_members, chunk_size)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {books} books and {members} members"))
+
+    def reindex(self, queryset, indexer, chunk_size):
+        """Index queryset in primary-key chunks so memory stays flat"""
+        total = 0
+        last_pk = 0
+        while True:
+            ids = list(queryset.filter(pk__gt=last_pk).values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                return total
+            indexer(queryset.filter(pk__in=ids))
+            total += len(ids)
+            last_pk = ids[-1]
@@ -0,0 +1,54 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+def create_fts_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE search_book_fts USING fts5("
+                "title, subtitle, isbn, author_name, tokenize='unicode61 remove_diacritics 2')"
+            )
+        except OperationalError:
+            # SQLite built without FTS5; search falls back to icontains
+            return
+        cursor.execute(
+            "CREATE VIRTUAL TABLE search_member_fts USING fts5("
+            "username, first_name, last_name, email, tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            "INSERT INTO search_book_fts (rowid, title, subtitle, isbn, author_name) "
+            "SELECT b.id, b.title, b.subtitle, b.isbn, a.name "
+            "FROM library_book b JOIN library_author a ON a.id = b.author_id"
+        )
+        cursor.execute(
+            "INSERT INTO search_member_fts (rowid, username, first_name, last_name, email) "
+            "SELECT m.id, u.username, u.first_name, u.last_name, u.email "
+            "FROM circulation_member m JOIN auth_user u ON u.id = m.user_id"
+        )
+
+
+def drop_fts_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS search_book_fts")
+        cursor.execute("DROP TABLE IF EXISTS search_member_fts")
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('library', '0001_initial'),
+        ('circulation', '0003_reservation_allocated_copy'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_tables, drop_fts_tables),
+    ]
@@ -0,0 +1,25 @@
+from search import index
+
+
+class FullTextSearchMixin:
+    """
+    ModelAdmin mixin that answers the changelist search box from the FTS
+    index instead of OR-ed ``icontains`` lookups across joins.
+
+    Set ``search_book_path``/``search_member_path`` to the lookup from the
+    admin's model to Book/Member. ``search_fields`` is still used when the
+    index is unavailable.
+    """
+    search_book_path = None
+    search_member_path = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not index.is_available(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+
+        queryset = index.search_filter(
+            queryset, search_term, fallback=None,
+            books=self.search_book_path,
+            members=self.search_member_path,
+        )
+        return queryset, False
@@ -0,0 +1,42 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from circulation.models import Member
+from library.models import Author, Book
+from . import index
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        index.index_books(Book.objects.using(using).filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, using=None, **kwargs):
+    index.remove_books([instance.pk], using=using)
+
+
+@receiver(post_save, sender=Author)
+def reindex_author_books(sender, instance, created, raw=False, using=None, **kwargs):
+    # A new author has no books yet; a rename changes every book's document
+    if not raw and not created:
+        index.index_books(Book.objects.using(using).filter(author=instance))
+
+
+@receiver(post_save, sender=Member)
+def index_member(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        index.index_members(Member.objects.using(using).filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Member)
+def unindex_member(sender, instance, using=None, **kwargs):
+    index.remove_members([instance.pk], using=using)
+
+
+@receiver(post_save, sender=User)
+def reindex_user_member(sender, instance, created, raw=False, using=None, **kwargs):
+    if not raw and not created:
+        index.index_members(Member.objects.using(using).filter(user=instance))
@@ -0,0 +1,69 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+from circulation.models import Member
+from library.models import Author, Book
+from . import index
+
+
+class FullTextIndexTest(TestCase):
+    """Test cases for the FTS5 book and member index"""
+
+    def setUp(self):
+        """Create two books and a member"""
+        self.author = Author.objects.create(name="Gabriel García Márquez")
+        self.solitude = Book.objects.create(title="One Hundred Years of Solitude",
+                                            author=self.author, isbn="9780060883287")
+        self.cholera = Book.objects.create(title="Love in the Time of Cholera",
+                                           author=self.author, isbn="9780307389732")
+        self.user = User.objects.create_user(username='amaranta', first_name='Amaranta',
+                                             last_name='Buendía', password='amarantapassword')
+        self.member = Member.objects.create(user=self.user)
+
+    def test_index_is_available_on_sqlite(self):
+        """Test the migration created the FTS tables"""
+        self.assertTrue(index.is_available())
+
+    def test_book_matches_by_prefix_and_author(self):
+        """Test title prefixes and accent-insensitive author names match"""
+        self.assertEqual(index.match_books("solit"), [self.solitude.pk])
+        self.assertCountEqual(index.match_books("garcia marquez"),
+                              [self.solitude.pk, self.cholera.pk])
+
+    def test_signals_follow_renames_and_deletes(self):
+        """Test author, user and book changes reach the index"""
+        self.author.name = "Gabo"
+        self.author.save()
+        self.assertCountEqual(index.match_books("gabo"), [self.solitude.pk, self.cholera.pk])
+
+        self.user.last_name = "Úrsula"
+        self.user.save()
+        self.assertEqual(index.match_members("ursula"), [self.member.pk])
+
+        self.cholera.delete()
+        self.assertEqual(index.match_books("cholera"), [])
+
+    def test_search_filter_ranks_member_queryset(self):
+        """Test search_filter restricts a queryset to matches"""
+        other = Member.objects.create(user=User.objects.create_user(username='remedios'))
+        members = index.search_filter(Member.objects.all(), "buendia", fallback=None, members='pk')
+        self.assertEqual(list(members), [self.member])
+        self.assertNotIn(other, members)
+
+    def test_search_filter_keeps_matches_past_ranking_limit(self):
+        """Test matches beyond RESULT_LIMIT are returned after the ranked ones"""
+        buendias = [
+            Member.objects.create(user=User.objects.create_user(username=f'aureliano{i}', last_name='Buendía'))
+            for i in range(3)
+        ]
+        with mock.patch.object(index, 'RESULT_LIMIT', 2):
+            members = list(index.search_filter(Member.objects.order_by('pk'), "buendia",
+                                               fallback=None, members='pk'))
+        self.assertCountEqual(members, [self.member, *buendias])
+        self.assertEqual(members[2:], sorted(members[2:], key=lambda member: member.pk))
+
+    def test_quotes_in_query_are_escaped(self):
+        """Test user input cannot break the MATCH syntax"""
+        self.assertEqual(index.match_books('"solitude'), [self.solitude.pk])
+        self.assertEqual(index.match_books('AND OR "'), [])